@@ -0,0 +1,189 @@
+import collections
+from functools import partial
+import os
+import threading
+from time import perf_counter
+from urllib.parse import parse_qs, urlsplit
+
+from django.apps import apps
+from django.conf import settings
+from mtp_common.auth import update_token_in_session, urljoin
+from mtp_common.auth.api_client import MoJOAuth2Session, get_request_token_url
+from mtp_common.auth.exceptions import Unauthorized
+from prometheus_client import Counter, Histogram
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from mtp_noms_ops.api_metrics import instrument_session
+
+api_connection_checkouts = Counter(
+    'mtp_api_connection_checkouts', 'Connections to mtp-api taken from the pool and whether they were already open',
+    labelnames=('host', 'reused', 'pid'),
+)
+api_connections_opened = Counter(
+    'mtp_api_connections_opened', 'New connections opened to mtp-api',
+    labelnames=('host', 'pid'),
+)
+api_connection_wait = Histogram(
+    'mtp_api_connection_wait', 'Time spent waiting for a connection to mtp-api from the pool',
+    labelnames=('host', 'pid'),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf')),
+)
+try:
+    app = apps.get_app_config('metrics')
+    app.register_collector(api_connection_checkouts)
+    app.register_collector(api_connections_opened)
+    app.register_collector(api_connection_wait)
+except LookupError:
+    pass
+
+
+class ApiConnectionMixin:
+    def connect(self):
+        api_connections_opened.labels(host=self.host, pid=str(os.getpid())).inc()
+        super().connect()
+
+
+class ApiHTTPConnection(ApiConnectionMixin, HTTPConnection):
+    pass
+
+
+class ApiHTTPSConnection(ApiConnectionMixin, HTTPSConnection):
+    pass
+
+
+class ApiConnectionPoolMixin:
+    def _get_conn(self, timeout=None):
+        started = perf_counter()
+        conn = super()._get_conn(timeout=timeout)
+        pid = str(os.getpid())
+        api_connection_wait.labels(host=self.host, pid=pid).observe(perf_counter() - started)
+        api_connection_checkouts.labels(
+            host=self.host, reused=str(conn.sock is not None).lower(), pid=pid,
+        ).inc()
+        return conn
+
+
+class ApiHTTPConnectionPool(ApiConnectionPoolMixin, HTTPConnectionPool):
+    ConnectionCls = ApiHTTPConnection
+
+
+class ApiHTTPSConnectionPool(ApiConnectionPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = ApiHTTPSConnection
+
+
+class ApiHTTPAdapter(HTTPAdapter):
+    """
+    Transport to mtp-api shared by all API sessions in a process so that kept-alive connections are reused
+    between requests rather than set up for each one.
+    Idempotent requests are retried if connecting or reading fails; error responses are not retried.
+    """
+
+    def __init__(self):
+        retries = settings.API_REQUEST_RETRIES
+        super().__init__(
+            pool_maxsize=settings.API_CONNECTION_POOL_SIZE,
+            pool_block=settings.API_CONNECTION_POOL_BLOCK,
+            max_retries=Retry(
+                total=retries, connect=retries, read=retries, status=0, redirect=0,
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, backoff_factor=0.1,
+                raise_on_status=False,
+            ),
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': ApiHTTPConnectionPool,
+            'https': ApiHTTPSConnectionPool,
+        }
+
+    def close(self):
+        # sessions using the shared transport must not close its connections
+        pass
+
+
+_api_adapter = None
+_api_adapter_lock = threading.Lock()
+
+
+def get_api_adapter():
+    global _api_adapter
+
+    with _api_adapter_lock:
+        if _api_adapter is None:
+            _api_adapter = ApiHTTPAdapter()
+        return _api_adapter
+
+
+class RequestApiSession(MoJOAuth2Session):
+    """
+    API session shared by everything handling one request.
+    Responses to identical GET requests are remembered for the life of the session
+    and forgotten whenever any other method is used in case it changed something.
+    Only the most recent settings.API_SESSION_MEMO_SIZE responses are kept and pages of lists,
+    requested with `offset` or `limit`, are not remembered as they are rarely requested again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memo = collections.OrderedDict()
+        self.mount(settings.API_URL.rstrip('/') + '/', get_api_adapter())
+        instrument_session(self, 'api')
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        if self.base_url and not urlsplit(url).scheme:
+            url = urljoin(self.base_url, url)
+        if method.upper() != 'GET' or kwargs.get('stream'):
+            self.memo.clear()
+            return super().request(method, url, data=data, headers=headers, **kwargs)
+
+        prepared_url = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+        if {'offset', 'limit'}.intersection(parse_qs(urlsplit(prepared_url).query)):
+            return super().request(method, url, data=data, headers=headers, **kwargs)
+
+        memo_key = (prepared_url, tuple(sorted((headers or {}).items())))
+        response = self.memo.get(memo_key)
+        if response is None:
+            response = super().request(method, url, data=data, headers=headers, **kwargs)
+            self.memo[memo_key] = response
+            while len(self.memo) > settings.API_SESSION_MEMO_SIZE:
+                self.memo.popitem(last=False)
+        else:
+            self.memo.move_to_end(memo_key)
+        return response
+
+
+def save_token(token, request):
+    request.user.token = token
+    update_token_in_session(request.session, token)
+
+
+def create_api_session(request):
+    user = request.user
+    if not user:
+        raise Unauthorized('no such user')
+    return RequestApiSession(
+        settings.API_CLIENT_ID,
+        token=user.token,
+        auto_refresh_url=get_request_token_url(),
+        auto_refresh_kwargs={
+            'client_id': settings.API_CLIENT_ID,
+            'client_secret': settings.API_CLIENT_SECRET,
+        },
+        token_updater=partial(save_token, request=request),
+    )
+
+
+def get_api_session(request):
+    """
+    Returns the API session attached to the request by ApiSessionMiddleware
+    or a new one if the middleware did not process the request
+    """
+    api_session = getattr(request, 'api_session', None)
+    if not isinstance(api_session, RequestApiSession):
+        api_session = create_api_session(request)
+    return api_session
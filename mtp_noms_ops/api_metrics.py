@@ -0,0 +1,140 @@
+import collections
+import contextvars
+from functools import partial
+import os
+import re
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.apps import apps
+from prometheus_client import Counter, Histogram
+
+from mtp_noms_ops.timing import record_timing
+
+services = ('api', 'nomis', 'offender-search')
+
+api_call_duration = Histogram(
+    'mtp_api_call_duration', 'Durations of calls to mtp-api, NOMIS and offender search',
+    labelnames=('service', 'method', 'endpoint', 'pid'),
+    buckets=(0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 25.0, 50.0, float('inf'))
+)
+api_call_responses = Counter(
+    'mtp_api_call_responses', 'Responses from mtp-api, NOMIS and offender search by status',
+    labelnames=('service', 'method', 'endpoint', 'status', 'pid'),
+)
+api_call_response_size = Histogram(
+    'mtp_api_call_response_size', 'Sizes in bytes of responses from mtp-api, NOMIS and offender search',
+    labelnames=('service', 'method', 'endpoint', 'pid'),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float('inf'))
+)
+api_calls_per_request = Histogram(
+    'mtp_api_calls_per_request', 'Number of calls to mtp-api, NOMIS and offender search made by each Django request',
+    labelnames=('view', 'service', 'pid'),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float('inf'))
+)
+try:
+    app = apps.get_app_config('metrics')
+    app.register_collector(api_call_duration)
+    app.register_collector(api_call_responses)
+    app.register_collector(api_call_response_size)
+    app.register_collector(api_calls_per_request)
+except LookupError:
+    pass
+
+# calls made while handling the current Django request, counted by service
+current_api_calls = contextvars.ContextVar('current_api_calls', default=None)
+
+endpoint_id_patterns = (
+    ('{id}', re.compile(r'^\d+$')),
+    ('{prisoner_number}', re.compile(r'^[A-Z]\d{4}[A-Z]{2}$', re.IGNORECASE)),
+    ('{uuid}', re.compile(r'^[0-9a-f-]{16,}$', re.IGNORECASE)),
+)
+# path segments following these are names rather than ids
+endpoint_named_collections = {
+    'users': '{username}',
+    'prison': '{prison}',
+    'prisons': '{prison}',
+}
+
+
+def normalise_endpoint(url):
+    """
+    Turns a URL into an endpoint template, e.g. /senders/{id}/credits/,
+    so that metrics are not labelled with every id requested
+    """
+    segments = urlsplit(url).path.split('/')
+    normalised = []
+    previous_segment = None
+    for segment in segments:
+        if segment and previous_segment in endpoint_named_collections:
+            normalised.append(endpoint_named_collections[previous_segment])
+        else:
+            normalised.append(next(
+                (template for template, pattern in endpoint_id_patterns if pattern.match(segment)),
+                segment,
+            ))
+        previous_segment = segment
+    return '/'.join(normalised) or '/'
+
+
+def record_api_call(service, response, *args, **kwargs):
+    """
+    Response hook for requests sessions that records metrics for each call made
+    """
+    started = perf_counter()
+    if kwargs.get('stream'):
+        size = response.headers.get('Content-Length')
+        size = int(size) if size and size.isdigit() else None
+    else:
+        size = len(response.content)
+    duration = response.elapsed.total_seconds() + perf_counter() - started
+    record_timing(service, duration)
+
+    method = response.request.method
+    endpoint = normalise_endpoint(response.request.url)
+    pid = str(os.getpid())
+    api_call_duration.labels(service=service, method=method, endpoint=endpoint, pid=pid).observe(duration)
+    api_call_responses.labels(
+        service=service, method=method, endpoint=endpoint, status=str(response.status_code), pid=pid,
+    ).inc()
+    if size is not None:
+        api_call_response_size.labels(service=service, method=method, endpoint=endpoint, pid=pid).observe(size)
+
+    call_counts = current_api_calls.get()
+    if call_counts is not None:
+        call_counts[service] += 1
+
+
+def instrument_session(session, service):
+    """
+    Records metrics for calls made using a requests session
+    :param service: one of `services`
+    """
+    # must run before mtp_common's hook which raises exceptions for error responses
+    session.hooks['response'].insert(0, partial(record_api_call, service))
+    return session
+
+
+class ApiCallMetricsMiddleware:
+    """
+    Counts calls to other services made while handling each request so that views making many can be found.
+    Threads started by views only contribute if they run in a copy of the request's context.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        call_counts = collections.Counter()
+        token = current_api_calls.set(call_counts)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_api_calls.reset(token)
+
+        view_name = getattr(getattr(request, 'resolver_match', None), 'view_name', None) or '<unnamed view>'
+        pid = str(os.getpid())
+        for service in services:
+            api_calls_per_request.labels(view=view_name, service=service, pid=pid).observe(call_counts[service])
+
+        return response
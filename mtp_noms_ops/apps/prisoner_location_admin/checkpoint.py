@@ -0,0 +1,130 @@
+import contextlib
+import csv
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+
+from django.conf import settings
+
+from prisoner_location_admin.models import PrisonerLocation
+from prisoner_location_admin.spool import PrisonerLocationSpool
+
+logger = logging.getLogger('mtp')
+
+
+class LocationLoadCheckpoint:
+    """
+    Progress of loading prisoner locations from offender search so that a failed load can be resumed.
+    Locations from loaded pages are appended to a CSV file without a header row and the pages loaded
+    for each prison are kept in a JSON state file that is only replaced once the page's locations are written.
+    """
+    fields = PrisonerLocationSpool.fields
+
+    def __init__(self, directory=None):
+        directory = directory or settings.LOCATION_LOAD_CHECKPOINT_DIR or tempfile.gettempdir()
+        self.state_path = os.path.join(directory, 'prisoner-location-load.json')
+        self.locations_path = os.path.join(directory, 'prisoner-location-load.csv')
+        self.prison_ids = []
+        self.prisons = {}
+        self.location_count = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.state_path} ({self.location_count} locations)>'
+
+    def load(self, prison_ids: list[str]) -> bool:
+        """
+        Loads saved progress if it is recent and for the same prisons
+        :return: True if there is progress to resume from
+        """
+        try:
+            if time.time() - os.path.getmtime(self.state_path) > settings.LOCATION_LOAD_CHECKPOINT_MAX_AGE:
+                logger.info('Prisoner location load checkpoint is too old to resume from')
+                return False
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state['prison_ids'] != prison_ids:
+                logger.info('Prisoner location load checkpoint is for different prisons')
+                return False
+            self.truncate_locations(state['location_count'])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, csv.Error):
+            logger.exception('Prisoner location load checkpoint cannot be read')
+            return False
+        self.prison_ids = state['prison_ids']
+        self.prisons = state['prisons']
+        self.location_count = state['location_count']
+        return True
+
+    def reset(self, prison_ids: list[str]):
+        self.prison_ids = list(prison_ids)
+        self.prisons = {}
+        self.location_count = 0
+        with open(self.locations_path, 'w', newline='', encoding='utf-8'):
+            pass
+        self.save_state()
+
+    def is_complete(self, prison_id: str) -> bool:
+        progress = self.prisons.get(prison_id)
+        return bool(progress) and progress['pages_loaded'] >= progress['page_count']
+
+    def pages_loaded(self, prison_id: str) -> int:
+        progress = self.prisons.get(prison_id)
+        return progress['pages_loaded'] if progress else 0
+
+    def page_count(self, prison_id: str) -> typing.Optional[int]:
+        progress = self.prisons.get(prison_id)
+        return progress['page_count'] if progress else None
+
+    def record_page(self, prison_id: str, page: int, page_count: int, locations: list[PrisonerLocation]):
+        """
+        Saves a loaded page of locations; pages of a prison must be recorded in order
+        """
+        with open(self.locations_path, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(
+                [location[field] for field in self.fields]
+                for location in locations
+            )
+        self.prisons[prison_id] = {'pages_loaded': page + 1, 'page_count': page_count}
+        self.location_count += len(locations)
+        self.save_state()
+
+    def iter_locations(self) -> typing.Iterator[PrisonerLocation]:
+        """
+        Yields locations saved when the checkpoint was loaded
+        """
+        location_count = self.location_count
+        if not location_count:
+            return
+        with open(self.locations_path, newline='', encoding='utf-8') as f:
+            for _, row in zip(range(location_count), csv.reader(f)):
+                yield PrisonerLocation(zip(self.fields, row))
+
+    def save_state(self):
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.prisoner-location-load-', suffix='.json',
+            dir=os.path.dirname(self.state_path),
+        )
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'prison_ids': self.prison_ids,
+                'prisons': self.prisons,
+                'location_count': self.location_count,
+            }, f)
+        os.replace(temp_path, self.state_path)
+
+    def truncate_locations(self, location_count: int):
+        # drops locations written for a page whose progress was not saved
+        with open(self.locations_path, 'r+', newline='', encoding='utf-8') as f:
+            for _ in range(location_count):
+                if not f.readline():
+                    raise ValueError('Prisoner location load checkpoint is missing locations')
+            f.truncate(f.tell())
+
+    def delete(self):
+        for path in (self.state_path, self.locations_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
@@ -1,4 +1,9 @@
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
 import logging
+import math
+import time
 import typing
 
 from django.conf import settings
@@ -6,11 +11,18 @@ from django.core.management import BaseCommand
 from django.utils import timezone
 from django.utils.functional import cached_property
 from mtp_common.auth import api_client, urljoin, MojUser
-from mtp_common.nomis import connector, request_retry
+from mtp_common.nomis import Retry, connector, request_retry
+from mtp_common.spooling import spooler
 from mtp_common.stack import StackException, is_first_instance
 import requests
 
+from mtp_noms_ops.api_metrics import instrument_session
+
+from prisoner_location_admin.checkpoint import LocationLoadCheckpoint
 from prisoner_location_admin.models import PrisonerLocation
+from prisoner_location_admin.snapshot import get_location_snapshot
+from prisoner_location_admin.spool import PrisonerLocationSpool
+from prisoner_location_admin.stats import LoadStats
 from prisoner_location_admin.tasks import update_locations
 from security.models import PrisonList
 
@@ -22,9 +34,13 @@ class Command(BaseCommand):
     Loads prisoner locations from offender search api for all known prisons and submits them to mtp-api
     """
     help = __doc__.strip().splitlines()[0]
+    offender_search_page_size = 500
 
     def add_arguments(self, parser):
         parser.add_argument('--scheduled', action='store_true')
+        parser.add_argument('--resume', action='store_true',
+                            help='Resume loading from offender search where a previous failed run stopped; '
+                                 'progress is only saved by runs with --resume or LOCATION_LOAD_CHECKPOINT enabled')
 
     def handle(self, **options):
         scheduled = options['scheduled']
@@ -46,13 +62,44 @@ class Command(BaseCommand):
         try:
             user = self.get_uploading_user()
             prison_ids = self.get_known_prison_ids()
-            locations = self.search_for_offenders(prison_ids)
+            if options['resume'] or settings.LOCATION_LOAD_CHECKPOINT:
+                checkpoint = LocationLoadCheckpoint()
+                if options['resume'] and checkpoint.load(prison_ids):
+                    self.stdout.write(
+                        f'Resuming with {checkpoint.location_count:,} prisoner locations already loaded'
+                    )
+                else:
+                    checkpoint.reset(prison_ids)
+                locations = itertools.chain(
+                    checkpoint.iter_locations(),
+                    self.search_for_offenders(prison_ids, checkpoint=checkpoint),
+                )
+            else:
+                checkpoint = None
+                locations = self.search_for_offenders(prison_ids)
+
+            if spooler.installed or get_location_snapshot():
+                # spooled tasks cannot take a generator and differential uploads need to read locations twice
+                locations = self.spool_locations(locations)
+                if not locations:
+                    locations.delete()
+                    locations = None
+            else:
+                # locations are uploaded as pages are loaded, but the first is needed to know if there are any
+                first_location = next(locations, None)
+                if first_location is not None:
+                    locations = itertools.chain([first_location], locations)
+                else:
+                    locations = None
 
             if locations:
                 self.stdout.write('Scheduling prisoner locations for upload')
                 update_locations(user=user, locations=locations)
             else:
                 self.stdout.write('Not scheduling prisoner locations for upload')
+            # NB: the checkpoint is kept if loading or uploading failed so that a rerun can resume
+            # but any from an earlier run is out of date once locations are uploaded
+            (checkpoint or LocationLoadCheckpoint()).delete()
         except Exception as e:  # noqa: E722,B001
             # catch and report any exception to prevent infinite uwsgi spooler loop
             logger.exception('Prisoner locations not loaded automatically from offender search')
@@ -61,10 +108,14 @@ class Command(BaseCommand):
 
     @cached_property
     def session(self) -> api_client.MoJOAuth2Session:
-        return api_client.get_authenticated_api_session(
+        return instrument_session(api_client.get_authenticated_api_session(
             settings.LOCATION_UPLOADER_USERNAME,
             settings.LOCATION_UPLOADER_PASSWORD,
-        )
+        ), 'api')
+
+    @cached_property
+    def offender_search_session(self) -> requests.Session:
+        return instrument_session(requests.Session(), 'offender-search')
 
     def get_uploading_user(self) -> MojUser:
         user_data = self.session.get(f'/users/{settings.LOCATION_UPLOADER_USERNAME}/').json()
@@ -80,43 +131,156 @@ class Command(BaseCommand):
         self.stdout.write(f'{len(prison_ids)} prisons with active prisoner locations')
         return prison_ids
 
-    def search_for_offenders(self, prison_ids: list[str]) -> list[PrisonerLocation]:
-        locations: list[PrisonerLocation] = []
+    def search_for_offenders(
+        self,
+        prison_ids: list[str],
+        checkpoint: typing.Optional[LocationLoadCheckpoint] = None,
+    ) -> typing.Iterator[PrisonerLocation]:
+        """
+        Yields locations in prison order then page order as pages of offenders are loaded.
+        Pages already recorded in the `checkpoint` are skipped and newly loaded ones are added to it.
+        Timings are logged and saved to be exposed as metrics.
+        """
+        stats = LoadStats('offender_search')
+        if checkpoint:
+            stats.add('resumed_rows', checkpoint.location_count)
 
+        self.stdout.write(f'Searching for offenders in {len(prison_ids)} prisons…')
+        succeeded = False
+        try:
+            yield from self.load_offender_locations(prison_ids, checkpoint, stats)
+            succeeded = True
+        finally:
+            stats.finish(succeeded=succeeded)
+            logger.info(
+                'Prisoner locations %s from offender search', 'loaded' if succeeded else 'not loaded',
+                extra={'elk_fields': stats.elk_fields()},
+            )
+
+        location_count = stats.counts['resumed_rows'] + stats.counts['rows']
+        self.stdout.write(f'Found {location_count:,} prisoner locations in total')
+
+    def load_offender_locations(
+        self,
+        prison_ids: list[str],
+        checkpoint: typing.Optional[LocationLoadCheckpoint],
+        stats: LoadStats,
+    ) -> typing.Iterator[PrisonerLocation]:
+        """
+        A few pages are loaded concurrently ahead of those being consumed: the first page of upcoming prisons
+        and remaining pages of the current prison once its total is known.
+        The total can grow while loading so pages continue to be loaded until one is empty or marked as last.
+        """
+        concurrency = settings.OFFENDER_SEARCH_CONCURRENCY
         headers = connector.build_request_api_headers()
-        for prison_id in prison_ids:
-            self.stdout.write(f'Searching for offenders in {prison_id}…')
-            page = 0
-            while True:
-                url = urljoin(
-                    settings.HMPPS_OFFENDER_SEARCH_BASE_URL,
-                    f'/prison/{prison_id}/prisoners?cellLocationPrefix=&size=500&page={page}&sort=prisonerNumber,ASC',
-                    trailing_slash=False,
-                )
+
+        def pages_loaded(prison_id):
+            return checkpoint.pages_loaded(prison_id) if checkpoint else 0
+
+        def load_page(prison_id, page, page_count, response):
+            self.write_page_loaded(prison_id, page, response)
+            with stats.time('parse'):
+                locations = list(map(to_prisoner_location, response['content']))
+            if checkpoint:
+                with stats.time('checkpoint'):
+                    checkpoint.record_page(prison_id, page, page_count, locations)
+            stats.add('rows', len(locations))
+            return locations
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            first_pages: dict[int, Future] = {}
+            later_pages: collections.deque[tuple[int, Future]] = collections.deque()
+
+            def submit(prison_id, page):
+                return executor.submit(self.get_page_of_offenders, prison_id, page, headers, stats)
+
+            def prefetch_first_pages(up_to_prison_index):
+                for prison_index in range(up_to_prison_index, min(up_to_prison_index + concurrency, len(prison_ids))):
+                    prison_id = prison_ids[prison_index]
+                    if prison_index not in first_pages and pages_loaded(prison_id) == 0:
+                        first_pages[prison_index] = submit(prison_id, 0)
+
+            try:
+                for prison_index, prison_id in enumerate(prison_ids):
+                    next_page = pages_loaded(prison_id)
+                    if next_page == 0:
+                        prefetch_first_pages(prison_index)
+                        response = first_pages.pop(prison_index).result()
+                        if has_more_pages(response):
+                            # the first page size is used in case offender search limits page size
+                            page_count = max(2, math.ceil(response['totalElements'] / len(response['content'])))
+                        else:
+                            page_count = 1
+                        yield from load_page(prison_id, 0, page_count, response)
+                        next_page = 1
+                    else:
+                        page_count = checkpoint.page_count(prison_id)
+
+                    while next_page < page_count or later_pages:
+                        while next_page < page_count and len(later_pages) < concurrency:
+                            later_pages.append((next_page, submit(prison_id, next_page)))
+                            next_page += 1
+                        page, future = later_pages.popleft()
+                        response = future.result()
+                        if not later_pages and next_page == page_count and has_more_pages(response):
+                            page_count += 1
+                        yield from load_page(prison_id, page, page_count, response)
+            finally:
+                for future in itertools.chain(first_pages.values(), (future for _, future in later_pages)):
+                    future.cancel()
+
+    def write_page_loaded(self, prison_id: str, page: int, response: 'OffenderSearchPrisonerList'):
+        self.stdout.write(
+            f'  {prison_id} page {page} loaded {len(response["content"])} offenders '
+            f'from a total of {response["totalElements"]:,}'
+        )
+
+    def spool_locations(self, locations: typing.Iterable[PrisonerLocation]) -> PrisonerLocationSpool:
+        spool = PrisonerLocationSpool()
+        try:
+            with spool.writer() as write:
+                for location in locations:
+                    write(location)
+        except:  # noqa: E722,B001
+            spool.delete()
+            raise
+        return spool
+
+    def get_page_of_offenders(
+        self, prison_id: str, page: int, headers: dict, stats: LoadStats,
+    ) -> 'OffenderSearchPrisonerList':
+        url = urljoin(
+            settings.HMPPS_OFFENDER_SEARCH_BASE_URL,
+            f'/prison/{prison_id}/prisoners?cellLocationPrefix=&size={self.offender_search_page_size}'
+            f'&page={page}&sort=prisonerNumber,ASC',
+            trailing_slash=False,
+        )
+        retries = BackoffRetry(settings.OFFENDER_SEARCH_RETRIES)
+        try:
+            with stats.time('fetch', prison=prison_id):
                 response: requests.Response = request_retry(
                     'get',
                     url,
-                    retries=0,
-                    session=None,
+                    retries=retries,
+                    session=self.offender_search_session,
                     headers=headers,
                 )
-                response.raise_for_status()
-                response: OffenderSearchPrisonerList = response.json()
-                page_of_offenders = response['content']
-                offender_count = response['totalElements']
-                self.stdout.write(
-                    f'  page {page} loaded {len(page_of_offenders)} offenders from a total of {offender_count:,}'
-                )
-                if page_of_offenders:
-                    locations.extend(to_prisoner_location(offender) for offender in page_of_offenders)
-                else:
-                    break
-                if response['last']:
-                    break
-                page += 1
+        finally:
+            stats.add('retries', retries.retry_count)
+        stats.add_response(response)
+        response.raise_for_status()
+        with stats.time('parse'):
+            return response.json()
 
-        self.stdout.write(f'Found {len(locations):,} prisoner locations in total')
-        return locations
+
+class BackoffRetry(Retry):
+    """
+    Waits exponentially longer before each retry
+    """
+
+    def before_retrying(self, request_kwargs):
+        time.sleep(settings.OFFENDER_SEARCH_RETRY_BACKOFF * 2 ** self.retry_count)
+        super().before_retrying(request_kwargs)
 
 
 class OffenderSearchPrisoner(typing.TypedDict):
@@ -136,6 +300,10 @@ class OffenderSearchPrisonerList(typing.TypedDict):
     last: bool
 
 
+def has_more_pages(response: OffenderSearchPrisonerList) -> bool:
+    return bool(response['content']) and not response['last']
+
+
 def to_prisoner_location(offender: OffenderSearchPrisoner) -> PrisonerLocation:
     return PrisonerLocation(
         prisoner_number=offender['prisonerNumber'],
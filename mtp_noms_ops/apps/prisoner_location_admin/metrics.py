@@ -0,0 +1,75 @@
+from django.apps import apps
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+from prisoner_location_admin.stats import load_saved_stats
+
+
+class LocationLoadMetricCollector:
+    """
+    Exposes the latest saved prisoner location load stats; these are read from files
+    because loads run in management commands and spooler processes rather than web workers
+    """
+    operations = ('offender_search', 'upload')
+
+    def collect(self):
+        last_run = GaugeMetricFamily(
+            'mtp_prisoner_location_load_timestamp_seconds', 'When prisoner location load finished',
+            labels=('operation',),
+        )
+        succeeded = GaugeMetricFamily(
+            'mtp_prisoner_location_load_success', 'Whether prisoner location load succeeded',
+            labels=('operation',),
+        )
+        duration = GaugeMetricFamily(
+            'mtp_prisoner_location_load_duration_seconds', 'Prisoner location load duration',
+            labels=('operation',),
+        )
+        rows_per_second = GaugeMetricFamily(
+            'mtp_prisoner_location_load_rows_per_second', 'Prisoner location load throughput',
+            labels=('operation',),
+        )
+        counts = GaugeMetricFamily(
+            'mtp_prisoner_location_load_count', 'Prisoner location load rows, bytes transferred and retries',
+            labels=('operation', 'name'),
+        )
+        phase_seconds = GaugeMetricFamily(
+            'mtp_prisoner_location_load_phase_seconds', 'Time spent in each phase of prisoner location load',
+            labels=('operation', 'phase'),
+        )
+        phase_counts = GaugeMetricFamily(
+            'mtp_prisoner_location_load_phase_count', 'Number of times each phase of prisoner location load ran',
+            labels=('operation', 'phase'),
+        )
+        prison_seconds = GaugeMetricFamily(
+            'mtp_prisoner_location_load_prison_seconds', 'Time spent loading prisoner locations for each prison',
+            labels=('operation', 'prison'),
+        )
+
+        for operation in self.operations:
+            stats = load_saved_stats(operation)
+            if not stats:
+                continue
+            last_run.add_metric([operation], stats['finished'] or stats['started'])
+            succeeded.add_metric([operation], 1 if stats['succeeded'] else 0)
+            duration.add_metric([operation], stats['duration'])
+            rows_per_second.add_metric([operation], stats['rows_per_second'])
+            for name, count in stats['counts'].items():
+                counts.add_metric([operation, name], count)
+            for phase, seconds in stats['phase_seconds'].items():
+                phase_seconds.add_metric([operation, phase], seconds)
+            for phase, count in stats['phase_counts'].items():
+                phase_counts.add_metric([operation, phase], count)
+            for prison, seconds in stats['prison_seconds'].items():
+                prison_seconds.add_metric([operation, prison], seconds)
+
+        return [
+            last_run, succeeded, duration, rows_per_second,
+            counts, phase_seconds, phase_counts, prison_seconds,
+        ]
+
+
+try:
+    app = apps.get_app_config('metrics')
+    app.register_collector(LocationLoadMetricCollector())
+except LookupError:
+    pass
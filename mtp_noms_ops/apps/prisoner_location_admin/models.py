@@ -1,3 +1,4 @@
+import array
 import typing
 
 
@@ -6,3 +7,111 @@ class PrisonerLocation(typing.TypedDict):
     prisoner_name: str
     prisoner_dob: str
     prison: str
+
+
+class PrisonerLocationBatch:
+    """
+    Compact columnar container of prisoner locations for when many need holding in memory or pickling:
+    prison codes are stored once and referenced by index and YYYY-MM-DD dates of birth are packed into integers.
+    Items are produced as PrisonerLocation dicts on demand.
+    """
+    __slots__ = ('prisoner_numbers', 'prisoner_names', 'prisoner_dobs', 'unpacked_dobs',
+                 'prisons', 'prison_indices', 'prison_lookup')
+
+    def __init__(self, locations: typing.Iterable[PrisonerLocation] = ()):
+        self.prisoner_numbers: list[str] = []
+        self.prisoner_names: list[str] = []
+        self.prisoner_dobs = array.array('I')  # YYYYMMDD or 0 if not in YYYY-MM-DD format
+        self.unpacked_dobs: dict[int, str] = {}
+        self.prisons: list[str] = []
+        self.prison_indices = array.array('H')
+        self.prison_lookup: dict[str, int] = {}
+        self.extend(locations)
+
+    def __len__(self):
+        return len(self.prisoner_numbers)
+
+    def __iter__(self) -> typing.Iterator[PrisonerLocation]:
+        for index in range(len(self)):
+            yield self.get_location(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PrisonerLocationBatch(self.get_location(i) for i in range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Prisoner location index out of range')
+        return self.get_location(index)
+
+    def __eq__(self, other):
+        if isinstance(other, PrisonerLocationBatch):
+            return self.as_payload() == other.as_payload()
+        return NotImplemented
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} ({len(self)} locations)>'
+
+    def __getstate__(self):
+        return (
+            self.prisoner_numbers, self.prisoner_names,
+            self.prisoner_dobs, self.unpacked_dobs,
+            self.prisons, self.prison_indices,
+        )
+
+    def __setstate__(self, state):
+        (
+            self.prisoner_numbers, self.prisoner_names,
+            self.prisoner_dobs, self.unpacked_dobs,
+            self.prisons, self.prison_indices,
+        ) = state
+        self.prison_lookup = {prison: index for index, prison in enumerate(self.prisons)}
+
+    def append(self, location: PrisonerLocation):
+        index = len(self.prisoner_numbers)
+        self.prisoner_numbers.append(location['prisoner_number'])
+        self.prisoner_names.append(location['prisoner_name'])
+
+        dob = location['prisoner_dob']
+        packed_dob = 0
+        if len(dob) == 10 and dob[4] == '-' and dob[7] == '-':
+            digits = dob.replace('-', '')
+            if digits.isascii() and digits.isdigit():
+                packed_dob = int(digits)
+        # 0 marks a date of birth that is not packed so, like other irregular values, 0000-00-00 is kept as is
+        if packed_dob:
+            self.prisoner_dobs.append(packed_dob)
+        else:
+            self.prisoner_dobs.append(0)
+            self.unpacked_dobs[index] = dob
+
+        prison = location['prison']
+        prison_index = self.prison_lookup.get(prison)
+        if prison_index is None:
+            prison_index = len(self.prisons)
+            self.prisons.append(prison)
+            self.prison_lookup[prison] = prison_index
+        self.prison_indices.append(prison_index)
+
+    def extend(self, locations: typing.Iterable[PrisonerLocation]):
+        for location in locations:
+            self.append(location)
+
+    def get_location(self, index: int) -> PrisonerLocation:
+        packed_dob = self.prisoner_dobs[index]
+        if packed_dob:
+            dob = f'{packed_dob // 10000:04d}-{packed_dob // 100 % 100:02d}-{packed_dob % 100:02d}'
+        else:
+            dob = self.unpacked_dobs[index]
+        return PrisonerLocation(
+            prisoner_number=self.prisoner_numbers[index],
+            prisoner_name=self.prisoner_names[index],
+            prisoner_dob=dob,
+            prison=self.prisons[self.prison_indices[index]],
+        )
+
+    def as_payload(self) -> list[PrisonerLocation]:
+        """
+        Returns the locations as a JSON-serialisable list for mtp-api
+        """
+        return list(self)
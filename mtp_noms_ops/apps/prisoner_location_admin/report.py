@@ -0,0 +1,117 @@
+import collections
+import contextlib
+import csv
+import io
+import re
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+
+
+class LocationFileReport:
+    """
+    Row-level problems found while validating an uploaded location file.
+    Problems are compressed as they are found so that the user can download a complete report
+    of rows that were not uploaded; the report is only kept if there were problems.
+    Counts are kept in the uploader's session and the report itself in the shared cache
+    so that both are available whichever instance serves the next request.
+    """
+    categories = {
+        'columns': _('Wrong number of columns'),
+        'dob': _('Invalid date of birth'),
+        'prison': _('Unsupported prison'),
+    }
+    header = ('Row', 'NOMIS Number', 'Category', 'Problem')
+    report_id_pattern = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, report_id=None, counts=None):
+        self.report_id = report_id or uuid.uuid4().hex
+        self.counts = collections.Counter(counts or {})
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.report_id} ({len(self)} problems)>'
+
+    @property
+    def cache_key(self):
+        return f'prisoner-location-report-{self.report_id}'
+
+    @classmethod
+    def from_session_data(cls, data):
+        """
+        Returns a report saved with `session_data` or None
+        """
+        if not isinstance(data, dict):
+            return None
+        report_id = data.get('report_id')
+        counts = data.get('counts')
+        if not isinstance(report_id, str) or not cls.report_id_pattern.match(report_id):
+            return None
+        if not isinstance(counts, dict) or not all(category in cls.categories for category in counts):
+            return None
+        report = cls(report_id, counts)
+        return report or None
+
+    def session_data(self):
+        return {'report_id': self.report_id, 'counts': dict(self.counts)}
+
+    def get_contents(self):
+        """
+        Returns the CSV report as bytes if it has not expired, otherwise None
+        """
+        contents = cache.get(self.cache_key)
+        if contents is None:
+            return None
+        try:
+            return zlib.decompress(contents)
+        except zlib.error:
+            return None
+
+    @contextlib.contextmanager
+    def writer(self):
+        """
+        Yields a function that records a problem with a row of the location file
+        """
+        buffer = io.StringIO()
+        csv_writer = csv.writer(buffer)
+        compressor = zlib.compressobj()
+        compressed = []
+
+        def write_row(row):
+            csv_writer.writerow(row)
+            compressed.append(compressor.compress(buffer.getvalue().encode('utf-8')))
+            buffer.seek(0)
+            buffer.truncate()
+
+        write_row(self.header)
+        self.counts.clear()
+
+        def write(row_number: int, prisoner_number: str, category: str, problem: str):
+            write_row([row_number, prisoner_number, category, problem])
+            self.counts[category] += 1
+
+        yield write
+        if self:
+            compressed.append(compressor.flush())
+            cache.set(self.cache_key, b''.join(compressed), timeout=settings.LOCATION_UPLOAD_REPORT_MAX_AGE)
+
+    def summary(self):
+        """
+        Returns (category description, count) for each category with problems
+        """
+        return [
+            (description, self.counts[category])
+            for category, description in self.categories.items()
+            if self.counts[category]
+        ]
+
+    def delete(self):
+        cache.delete(self.cache_key)
@@ -0,0 +1,111 @@
+import contextlib
+import csv
+import dataclasses
+import gzip
+import logging
+import os
+import tempfile
+import time
+import typing
+
+from django.conf import settings
+
+from prisoner_location_admin.models import PrisonerLocation, PrisonerLocationBatch
+from prisoner_location_admin.spool import PrisonerLocationSpool
+
+logger = logging.getLogger('mtp')
+
+
+@dataclasses.dataclass
+class LocationChanges:
+    changed: PrisonerLocationBatch
+    removed: list[str]
+
+    @property
+    def count(self):
+        return len(self.changed) + len(self.removed)
+
+
+class LocationSnapshot:
+    """
+    The last set of prisoner locations successfully uploaded to mtp-api from this instance
+    stored as a gzipped CSV without a header row, sorted by prisoner number
+    """
+    fields = PrisonerLocationSpool.fields
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path}>'
+
+    def load(self) -> typing.Optional[dict[str, tuple[str, ...]]]:
+        """
+        Returns the snapshot keyed by prisoner number or None if it is missing, unreadable or too old to be trusted
+        """
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+            if age > settings.LOCATION_UPLOAD_SNAPSHOT_MAX_AGE:
+                logger.info('Prisoner location snapshot is too old to use')
+                return None
+            with gzip.open(self.path, 'rt', newline='', encoding='utf-8') as f:
+                return {
+                    row[0]: tuple(row[1:])
+                    for row in csv.reader(f)
+                }
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, csv.Error, IndexError):
+            logger.exception('Prisoner location snapshot cannot be read')
+            return None
+
+    def save(self, locations: typing.Iterable[PrisonerLocation]):
+        """
+        Replaces the snapshot; the file is swapped in atomically so a failed save leaves no partial snapshot
+        """
+        rows = sorted(
+            [location[field] for field in self.fields]
+            for location in locations
+        )
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.prisoner-locations-', suffix='.csv.gz',
+            dir=os.path.dirname(self.path) or None,
+        )
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(rows)
+            os.replace(temp_path, self.path)
+        except:  # noqa: E722,B001
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_path)
+            raise
+
+    def delete(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+def get_location_snapshot() -> typing.Optional[LocationSnapshot]:
+    if not settings.LOCATION_UPLOAD_DIFFERENTIAL or not settings.LOCATION_UPLOAD_SNAPSHOT_PATH:
+        return None
+    return LocationSnapshot(settings.LOCATION_UPLOAD_SNAPSHOT_PATH)
+
+
+def diff_locations(
+    previous: dict[str, tuple[str, ...]],
+    locations: typing.Iterable[PrisonerLocation],
+) -> LocationChanges:
+    """
+    Finds prisoners who are new or whose details have changed since the `previous` snapshot
+    and the numbers of prisoners who are no longer present
+    """
+    fields = LocationSnapshot.fields[1:]
+    changed = PrisonerLocationBatch()
+    seen = set()
+    for location in locations:
+        prisoner_number = location['prisoner_number']
+        seen.add(prisoner_number)
+        if previous.get(prisoner_number) != tuple(location[field] for field in fields):
+            changed.append(location)
+    removed = sorted(previous.keys() - seen)
+    return LocationChanges(changed=changed, removed=removed)
@@ -0,0 +1,71 @@
+import contextlib
+import csv
+import itertools
+import os
+import tempfile
+
+from django.conf import settings
+
+from prisoner_location_admin.models import PrisonerLocation, PrisonerLocationBatch
+
+
+class PrisonerLocationSpool:
+    """
+    Normalised prisoner locations stored in a temporary CSV file without a header row
+    so that large uploads need not be held in memory or pickled into a uWSGI spooler message.
+    Only the file path and row count are pickled; the file is read back by the upload task.
+    """
+    fields = ('prisoner_number', 'prisoner_name', 'prisoner_dob', 'prison')
+
+    def __init__(self, path=None, count=0):
+        if path is None:
+            fd, path = tempfile.mkstemp(
+                prefix='prisoner-locations-', suffix='.csv',
+                dir=settings.LOCATION_UPLOAD_SPOOL_DIR,
+            )
+            os.close(fd)
+        self.path = path
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __iter__(self):
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                yield PrisonerLocation(zip(self.fields, row))
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.path} ({self.count} locations)>'
+
+    @contextlib.contextmanager
+    def writer(self):
+        """
+        Yields a function that appends a location to the spool file
+        """
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            csv_writer = csv.writer(f)
+            self.count = 0
+
+            def write(location: PrisonerLocation):
+                csv_writer.writerow([location[field] for field in self.fields])
+                self.count += 1
+
+            yield write
+
+    def delete(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+
+def iter_batches(locations, batch_size):
+    """
+    Yields compact batches of at most `batch_size` locations from any iterable of locations;
+    the JSON payload for each is only built when it is posted
+    """
+    locations = iter(locations)
+    while batch := PrisonerLocationBatch(itertools.islice(locations, batch_size)):
+        yield batch
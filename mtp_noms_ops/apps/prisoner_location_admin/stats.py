@@ -0,0 +1,146 @@
+import collections
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('mtp')
+
+
+class LoadStats:
+    """
+    Timings and counts collected while loading prisoner locations from offender search or uploading them to mtp-api.
+    Recording is thread-safe so that concurrent requests can share an instance.
+    The latest stats for each operation are saved to a file so that any process can expose them as metrics.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.time()
+        self.finished = None
+        self.succeeded = None
+        self.phase_seconds = collections.Counter()
+        self.phase_counts = collections.Counter()
+        self.prison_seconds = collections.Counter()
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.operation}>'
+
+    @contextlib.contextmanager
+    def time(self, phase, prison=None):
+        """
+        Adds time spent in the block to the total for `phase` and, if given, `prison`
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.phase_seconds[phase] += duration
+                self.phase_counts[phase] += 1
+                if prison:
+                    self.prison_seconds[prison] += duration
+
+    def add(self, name, count=1):
+        """
+        Increments a counter such as `rows`, `retries`, `bytes_sent` or `bytes_received`
+        """
+        with self.lock:
+            self.counts[name] += count
+
+    def add_response(self, response):
+        if response is None:
+            return
+        request_body = getattr(response.request, 'body', None) or b''
+        self.add('bytes_sent', len(request_body))
+        self.add('bytes_received', len(response.content or b''))
+
+    @property
+    def duration(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rows_per_second(self):
+        duration = self.duration
+        return self.counts['rows'] / duration if duration else 0
+
+    def finish(self, succeeded):
+        self.finished = time.time()
+        self.succeeded = succeeded
+        try:
+            self.save()
+        except OSError:
+            logger.exception('Prisoner location %s stats could not be saved', self.operation)
+
+    def elk_fields(self):
+        prefix = f'@fields.prisoner_location_{self.operation}'
+        fields = {
+            f'{prefix}_seconds': round(self.duration, 3),
+            f'{prefix}_rows_per_second': round(self.rows_per_second, 1),
+        }
+        fields.update(
+            (f'{prefix}_{name}', count)
+            for name, count in sorted(self.counts.items())
+        )
+        fields.update(
+            (f'{prefix}_{phase}_seconds', round(seconds, 3))
+            for phase, seconds in sorted(self.phase_seconds.items())
+        )
+        fields.update(
+            (f'{prefix}_{phase}_count', count)
+            for phase, count in sorted(self.phase_counts.items())
+        )
+        if self.prison_seconds:
+            fields[f'{prefix}_prison_seconds'] = {
+                prison: round(seconds, 3)
+                for prison, seconds in sorted(self.prison_seconds.items())
+            }
+        return fields
+
+    def as_dict(self):
+        return {
+            'operation': self.operation,
+            'started': self.started,
+            'finished': self.finished,
+            'succeeded': self.succeeded,
+            'duration': self.duration,
+            'rows_per_second': self.rows_per_second,
+            'phase_seconds': dict(self.phase_seconds),
+            'phase_counts': dict(self.phase_counts),
+            'prison_seconds': dict(self.prison_seconds),
+            'counts': dict(self.counts),
+        }
+
+    def save(self):
+        path = get_stats_path(self.operation)
+        fd, temp_path = tempfile.mkstemp(prefix='.prisoner-location-stats-', suffix='.json', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.as_dict(), f)
+        os.replace(temp_path, path)
+
+
+def get_stats_path(operation):
+    directory = settings.LOCATION_LOAD_STATS_DIR or tempfile.gettempdir()
+    return os.path.join(directory, f'prisoner-location-{operation}-stats.json')
+
+
+def load_saved_stats(operation):
+    """
+    Returns the latest saved stats for an operation as a dict or None
+    """
+    try:
+        with open(get_stats_path(operation)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.exception('Prisoner location %s stats cannot be read', operation)
+        return None
@@ -1,6 +1,9 @@
+import collections.abc
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import json
 import logging
-import math
+import threading
+import time
 from urllib.parse import urljoin
 
 from django.conf import settings
@@ -8,35 +11,219 @@ from django.forms import ValidationError
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from mtp_common.auth import api_client
-from mtp_common.auth.exceptions import HttpClientError
+from mtp_common.auth.exceptions import HttpClientError, HttpServerError
 from mtp_common.spooling import Context, spoolable
 from mtp_common.tasks import send_email
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import ConnectTimeoutError
+
+from mtp_noms_ops.api_metrics import instrument_session
+
+from prisoner_location_admin.models import PrisonerLocationBatch
+from prisoner_location_admin.snapshot import diff_locations, get_location_snapshot
+from prisoner_location_admin.spool import PrisonerLocationSpool, iter_batches
+from prisoner_location_admin.stats import LoadStats
 
 logger = logging.getLogger('mtp')
 
 
-def format_errors(error_list):
+def format_errors(error_list, row_offset=0, locations=None):
+    """
+    Formats API validation errors for a batch of locations,
+    `row_offset` is the position of the batch in the whole upload
+    """
     output_list = []
     for i, error in enumerate(error_list):
         if error:
             field_errors = []
             for key in error:
                 field_errors += error[key]
-            output_list.append('Row %s: %s' % (i + 1, ', '.join(field_errors)))
+            row = 'Row %s' % (row_offset + i + 1)
+            if locations and i < len(locations):
+                row += ' (%s)' % locations[i]['prisoner_number']
+            output_list.append('%s: %s' % (row, ', '.join(field_errors)))
     return output_list
 
 
+def format_batch_failure(exception, row_offset, locations):
+    if isinstance(exception, HttpClientError) and getattr(exception, 'content', None):
+        try:
+            return format_errors(json.loads(exception.content.decode()), row_offset=row_offset, locations=locations)
+        except ValueError:
+            return [exception.content]
+    return []
+
+
+def get_upload_session():
+    return instrument_session(api_client.get_authenticated_api_session(
+        settings.LOCATION_UPLOADER_USERNAME,
+        settings.LOCATION_UPLOADER_PASSWORD,
+    ), 'api')
+
+
+def request_not_sent(exception):
+    """
+    Whether a request failed before reaching mtp-api, so that it can be retried even if it is not idempotent
+    """
+    if isinstance(exception, ConnectTimeout):
+        return True
+    if isinstance(exception, RequestsConnectionError) and exception.args:
+        # NB: urllib3's NewConnectionError is a kind of ConnectTimeoutError
+        return isinstance(getattr(exception.args[0], 'reason', None), ConnectTimeoutError)
+    return False
+
+
+def is_transient_failure(exception):
+    return isinstance(exception, (HttpServerError, RequestsConnectionError, Timeout))
+
+
+def upload_location_batch(session, locations, stats):
+    """
+    Posts one batch of locations retrying, with exponential back-off, only failures to connect
+    because a batch that reached mtp-api may have been saved even if the response was an error
+    """
+    attempt = 0
+    while True:
+        try:
+            with stats.time('upload_batch'):
+                response = session.post('/prisoner_locations/', json=locations.as_payload())
+            stats.add_response(response)
+            return
+        except (RequestsConnectionError, Timeout) as e:
+            if not request_not_sent(e) or attempt >= settings.UPLOAD_REQUEST_RETRIES:
+                raise
+            delay = settings.UPLOAD_REQUEST_RETRY_BACKOFF * 2 ** attempt
+            attempt += 1
+            stats.add('retries')
+            logger.warning('Prisoner location batch upload failed, retrying in %0.1fs', delay)
+            time.sleep(delay)
+
+
+def upload_location_batches(locations, stats):
+    """
+    Posts batches of settings.UPLOAD_REQUEST_PAGE_SIZE locations using up to settings.UPLOAD_REQUEST_CONCURRENCY
+    concurrent requests; no further batches are started once one fails.
+    Each worker thread authenticates its own session as refreshing tokens in a shared one is not thread-safe.
+    `locations` can be a generator in which case batches are posted as they fill.
+    :return: list of (row offset, batch, exception) for each failed batch
+        (batch is empty if `locations` itself raised an exception) and the number of locations read
+    """
+    failures = []
+    in_flight = {}
+    worker = threading.local()
+
+    def upload(batch):
+        if not hasattr(worker, 'session'):
+            worker.session = get_upload_session()
+        upload_location_batch(worker.session, batch, stats)
+
+    def collect(futures):
+        for future in futures:
+            row_offset, batch = in_flight.pop(future)
+            exception = future.exception()
+            if exception is not None:
+                failures.append((row_offset, batch, exception))
+
+    with ThreadPoolExecutor(max_workers=settings.UPLOAD_REQUEST_CONCURRENCY) as executor:
+        row_offset = 0
+        try:
+            for batch in iter_batches(locations, settings.UPLOAD_REQUEST_PAGE_SIZE):
+                if len(in_flight) >= settings.UPLOAD_REQUEST_CONCURRENCY:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if failures:
+                    break
+                in_flight[executor.submit(upload, batch)] = (row_offset, batch)
+                row_offset += len(batch)
+        except Exception as e:
+            failures.append((row_offset, [], e))
+        collect(list(in_flight))
+
+    return sorted(failures, key=lambda failure: failure[0]), row_offset
+
+
+def save_location_snapshot(locations, stats):
+    snapshot = get_location_snapshot()
+    if snapshot is None:
+        return
+    if not isinstance(locations, collections.abc.Sized):
+        # streamed locations cannot be read again so any existing snapshot is now out of date
+        snapshot.delete()
+        return
+    try:
+        with stats.time('save_snapshot'):
+            snapshot.save(locations)
+    except OSError:
+        logger.exception('Prisoner location snapshot could not be saved')
+        snapshot.delete()
+
+
+def discard_location_snapshot():
+    snapshot = get_location_snapshot()
+    if snapshot:
+        snapshot.delete()
+
+
+def upload_location_changes(session, locations, stats):
+    """
+    Posts only locations that have changed since the last successful upload from this instance
+    along with prisoner numbers that are no longer present.
+    :return: False if a full upload is needed because there is no usable snapshot,
+        too much has changed or mtp-api does not support differential updates
+    """
+    snapshot = get_location_snapshot()
+    if snapshot is None or not isinstance(locations, collections.abc.Sized):
+        return False
+    previous_locations = snapshot.load()
+    if previous_locations is None:
+        logger.info('No prisoner location snapshot so all locations will be uploaded')
+        return False
+    with stats.time('diff'):
+        changes = diff_locations(previous_locations, locations)
+    if changes.count > settings.LOCATION_UPLOAD_DIFFERENTIAL_LIMIT * len(locations):
+        logger.info('%d prisoner locations changed so all locations will be uploaded', changes.count)
+        return False
+    if not changes.count:
+        logger.info('No prisoner locations changed since last upload')
+        save_location_snapshot(locations, stats)
+        return True
+
+    logger.info(
+        'Uploading %d changed and %d removed prisoner locations',
+        len(changes.changed), len(changes.removed),
+    )
+    batches = iter_batches(changes.changed, settings.UPLOAD_REQUEST_PAGE_SIZE)
+    for batch_number, batch in enumerate(batches if changes.changed else [PrisonerLocationBatch()]):
+        # removed prisoners are sent with the first batch only
+        try:
+            with stats.time('update'):
+                response = session.post('/prisoner_locations/actions/update/', json={
+                    'locations': batch.as_payload(),
+                    'removed_prisoner_numbers': changes.removed if batch_number == 0 else [],
+                })
+            stats.add_response(response)
+        except HttpClientError as e:
+            if batch_number == 0 and e.response is not None and e.response.status_code in (404, 405):
+                logger.warning('Differential prisoner location update not supported so all locations will be uploaded')
+                return False
+            raise
+    save_location_snapshot(locations, stats)
+    return True
+
+
 @spoolable(pre_condition=settings.ASYNC_LOCATION_UPLOAD, body_params=('user', 'locations'))
 def update_locations(*, user, locations, context: Context):
     """
     Uploads locations in batches of settings.UPLOAD_REQUEST_PAGE_SIZE, because ~80k in one go is unreliable.
+    Batches are posted concurrently. If the API is temporarily unavailable, inactive locations are deleted
+    and the whole upload restarted, unless `locations` is a generator that cannot be read again.
+    If a snapshot of the last upload is kept, only changed locations are sent when possible.
     Uses uwsgi spooler because this takes a couple of minutes.
     An email is sent to the uploader if there's an error.
+    `locations` can be a list, a PrisonerLocationSpool which is deleted once the upload finishes
+    or, if not spooled, a generator that is consumed as batches are posted.
     """
-    session = api_client.get_authenticated_api_session(
-        settings.LOCATION_UPLOADER_USERNAME,
-        settings.LOCATION_UPLOADER_PASSWORD,
-    )
+    session = get_upload_session()
     username = user.user_data.get('username', 'Unknown')
     user_description = user.get_full_name()
     if user_description:
@@ -45,43 +232,97 @@ def update_locations(*, user, locations, context: Context):
         user_description = username
 
     errors = []
-    location_count = len(locations)
-    logger.info('Starting upload of %d prisoner locations by %s', location_count, user_description)
+    stats = LoadStats('upload')
+    if isinstance(locations, collections.abc.Sized):
+        location_count = len(locations)
+        logger.info('Starting upload of %d prisoner locations by %s', location_count, user_description)
+    else:
+        location_count = None
+        logger.info('Starting streamed upload of prisoner locations by %s', user_description)
     try:
-        logger.info('Deleting inactive prisoner locations (i.e. previous failed batches)')
+        if upload_location_changes(session, locations, stats):
+            stats.add('rows', location_count)
+            stats.finish(succeeded=True)
+            logger.info('%d prisoner locations updated by %s', location_count, user_description, extra={
+                'elk_fields': {
+                    '@fields.prisoner_location_count': location_count,
+                    '@fields.username': username,
+                    '@fields.differential': True,
+                    **stats.elk_fields(),
+                }
+            })
+            return location_count
+
+        attempt = 0
+        while True:
+            logger.info('Deleting inactive prisoner locations (i.e. previous failed batches)')
+            with stats.time('delete_inactive'):
+                session.post('/prisoner_locations/actions/delete_inactive/')
+            failures, location_count = upload_location_batches(locations, stats)
+            if (
+                not failures or attempt >= settings.UPLOAD_REQUEST_RETRIES
+                or not isinstance(locations, collections.abc.Sized)
+                or not all(is_transient_failure(exception) for _, _, exception in failures)
+            ):
+                break
+            delay = settings.UPLOAD_REQUEST_RETRY_BACKOFF * 2 ** attempt
+            attempt += 1
+            stats.add('retries')
+            logger.warning('Prisoner location upload failed, restarting in %0.1fs', delay)
+            time.sleep(delay)
+        stats.add('rows', location_count)
+        if not failures:
+            logger.info('Deleting old prisoner locations')
+            with stats.time('delete_old'):
+                session.post('/prisoner_locations/actions/delete_old/')
+            save_location_snapshot(locations, stats)
+
+            stats.finish(succeeded=True)
+            logger.info('%d prisoner locations updated successfully by %s', location_count, user_description, extra={
+                'elk_fields': {
+                    '@fields.prisoner_location_count': location_count,
+                    '@fields.username': username,
+                    **stats.elk_fields(),
+                }
+            })
+            return location_count
+
+        for row_offset, batch, exception in failures:
+            if batch:
+                logger.error(
+                    'Prisoner locations update by %(user)s failed at rows %(start)d-%(end)d!',
+                    {'user': user_description, 'start': row_offset + 1, 'end': row_offset + len(batch)},
+                    exc_info=exception,
+                )
+            else:
+                logger.error(
+                    'Prisoner locations update by %(user)s failed reading locations after %(count)d rows!',
+                    {'user': user_description, 'count': row_offset},
+                    exc_info=exception,
+                )
+            errors += format_batch_failure(exception, row_offset, batch)
+        logger.info('Deleting inactive prisoner locations from failed upload')
         session.post('/prisoner_locations/actions/delete_inactive/')
-        pages = int(math.ceil(location_count / settings.UPLOAD_REQUEST_PAGE_SIZE))
-        for page in range(pages):
-            session.post(
-                '/prisoner_locations/',
-                json=locations[
-                    page * settings.UPLOAD_REQUEST_PAGE_SIZE:
-                    (page + 1) * settings.UPLOAD_REQUEST_PAGE_SIZE
-                ]
-            )
-        logger.info('Deleting old prisoner locations')
-        session.post('/prisoner_locations/actions/delete_old/')
-
-        logger.info('%d prisoner locations updated successfully by %s', location_count, user_description, extra={
-            'elk_fields': {
-                '@fields.prisoner_location_count': location_count,
-                '@fields.username': username,
-            }
-        })
-        return location_count
     except HttpClientError as e:
         logger.exception('Prisoner locations update by %(user)s failed!', {'user': user_description})
-        if hasattr(e, 'content') and e.content:
-            try:
-                errors += format_errors(json.loads(e.content.decode()))
-            except ValueError:
-                errors.append(e.content)
+        errors += format_batch_failure(e, 0, None)
     except:  # noqa: E722,B001
         logger.exception('Prisoner locations update by %(user)s failed!', {'user': user_description})
+    finally:
+        if isinstance(locations, PrisonerLocationSpool):
+            locations.delete()
 
+    # mtp-api may now hold some of these locations so the next upload must send all of them
+    discard_location_snapshot()
     if not errors:
         errors.append(_('An unknown error occurred uploading prisoner locations'))
-    logger.error('Prisoner locations update failed: %r', errors)
+    stats.finish(succeeded=False)
+    logger.error('Prisoner locations update failed: %r', errors, extra={
+        'elk_fields': {
+            '@fields.username': username,
+            **stats.elk_fields(),
+        }
+    })
 
     if context.spooled:
         if user.email:
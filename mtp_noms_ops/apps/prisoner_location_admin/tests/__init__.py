@@ -1,9 +1,10 @@
 import random
 import string
+import tempfile
 from unittest import mock
 
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, override_settings
 from django.urls import reverse
 from django.utils.crypto import get_random_string
 from mtp_common.auth.api_client import MoJOAuth2Session
@@ -23,10 +24,18 @@ class PrisonerLocationUploadTestCase(SimpleTestCase):
         self.notifications_mock.start()
         self.disable_cache = mock.patch('security.models.cache')
         self.disable_cache.start().get.return_value = None
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.spool_dir_settings = override_settings(
+            LOCATION_UPLOAD_SPOOL_DIR=self.spool_dir.name,
+            LOCATION_LOAD_STATS_DIR=self.spool_dir.name,
+        )
+        self.spool_dir_settings.enable()
 
     def tearDown(self):
         self.notifications_mock.stop()
         self.disable_cache.stop()
+        self.spool_dir_settings.disable()
+        self.spool_dir.cleanup()
         super().tearDown()
 
     @mock.patch('mtp_common.auth.backends.api_client')
@@ -1,16 +1,30 @@
+import csv
+import datetime
+import io
 import json
 import logging
+import os
+import re
+import time
+import unittest
 from unittest import mock
 
-from django.test import RequestFactory, override_settings
+from django import forms
+from django.test import RequestFactory, SimpleTestCase, override_settings
 from django.urls import reverse
+from mtp_common.auth.api_client import MoJOAuth2Session
+from mtp_common.auth.test_utils import generate_tokens
 from mtp_common.test_utils import silence_logger
+import requests
 import responses
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
-from prisoner_location_admin.forms import LocationFileUploadForm
+from prisoner_location_admin.forms import LocationFileUploadForm, parse_dob
+from prisoner_location_admin.tasks import update_locations
 from prisoner_location_admin.tests import (
     PrisonerLocationUploadTestCase, generate_testable_location_data,
     get_csv_data_as_file, respond_to_upload_checks, setup_mock_get_authenticated_api_session,
+    random_dob,
 )
 from security.tests import api_url
 
@@ -50,12 +64,30 @@ class LocationFileUploadFormTestCase(PrisonerLocationUploadTestCase):
             form = LocationFileUploadForm(request.POST, request.FILES, request=request)
             self.assertTrue(form.is_valid())
 
-    def test_location_file_short_row_length_invalid(self):
-        file_data, _ = generate_testable_location_data(
-            extra_rows=['A1234GY,Smith,John,2/9/1997 00:00']
-        )
+    def test_location_file_spooled_to_disk(self):
+        file_data, expected_data = generate_testable_location_data()
 
         request = self.make_request(get_csv_data_as_file(file_data))
+        with responses.RequestsMock() as rsps:
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+        locations = form.cleaned_data['location_file']
+        self.assertEqual(len(locations), len(expected_data))
+        self.assertTrue(os.path.exists(locations.path))
+        self.assertListEqual(list(locations), expected_data)
+        locations.delete()
+        self.assertFalse(os.path.exists(locations.path))
+
+    def test_location_file_not_utf8_invalid(self):
+        file_data, _ = generate_testable_location_data()
+        file_data = get_csv_data_as_file(file_data)
+        file_data.file.seek(0, os.SEEK_END)
+        file_data.file.write('A1234ZZ,Smith,Zoë,2/9/1997,IXB'.encode('latin-1'))
+        file_data.file.seek(0)
+
+        request = self.make_request(file_data)
         with responses.RequestsMock() as rsps:
             respond_to_upload_checks(rsps)
             form = LocationFileUploadForm(request.POST, request.FILES, request=request)
@@ -63,8 +95,73 @@ class LocationFileUploadFormTestCase(PrisonerLocationUploadTestCase):
 
         self.assertEqual(
             form.errors['location_file'],
-            ['The file has the wrong number of columns']
+            ['Can’t read CSV file']
         )
+        self.assertListEqual(os.listdir(self.spool_dir.name), [])
+
+    def test_location_file_short_row_length_reported(self):
+        file_data, expected_data = generate_testable_location_data(
+            extra_rows=['A1234GY,Smith,John,2/9/1997 00:00']
+        )
+
+        request = self.make_request(get_csv_data_as_file(file_data))
+        with responses.RequestsMock() as rsps:
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+        self.assertListEqual(list(form.cleaned_data['location_file']), expected_data)
+        self.assertDictEqual(form.report.counts, {'columns': 1})
+        with io.StringIO(form.report.get_contents().decode()) as f:
+            self.assertListEqual(list(csv.reader(f)), [
+                ['Row', 'NOMIS Number', 'Category', 'Problem'],
+                ['2', 'A1234GY', 'columns', 'Row has 4 columns but 5 are expected'],
+            ])
+
+    def test_location_file_problems_reported_in_one_pass(self):
+        file_data, expected_data = generate_testable_location_data(length=10, extra_rows=[
+            'A1234GY,Smith,John,2/9/1997 00:00',
+            'A1234ZZ,Smith,John,31/2/1997,IXB',
+            'A1235ZZ,Smith,Fred,2/9/1997,ZCH',
+            'A1236ZZ,Smith,Fred,2/9/1997,TRN',
+            'A1237ZZ,Smith,Jack,1990-01-01,INP',
+        ])
+
+        request = self.make_request(get_csv_data_as_file(file_data))
+        with responses.RequestsMock() as rsps:
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+        # only valid rows proceed
+        self.assertListEqual(list(form.cleaned_data['location_file']), expected_data)
+        self.assertEqual(form.cleaned_data['transfer_count'], 1)
+        self.assertDictEqual(form.cleaned_data['skipped_counts'], {'ZCH': 1})
+        self.assertEqual(len(form.report), 4)
+        self.assertListEqual(
+            [(str(description), count) for description, count in form.report.summary()],
+            [('Wrong number of columns', 1), ('Invalid date of birth', 2), ('Unsupported prison', 1)],
+        )
+        with io.StringIO(form.report.get_contents().decode()) as f:
+            self.assertListEqual(list(csv.reader(f))[1:], [
+                ['2', 'A1234GY', 'columns', 'Row has 4 columns but 5 are expected'],
+                ['3', 'A1234ZZ', 'dob', 'Date of birth "31/2/1997" is not in a valid format'],
+                ['4', 'A1235ZZ', 'prison', 'Prison "ZCH" is not supported'],
+                ['6', 'A1237ZZ', 'dob', 'Date of birth "1990-01-01" is not in a valid format'],
+            ])
+
+    def test_location_file_without_problems_has_no_report(self):
+        file_data, _ = generate_testable_location_data()
+
+        request = self.make_request(get_csv_data_as_file(file_data))
+        with responses.RequestsMock() as rsps:
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+        self.assertIsNone(form.report)
+        self.assertEqual(len(os.listdir(self.spool_dir.name)), 1)
+        form.cleaned_data['location_file'].delete()
 
     def test_location_file_empty_file_invalid(self):
         request = self.make_request(get_csv_data_as_file(''))
@@ -135,11 +232,11 @@ class LocationFileUploadFormTestCase(PrisonerLocationUploadTestCase):
 
         file_data, expected_data = generate_testable_location_data(length=50)
         expected_calls = [
-            expected_data[40:50],
-            expected_data[30:40],
-            expected_data[20:30],
-            expected_data[10:20],
             expected_data[0:10],
+            expected_data[10:20],
+            expected_data[20:30],
+            expected_data[30:40],
+            expected_data[40:50],
         ]
 
         request = self.make_request(get_csv_data_as_file(file_data))
@@ -163,15 +260,214 @@ class LocationFileUploadFormTestCase(PrisonerLocationUploadTestCase):
             )
             form.update_locations()
 
-            for call in rsps.calls:
-                if call.request.url == api_url('/prisoner_locations/'):
-                    self.assertEqual(
-                        json.loads(call.request.body.decode()),
-                        expected_calls.pop()
-                    )
+            # batches are uploaded concurrently so may arrive in any order
+            self.assertCountEqual(
+                [
+                    json.loads(call.request.body.decode())
+                    for call in rsps.calls
+                    if call.request.url == api_url('/prisoner_locations/')
+                ],
+                expected_calls
+            )
+            self.assertEqual(rsps.calls[-1].request.url, api_url('/prisoner_locations/actions/delete_old/'))
 
-        if expected_calls:
-            self.fail('Not all location data was uploaded')
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=10, UPLOAD_REQUEST_RETRIES=2, UPLOAD_REQUEST_RETRY_BACKOFF=0)
+    def test_location_file_batch_upload_restarts_after_server_errors(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+
+        file_data, expected_data = generate_testable_location_data(length=10)
+
+        request = self.make_request(get_csv_data_as_file(file_data))
+
+        with responses.RequestsMock() as rsps, silence_logger(level=logging.ERROR):
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/actions/delete_inactive/')
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+                status=502,
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+                status=503,
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/actions/delete_old/')
+            )
+            form.update_locations()
+
+            upload_calls = [
+                json.loads(call.request.body.decode())
+                for call in rsps.calls
+                if call.request.url == api_url('/prisoner_locations/')
+            ]
+            self.assertEqual(upload_calls, [expected_data] * 3)
+            # batches that may have been saved are deleted before restarting
+            self.assertListEqual(
+                [call.request.url for call in rsps.calls[-7:]],
+                [
+                    api_url('/prisoner_locations/actions/delete_inactive/'),
+                    api_url('/prisoner_locations/'),
+                ] * 3 + [api_url('/prisoner_locations/actions/delete_old/')],
+            )
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=10, UPLOAD_REQUEST_RETRIES=2, UPLOAD_REQUEST_RETRY_BACKOFF=0)
+    def test_location_file_batch_upload_retries_batches_not_sent(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+
+        file_data, expected_data = generate_testable_location_data(length=10)
+
+        request = self.make_request(get_csv_data_as_file(file_data))
+
+        with responses.RequestsMock() as rsps, silence_logger(level=logging.ERROR):
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/actions/delete_inactive/')
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+                body=requests.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused'))),
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/actions/delete_old/')
+            )
+            form.update_locations()
+
+            self.assertListEqual(
+                [call.request.url for call in rsps.calls[-4:]],
+                [
+                    api_url('/prisoner_locations/actions/delete_inactive/'),
+                    api_url('/prisoner_locations/'),
+                    api_url('/prisoner_locations/'),
+                    api_url('/prisoner_locations/actions/delete_old/'),
+                ],
+            )
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=10, UPLOAD_REQUEST_RETRIES=2, UPLOAD_REQUEST_RETRY_BACKOFF=0)
+    def test_location_file_batch_upload_does_not_repost_timed_out_batches(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+
+        _, expected_data = generate_testable_location_data(length=10)
+        user = mock.MagicMock(email='')
+        user.user_data = {'username': 'shall'}
+
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/actions/delete_inactive/')
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+                body=requests.ReadTimeout(),
+            )
+            # a generator cannot be read again so the upload cannot be restarted
+            with self.assertRaises(forms.ValidationError):
+                update_locations(user=user, locations=(location for location in expected_data))
+
+            self.assertListEqual(
+                [call.request.url for call in rsps.calls],
+                [
+                    api_url('/prisoner_locations/actions/delete_inactive/'),
+                    api_url('/prisoner_locations/'),
+                    api_url('/prisoner_locations/actions/delete_inactive/'),
+                ],
+            )
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=10, UPLOAD_REQUEST_CONCURRENCY=2)
+    def test_location_file_batch_upload_workers_have_own_sessions(self, mock_api_client):
+        sessions = []
+
+        def get_authenticated_api_session(*args):
+            session = MoJOAuth2Session(token=generate_tokens())
+            sessions.append(session)
+            return session
+
+        mock_api_client.get_authenticated_api_session.side_effect = get_authenticated_api_session
+        _, expected_data = generate_testable_location_data(length=50)
+        user = mock.MagicMock()
+        user.user_data = {'username': 'shall'}
+
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_inactive/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_old/'))
+            update_locations(user=user, locations=expected_data)
+            self.assertEqual(sum(call.request.url == api_url('/prisoner_locations/') for call in rsps.calls), 5)
+
+        # one for the task and one for each worker thread
+        self.assertIn(len(sessions), (2, 3))
+        self.assertEqual(len(set(map(id, sessions))), len(sessions))
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=10, UPLOAD_REQUEST_CONCURRENCY=1)
+    def test_location_file_batch_upload_errors_report_file_rows(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+
+        file_data, expected_data = generate_testable_location_data(length=20)
+
+        request = self.make_request(get_csv_data_as_file(file_data))
+
+        with responses.RequestsMock() as rsps, silence_logger():
+            respond_to_upload_checks(rsps)
+            form = LocationFileUploadForm(request.POST, request.FILES, request=request)
+            self.assertTrue(form.is_valid())
+
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/actions/delete_inactive/')
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+            )
+            rsps.add(
+                rsps.POST,
+                api_url('/prisoner_locations/'),
+                status=400,
+                json=[{}, {}, {'prison': ['Prison not found']}] + [{}] * 7,
+            )
+            with self.assertRaises(forms.ValidationError) as e:
+                form.update_locations()
+
+            self.assertEqual(
+                e.exception.messages,
+                ['Row 13 (%s): Prison not found' % expected_data[12]['prisoner_number']]
+            )
+            self.assertEqual(
+                [call.request.url for call in rsps.calls[-3:]],
+                [
+                    api_url('/prisoner_locations/'),
+                    api_url('/prisoner_locations/'),
+                    api_url('/prisoner_locations/actions/delete_inactive/'),
+                ]
+            )
 
     @mock.patch('prisoner_location_admin.tasks.api_client')
     @override_settings(UPLOAD_REQUEST_PAGE_SIZE=50)
@@ -214,3 +510,44 @@ class LocationFileUploadFormTestCase(PrisonerLocationUploadTestCase):
 
         if expected_calls:
             self.fail('Not all location data was uploaded')
+
+
+def parse_dob_with_strptime(dob):
+    # original implementation of parse_dob which the hand-rolled version must match
+    dob_matches = re.match(r'(?P<dob>\d{1,2}/\d{1,2}/\d{2,4}).*', dob)
+    if dob_matches:
+        for date_format in ('%d/%m/%Y', '%d/%m/%y'):
+            try:
+                return datetime.datetime.strptime(dob_matches.group('dob'), date_format).strftime('%Y-%m-%d')
+            except ValueError:
+                pass
+    return None
+
+
+class ParseDobTestCase(SimpleTestCase):
+    samples = [
+        '2/9/1997', '02/09/1997 00:00', '2/9/1997 0:00:00', '31/12/68', '1/1/69', '01/01/00',
+        '29/2/2000', '29/2/1900', '31/4/1990', '0/1/1990', '1/0/1990', '32/1/1990', '1/13/1990',
+        '1/1/199', '1/1/1', '1/1/19900', '1/1/1990x', '1/1/19x0', '01/01/0999', '1/1/0000',
+        '123/1/1990', '1/123/1990', '1-1-1990', '1990-01-01', '', ' 1/1/1990', '1/1/ 1990', 'a/b/cdef',
+    ]
+
+    def test_matches_strptime(self):
+        for dob in self.samples + [random_dob()[1] for _ in range(500)]:
+            self.assertEqual(parse_dob(dob), parse_dob_with_strptime(dob), msg=dob)
+
+    @unittest.skipUnless(os.environ.get('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+    def test_benchmark(self):
+        dobs = [random_dob()[1] for _ in range(100_000)]
+
+        start = time.perf_counter()
+        for dob in dobs:
+            parse_dob_with_strptime(dob)
+        strptime_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for dob in dobs:
+            parse_dob(dob)
+        duration = time.perf_counter() - start
+
+        self.assertLess(duration, strptime_duration)
@@ -1,6 +1,12 @@
 import collections
 import datetime
 import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
 from unittest import mock
 
 from django.core.management import call_command
@@ -10,11 +16,13 @@ from mtp_common.auth import MojUser
 from mtp_common.test_utils import silence_logger
 import responses
 
+from prisoner_location_admin.checkpoint import LocationLoadCheckpoint
 from prisoner_location_admin.management.commands.load_locations_from_offender_search import (
-    OffenderSearchPrisonerList, OffenderSearchPrisoner,
+    OffenderSearchPrisonerList, OffenderSearchPrisoner, to_prisoner_location,
 )
+from prisoner_location_admin.spool import PrisonerLocationSpool
 from prisoner_location_admin.tests import (
-    setup_mock_get_authenticated_api_session,
+    generate_testable_location_data, setup_mock_get_authenticated_api_session,
     random_dob, random_prisoner_name, random_prisoner_num,
 )
 from security.tests import api_url
@@ -25,8 +33,23 @@ from security.tests.test_forms.test_search_forms import mock_prison_response
     CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
     HMPPS_AUTH_BASE_URL='https://hmpps-auth-dev.local',
     HMPPS_OFFENDER_SEARCH_BASE_URL='https://offender-search-dev.local',
+    OFFENDER_SEARCH_RETRY_BACKOFF=0,
 )
 class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checkpoint_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir_settings = override_settings(
+            LOCATION_LOAD_CHECKPOINT_DIR=self.checkpoint_dir.name,
+            LOCATION_LOAD_STATS_DIR=self.checkpoint_dir.name,
+        )
+        self.checkpoint_dir_settings.enable()
+
+    def tearDown(self):
+        self.checkpoint_dir_settings.disable()
+        self.checkpoint_dir.cleanup()
+        super().tearDown()
+
     @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
     @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.is_first_instance')
     @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.timezone')
@@ -70,6 +93,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
             datetime.datetime(2023, 10, 23, 11, 42)
         )
         setup_mock_get_authenticated_api_session(mock_api_client)
+        consume_streamed_locations(mock_update_locations)
 
         with silence_logger(), responses.RequestsMock() as rsps:
             mock_get_uploading_user(rsps)
@@ -96,6 +120,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
             datetime.datetime(2023, 10, 23, 7, 42)
         )
         setup_mock_get_authenticated_api_session(mock_api_client)
+        consume_streamed_locations(mock_update_locations)
 
         with silence_logger(), responses.RequestsMock() as rsps:
             mock_get_uploading_user(rsps)
@@ -122,6 +147,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
             datetime.datetime(2023, 10, 23, 11, 42)
         )
         setup_mock_get_authenticated_api_session(mock_api_client)
+        consume_streamed_locations(mock_update_locations)
 
         with silence_logger(), responses.RequestsMock() as rsps:
             mock_get_uploading_user(rsps)
@@ -191,6 +217,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
     def test_one_offender_found(self, mock_update_locations, mock_api_client_command, mock_api_client_task):
         setup_mock_get_authenticated_api_session(mock_api_client_command)
         setup_mock_get_authenticated_api_session(mock_api_client_task)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
 
         with responses.RequestsMock() as rsps:
             mock_get_uploading_user(rsps)
@@ -206,7 +233,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
         user = update_locations_call.kwargs['user']
         self.assertIsInstance(user, MojUser)
         self.assertEqual(user.username, 'prisoner-location-admin')
-        prisoner_locations = update_locations_call.kwargs['locations']
+        prisoner_locations = streamed_locations
         self.assertEqual(len(prisoner_locations), 1)
         prisoner_location = prisoner_locations[0]
         self.assertTrue(all(
@@ -221,6 +248,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
     def test_two_offenders_found(self, mock_update_locations, mock_api_client_command, mock_api_client_task):
         setup_mock_get_authenticated_api_session(mock_api_client_command)
         setup_mock_get_authenticated_api_session(mock_api_client_task)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
 
         with responses.RequestsMock() as rsps:
             mock_get_uploading_user(rsps)
@@ -232,8 +260,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
             call_command('load_locations_from_offender_search')
 
         mock_update_locations.assert_called_once()
-        update_locations_call = mock_update_locations.mock_calls[-1]
-        prisoner_locations = update_locations_call.kwargs['locations']
+        prisoner_locations = streamed_locations
         self.assertEqual(len(prisoner_locations), 2)
         prisoner_location_counts_by_prison = collections.defaultdict(int)
         for prisoner_location in prisoner_locations:
@@ -246,6 +273,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
     def test_four_offenders_found(self, mock_update_locations, mock_api_client_command, mock_api_client_task):
         setup_mock_get_authenticated_api_session(mock_api_client_command)
         setup_mock_get_authenticated_api_session(mock_api_client_task)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
 
         with responses.RequestsMock() as rsps:
             mock_get_uploading_user(rsps)
@@ -257,8 +285,7 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
             call_command('load_locations_from_offender_search')
 
         mock_update_locations.assert_called_once()
-        update_locations_call = mock_update_locations.mock_calls[-1]
-        prisoner_locations = update_locations_call.kwargs['locations']
+        prisoner_locations = streamed_locations
         self.assertEqual(len(prisoner_locations), 4)
         prisoner_location_counts_by_prison = collections.defaultdict(int)
         for prisoner_location in prisoner_locations:
@@ -313,6 +340,375 @@ class LoadLocationsFromOffenderSearchTestCase(SimpleTestCase):
 
             call_command('load_locations_from_offender_search')
 
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=3, UPLOAD_REQUEST_CONCURRENCY=1)
+    def test_prisoner_locations_streamed_into_upload_batches(self, mock_api_client_command, mock_api_client_task):
+        setup_mock_get_authenticated_api_session(mock_api_client_command)
+        setup_mock_get_authenticated_api_session(mock_api_client_task)
+        offender_search = OffenderSearchStub(page_size=2, IXB=5, INP=3)
+
+        with responses.RequestsMock() as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            rsps.post(api_url('/prisoner_locations/actions/delete_inactive/'))
+            rsps.post(api_url('/prisoner_locations/'))
+            rsps.post(api_url('/prisoner_locations/actions/delete_old/'))
+
+            call_command('load_locations_from_offender_search')
+
+            api_calls = [call for call in rsps.calls if call.request.url.startswith(api_url('/prisoner_locations/'))]
+
+        self.assertEqual(api_calls[0].request.url, api_url('/prisoner_locations/actions/delete_inactive/'))
+        self.assertEqual(api_calls[-1].request.url, api_url('/prisoner_locations/actions/delete_old/'))
+        batches = [json.loads(call.request.body.decode()) for call in api_calls[1:-1]]
+        self.assertListEqual(list(map(len, batches)), [3, 3, 2])
+        self.assertListEqual(
+            [location['prisoner_number'] for batch in batches for location in batch],
+            [
+                offender['prisonerNumber']
+                for offender in offender_search.offenders['IXB'] + offender_search.offenders['INP']
+            ]
+        )
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=2, OFFENDER_SEARCH_RETRIES=0)
+    def test_offender_search_failure_during_upload_deletes_inactive_locations(
+        self, mock_api_client_command, mock_api_client_task,
+    ):
+        setup_mock_get_authenticated_api_session(mock_api_client_command)
+        setup_mock_get_authenticated_api_session(mock_api_client_task)
+        offender_search = OffenderSearchStub(page_size=2, broken_pages={('INP', 1)}, IXB=3, INP=3)
+
+        with silence_logger(), responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            rsps.post(api_url('/prisoner_locations/actions/delete_inactive/'))
+            rsps.post(api_url('/prisoner_locations/'))
+            rsps.post(api_url('/prisoner_locations/actions/delete_old/'))
+
+            call_command('load_locations_from_offender_search')
+
+            api_urls = [call.request.url for call in rsps.calls if call.request.method == 'POST']
+
+        self.assertNotIn(api_url('/prisoner_locations/actions/delete_old/'), api_urls)
+        self.assertEqual(api_urls[-1], api_url('/prisoner_locations/actions/delete_inactive/'))
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    def test_locations_spooled_for_differential_upload(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        offender_search = OffenderSearchStub(page_size=2, IXB=3, INP=1)
+
+        with tempfile.TemporaryDirectory() as temp_dir, override_settings(
+            LOCATION_UPLOAD_SPOOL_DIR=temp_dir,
+            LOCATION_UPLOAD_DIFFERENTIAL=True,
+            LOCATION_UPLOAD_SNAPSHOT_PATH=os.path.join(temp_dir, 'locations.csv.gz'),
+        ):
+            with responses.RequestsMock() as rsps:
+                mock_get_uploading_user(rsps)
+                mock_prison_response(rsps)
+                mock_hmpps_auth_token(rsps)
+                offender_search.register(rsps)
+
+                call_command('load_locations_from_offender_search')
+
+            prisoner_locations = mock_update_locations.mock_calls[-1].kwargs['locations']
+            self.assertIsInstance(prisoner_locations, PrisonerLocationSpool)
+            self.assertEqual(len(prisoner_locations), 4)
+            self.assertEqual(len(list(prisoner_locations)), 4)
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    @override_settings(OFFENDER_SEARCH_CONCURRENCY=3)
+    def test_concurrent_search_results_merged_in_order(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
+        offender_search = OffenderSearchStub(page_size=2, IXB=5, INP=3)
+
+        with responses.RequestsMock() as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search')
+
+        self.assertCountEqual(offender_search.requested_pages, [
+            ('IXB', 0), ('IXB', 1), ('IXB', 2),
+            ('INP', 0), ('INP', 1),
+        ])
+        prisoner_locations = streamed_locations
+        self.assertListEqual(
+            [prisoner_location['prisoner_number'] for prisoner_location in prisoner_locations],
+            [
+                offender['prisonerNumber']
+                for offender in offender_search.offenders['IXB'] + offender_search.offenders['INP']
+            ]
+        )
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    def test_pages_loaded_until_last_when_total_grows(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
+        # the first page reports 3 offenders in IXB but 4 more are added while the rest load
+        offender_search = OffenderSearchStub(page_size=2, added_offenders={'IXB': 4}, IXB=3, INP=1)
+
+        with responses.RequestsMock() as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search')
+
+        self.assertCountEqual(offender_search.requested_pages, [
+            ('IXB', 0), ('IXB', 1), ('IXB', 2), ('IXB', 3),
+            ('INP', 0),
+        ])
+        self.assertEqual(len(offender_search.offenders['IXB']), 7)
+        self.assertListEqual(
+            [prisoner_location['prisoner_number'] for prisoner_location in streamed_locations],
+            [
+                offender['prisonerNumber']
+                for offender in offender_search.offenders['IXB'] + offender_search.offenders['INP']
+            ]
+        )
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    @override_settings(OFFENDER_SEARCH_RETRIES=2)
+    def test_offender_search_retried(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
+        offender_search = OffenderSearchStub(page_size=2, failures=2, IXB=3, INP=1)
+
+        with responses.RequestsMock() as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search')
+
+        prisoner_locations = streamed_locations
+        self.assertEqual(len(prisoner_locations), 4)
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    @override_settings(OFFENDER_SEARCH_RETRIES=0, LOCATION_LOAD_CHECKPOINT=True)
+    def test_resumes_after_offender_search_failure(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
+        offender_search = OffenderSearchStub(page_size=2, broken_pages={('INP', 1)}, IXB=3, INP=5)
+
+        with silence_logger(), responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search')
+
+        checkpoint = LocationLoadCheckpoint()
+        self.assertTrue(checkpoint.load(['IXB', 'INP']))
+        self.assertTrue(checkpoint.is_complete('IXB'))
+        self.assertEqual(checkpoint.pages_loaded('INP'), 1)
+        self.assertEqual(checkpoint.location_count, 5)
+
+        offender_search.broken_pages.clear()
+        offender_search.requested_pages.clear()
+        streamed_locations.clear()
+        with responses.RequestsMock() as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search', resume=True)
+
+        self.assertListEqual(offender_search.requested_pages, [('INP', 1), ('INP', 2)])
+        self.assertListEqual(
+            [prisoner_location['prisoner_number'] for prisoner_location in streamed_locations],
+            [
+                offender['prisonerNumber']
+                for offender in offender_search.offenders['IXB'] + offender_search.offenders['INP']
+            ]
+        )
+        self.assertFalse(LocationLoadCheckpoint().load(['IXB', 'INP']), 'checkpoint should be deleted after upload')
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    @override_settings(OFFENDER_SEARCH_RETRIES=0)
+    def test_checkpoint_only_saved_if_enabled(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        consume_streamed_locations(mock_update_locations)
+        offender_search = OffenderSearchStub(page_size=2, broken_pages={('INP', 1)}, IXB=3, INP=5)
+
+        with silence_logger(), responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search')
+
+        self.assertFalse(any(
+            name.startswith('prisoner-location-load') for name in os.listdir(self.checkpoint_dir.name)
+        ))
+
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.api_client')
+    @mock.patch('prisoner_location_admin.management.commands.load_locations_from_offender_search.update_locations')
+    def test_checkpoint_ignored_unless_resuming(self, mock_update_locations, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        streamed_locations = consume_streamed_locations(mock_update_locations)
+        offender_search = OffenderSearchStub(page_size=2, IXB=3, INP=1)
+
+        checkpoint = LocationLoadCheckpoint()
+        checkpoint.reset(['IXB', 'INP'])
+        checkpoint.record_page('IXB', 0, 2, [to_prisoner_location(offender_search.offenders['IXB'][0])])
+
+        with responses.RequestsMock() as rsps:
+            mock_get_uploading_user(rsps)
+            mock_prison_response(rsps)
+            mock_hmpps_auth_token(rsps)
+            offender_search.register(rsps)
+
+            call_command('load_locations_from_offender_search')
+
+        self.assertCountEqual(offender_search.requested_pages, [('IXB', 0), ('IXB', 1), ('INP', 0)])
+        self.assertEqual(len(streamed_locations), 4)
+
+
+class LocationLoadCheckpointTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checkpoint_dir = tempfile.TemporaryDirectory()
+        self.checkpoint = LocationLoadCheckpoint(self.checkpoint_dir.name)
+
+    def tearDown(self):
+        self.checkpoint_dir.cleanup()
+        super().tearDown()
+
+    def test_unsaved_page_discarded(self):
+        _, locations = generate_testable_location_data(length=4)
+        self.checkpoint.reset(['IXB'])
+        self.checkpoint.record_page('IXB', 0, 3, locations[:2])
+        # simulate failure after writing locations but before saving progress
+        with open(self.checkpoint.locations_path, 'a') as f:
+            f.write('A1234AA,JOHN HALLS,1980-01-01,IXB\r\n')
+
+        checkpoint = LocationLoadCheckpoint(self.checkpoint_dir.name)
+        self.assertTrue(checkpoint.load(['IXB']))
+        self.assertEqual(checkpoint.pages_loaded('IXB'), 1)
+        self.assertEqual(checkpoint.page_count('IXB'), 3)
+        self.assertListEqual(list(checkpoint.iter_locations()), locations[:2])
+
+        checkpoint.record_page('IXB', 1, 3, locations[2:])
+        self.assertListEqual(list(checkpoint.iter_locations()), locations)
+
+    def test_checkpoint_for_other_prisons_ignored(self):
+        self.checkpoint.reset(['IXB'])
+        with silence_logger():
+            self.assertFalse(LocationLoadCheckpoint(self.checkpoint_dir.name).load(['IXB', 'INP']))
+
+    @override_settings(LOCATION_LOAD_CHECKPOINT_MAX_AGE=60)
+    def test_old_checkpoint_ignored(self):
+        self.checkpoint.reset(['IXB'])
+        an_hour_ago = time.time() - 3600
+        os.utime(self.checkpoint.state_path, (an_hour_ago, an_hour_ago))
+        with silence_logger():
+            self.assertFalse(LocationLoadCheckpoint(self.checkpoint_dir.name).load(['IXB']))
+
+
+class OffenderSearchStub:
+    """
+    Serves pages of generated offenders per prison like the offender search api
+    optionally failing the first requests or always failing some pages with a 503 response
+    """
+
+    def __init__(self, page_size=500, failures=0, broken_pages=(), added_offenders=None, **offender_counts):
+        self.page_size = page_size
+        self.failures = failures
+        self.broken_pages = set(broken_pages)
+        # offenders added to the end of a prison's list once its first page has been loaded
+        self.added_offenders = dict(added_offenders or {})
+        self.offenders = {
+            prison_id: self.make_offenders(prison_id, offender_count)
+            for prison_id, offender_count in offender_counts.items()
+        }
+        self.requested_pages = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def make_offenders(cls, prison_id, offender_count, start=0):
+        return sorted(
+            (
+                OffenderSearchPrisoner(
+                    prisonId=prison_id, cellLocation=f'1-1-{index:03}',
+                    prisonerNumber=random_prisoner_num(), bookingId=f'1{index:04}',
+                    firstName=random_prisoner_name()[0], middleNames=None, lastName=random_prisoner_name()[1],
+                    dateOfBirth=random_dob()[0],
+                )
+                for index in range(start, start + offender_count)
+            ),
+            key=lambda offender: offender['prisonerNumber'],
+        )
+
+    def register(self, rsps: responses.RequestsMock):
+        rsps.add_callback(
+            rsps.GET,
+            re.compile(r'^https://offender-search-dev\.local/prison/(?P<prison_id>[A-Z]{3})/prisoners'),
+            callback=self.respond,
+        )
+
+    def respond(self, request):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                return 503, {}, ''
+            url = urllib.parse.urlsplit(request.url)
+            prison_id = url.path.split('/')[2]
+            query = urllib.parse.parse_qs(url.query)
+            page = int(query['page'][0])
+            self.requested_pages.append((prison_id, page))
+            if (prison_id, page) in self.broken_pages:
+                return 503, {}, ''
+            page_size = min(int(query['size'][0]), self.page_size)
+            offenders = list(self.offenders.get(prison_id, []))
+            if page == 0 and prison_id in self.added_offenders:
+                self.offenders[prison_id] += self.make_offenders(
+                    prison_id, self.added_offenders.pop(prison_id), start=len(offenders),
+                )
+        content = offenders[page * page_size:(page + 1) * page_size]
+        return 200, {}, json.dumps(OffenderSearchPrisonerList(
+            content=content,
+            totalElements=len(offenders),
+            last=(page + 1) * page_size >= len(offenders),
+        ))
+
+
+def consume_streamed_locations(mock_update_locations: mock.MagicMock) -> list:
+    """
+    Locations are streamed from offender search into update_locations
+    so the generator needs consuming while responses are mocked
+    """
+    streamed_locations = []
+
+    def update_locations(*, user, locations):
+        streamed_locations.extend(locations)
+
+    mock_update_locations.side_effect = update_locations
+    return streamed_locations
+
 
 def mock_get_uploading_user(rsps: responses.RequestsMock):
     rsps.get(api_url('/users/prisoner-location-admin/'), json=dict(
@@ -0,0 +1,59 @@
+import pickle
+
+from django.test import SimpleTestCase
+
+from prisoner_location_admin.models import PrisonerLocationBatch
+from prisoner_location_admin.spool import iter_batches
+from prisoner_location_admin.tests import generate_testable_location_data
+
+
+class PrisonerLocationBatchTestCase(SimpleTestCase):
+    def test_locations_round_trip(self):
+        _, locations = generate_testable_location_data(length=50)
+        locations[3]['prisoner_dob'] = '1/2/1980'
+        batch = PrisonerLocationBatch(locations)
+
+        self.assertEqual(len(batch), 50)
+        self.assertListEqual(list(batch), locations)
+        self.assertListEqual(batch.as_payload(), locations)
+        self.assertDictEqual(batch[3], locations[3])
+        self.assertDictEqual(batch[-1], locations[-1])
+        self.assertListEqual(batch[10:20].as_payload(), locations[10:20])
+        with self.assertRaises(IndexError):
+            batch[50]
+
+    def test_irregular_dates_of_birth_round_trip(self):
+        _, locations = generate_testable_location_data(length=4)
+        locations[0]['prisoner_dob'] = '0000-00-00'
+        locations[1]['prisoner_dob'] = '0001-01-01'
+        locations[2]['prisoner_dob'] = '１９９０-01-01'
+        batch = PrisonerLocationBatch(locations)
+
+        self.assertListEqual(list(batch), locations)
+        self.assertListEqual(sorted(batch.unpacked_dobs), [0, 2])
+
+    def test_prison_codes_stored_once(self):
+        _, locations = generate_testable_location_data(length=50)
+        batch = PrisonerLocationBatch(locations)
+        self.assertListEqual(sorted(batch.prisons), sorted({location['prison'] for location in locations}))
+        self.assertDictEqual(batch.unpacked_dobs, {})
+
+    def test_pickles_compactly(self):
+        _, locations = generate_testable_location_data(length=500)
+        locations[0]['prisoner_dob'] = 'unknown'
+        batch = PrisonerLocationBatch(locations)
+
+        pickled_batch = pickle.dumps(batch)
+        self.assertLess(len(pickled_batch), len(pickle.dumps(locations)) * 2 / 3)
+
+        unpickled_batch = pickle.loads(pickled_batch)
+        self.assertEqual(unpickled_batch, batch)
+        unpickled_batch.append(locations[1])
+        self.assertEqual(len(unpickled_batch.prisons), len(batch.prisons))
+
+    def test_iter_batches(self):
+        _, locations = generate_testable_location_data(length=25)
+        batches = list(iter_batches(iter(locations), 10))
+        self.assertListEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertTrue(all(isinstance(batch, PrisonerLocationBatch) for batch in batches))
+        self.assertListEqual([location for batch in batches for location in batch], locations)
@@ -0,0 +1,186 @@
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+from mtp_common.test_utils import silence_logger
+import responses
+
+from prisoner_location_admin.snapshot import LocationSnapshot, diff_locations, get_location_snapshot
+from prisoner_location_admin.tasks import update_locations
+from prisoner_location_admin.tests import generate_testable_location_data, setup_mock_get_authenticated_api_session
+from security.tests import api_url
+
+
+class LocationSnapshotTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.snapshot = LocationSnapshot(os.path.join(self.snapshot_dir.name, 'locations.csv.gz'))
+
+    def tearDown(self):
+        self.snapshot_dir.cleanup()
+        super().tearDown()
+
+    def test_missing_snapshot(self):
+        self.assertIsNone(self.snapshot.load())
+
+    def test_saved_snapshot_keyed_by_prisoner_number(self):
+        _, locations = generate_testable_location_data(length=5)
+        self.snapshot.save(locations)
+        self.assertDictEqual(self.snapshot.load(), {
+            location['prisoner_number']: (location['prisoner_name'], location['prisoner_dob'], location['prison'])
+            for location in locations
+        })
+        self.assertEqual(os.listdir(self.snapshot_dir.name), ['locations.csv.gz'])
+
+    @override_settings(LOCATION_UPLOAD_SNAPSHOT_MAX_AGE=60)
+    def test_old_snapshot_ignored(self):
+        _, locations = generate_testable_location_data(length=5)
+        self.snapshot.save(locations)
+        an_hour_ago = time.time() - 3600
+        os.utime(self.snapshot.path, (an_hour_ago, an_hour_ago))
+        self.assertIsNone(self.snapshot.load())
+
+    def test_corrupt_snapshot_ignored(self):
+        with open(self.snapshot.path, 'wb') as f:
+            f.write(b'not gzipped')
+        with silence_logger():
+            self.assertIsNone(self.snapshot.load())
+
+    def test_diff(self):
+        previous_locations = [
+            {'prisoner_number': 'A1234AA', 'prisoner_name': 'JOHN HALLS',
+             'prisoner_dob': '1980-01-01', 'prison': 'IXB'},
+            {'prisoner_number': 'A1234AB', 'prisoner_name': 'FRED SMITH',
+             'prisoner_dob': '1981-01-01', 'prison': 'IXB'},
+            {'prisoner_number': 'A1234AC', 'prisoner_name': 'MARY JONES',
+             'prisoner_dob': '1982-01-01', 'prison': 'INP'},
+        ]
+        self.snapshot.save(previous_locations)
+        locations = [
+            previous_locations[0],
+            dict(previous_locations[1], prison='INP'),
+            {'prisoner_number': 'A1234AD', 'prisoner_name': 'JANE BROWN',
+             'prisoner_dob': '1983-01-01', 'prison': 'IXB'},
+        ]
+        changes = diff_locations(self.snapshot.load(), locations)
+        self.assertListEqual(list(changes.changed), locations[1:])
+        self.assertListEqual(changes.removed, ['A1234AC'])
+        self.assertEqual(changes.count, 3)
+
+
+class DifferentialUploadTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot_dir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.snapshot_dir.name, 'locations.csv.gz')
+        self.snapshot_settings = override_settings(
+            LOCATION_UPLOAD_DIFFERENTIAL=True,
+            LOCATION_UPLOAD_SNAPSHOT_PATH=self.snapshot_path,
+            LOCATION_LOAD_STATS_DIR=self.snapshot_dir.name,
+        )
+        self.snapshot_settings.enable()
+        self.user = mock.MagicMock()
+        self.user.user_data = {'username': 'shall'}
+        self.user.get_full_name.return_value = 'Sam Hall'
+
+    def tearDown(self):
+        self.snapshot_settings.disable()
+        self.snapshot_dir.cleanup()
+        super().tearDown()
+
+    def full_upload(self, rsps, locations):
+        rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_inactive/'))
+        rsps.add(rsps.POST, api_url('/prisoner_locations/'))
+        rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_old/'))
+        with silence_logger():
+            update_locations(user=self.user, locations=locations)
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    def test_only_changes_uploaded(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        _, locations = generate_testable_location_data(length=20)
+
+        with responses.RequestsMock() as rsps:
+            self.full_upload(rsps, locations)
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+        moved_location = dict(locations[0], prison='INP' if locations[0]['prison'] == 'IXB' else 'IXB')
+        new_locations = [moved_location, *locations[1:-1]]
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/update/'))
+            update_locations(user=self.user, locations=new_locations)
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertDictEqual(json.loads(rsps.calls[0].request.body), {
+                'locations': [moved_location],
+                'removed_prisoner_numbers': [locations[-1]['prisoner_number']],
+            })
+
+        self.assertEqual(len(LocationSnapshot(self.snapshot_path).load()), 19)
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    def test_full_upload_when_differential_update_unsupported(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        _, locations = generate_testable_location_data(length=20)
+
+        with responses.RequestsMock() as rsps:
+            self.full_upload(rsps, locations)
+
+        new_locations = locations[1:]
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/update/'), status=404)
+            self.full_upload(rsps, new_locations)
+            self.assertEqual(
+                [call.request.url for call in rsps.calls],
+                [
+                    api_url('/prisoner_locations/actions/update/'),
+                    api_url('/prisoner_locations/actions/delete_inactive/'),
+                    api_url('/prisoner_locations/'),
+                    api_url('/prisoner_locations/actions/delete_old/'),
+                ]
+            )
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(LOCATION_UPLOAD_DIFFERENTIAL_LIMIT=0.1)
+    def test_full_upload_when_many_changes(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        _, locations = generate_testable_location_data(length=20)
+
+        with responses.RequestsMock() as rsps:
+            self.full_upload(rsps, locations)
+
+        _, new_locations = generate_testable_location_data(length=20)
+        with responses.RequestsMock() as rsps:
+            self.full_upload(rsps, new_locations)
+            self.assertEqual(len(rsps.calls), 3)
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    def test_full_upload_when_differential_upload_disabled(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        _, locations = generate_testable_location_data(length=20)
+
+        with override_settings(LOCATION_UPLOAD_DIFFERENTIAL=False):
+            self.assertIsNone(get_location_snapshot())
+            with responses.RequestsMock() as rsps:
+                self.full_upload(rsps, locations)
+                self.assertEqual(len(rsps.calls), 3)
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    def test_snapshot_removed_after_failed_upload(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        _, locations = generate_testable_location_data(length=20)
+
+        with responses.RequestsMock() as rsps:
+            self.full_upload(rsps, locations)
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/update/'), status=400)
+            with self.assertRaises(ValidationError):
+                update_locations(user=self.user, locations=locations[1:])
+        self.assertFalse(os.path.exists(self.snapshot_path))
@@ -0,0 +1,89 @@
+import base64
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from mtp_common.test_utils import silence_logger
+import responses
+
+from prisoner_location_admin.stats import LoadStats, load_saved_stats
+from prisoner_location_admin.tasks import update_locations
+from prisoner_location_admin.tests import generate_testable_location_data, setup_mock_get_authenticated_api_session
+from security.tests import api_url
+
+
+class LoadStatsTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stats_dir = tempfile.TemporaryDirectory()
+        self.stats_dir_settings = override_settings(LOCATION_LOAD_STATS_DIR=self.stats_dir.name)
+        self.stats_dir_settings.enable()
+
+    def tearDown(self):
+        self.stats_dir_settings.disable()
+        self.stats_dir.cleanup()
+        super().tearDown()
+
+    def test_phases_and_counts_recorded(self):
+        stats = LoadStats('offender_search')
+        for _ in range(3):
+            with stats.time('fetch', prison='IXB'):
+                pass
+        with stats.time('fetch', prison='INP'):
+            pass
+        stats.add('rows', 100)
+        stats.add('retries')
+        stats.finish(succeeded=True)
+
+        elk_fields = stats.elk_fields()
+        self.assertEqual(elk_fields['@fields.prisoner_location_offender_search_fetch_count'], 4)
+        self.assertEqual(elk_fields['@fields.prisoner_location_offender_search_rows'], 100)
+        self.assertEqual(elk_fields['@fields.prisoner_location_offender_search_retries'], 1)
+        self.assertSetEqual(set(elk_fields['@fields.prisoner_location_offender_search_prison_seconds']), {'IXB', 'INP'})
+
+        saved_stats = load_saved_stats('offender_search')
+        self.assertTrue(saved_stats['succeeded'])
+        self.assertDictEqual(saved_stats['counts'], {'rows': 100, 'retries': 1})
+        self.assertEqual(saved_stats['phase_counts'], {'fetch': 4})
+
+    def test_saved_stats_exposed_as_metrics(self):
+        stats = LoadStats('upload')
+        with stats.time('delete_old'):
+            pass
+        stats.add('rows', 80000)
+        stats.finish(succeeded=False)
+
+        response = self.client.get(reverse('prometheus_metrics'), HTTP_AUTHORIZATION='Basic %s' % (
+            base64.b64encode(b'prom:prom').decode()
+        ))
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('mtp_prisoner_location_load_success{operation="upload"} 0.0', metrics)
+        self.assertIn('mtp_prisoner_location_load_count{name="rows",operation="upload"} 80000.0', metrics)
+        self.assertIn('mtp_prisoner_location_load_phase_count{operation="upload",phase="delete_old"} 1.0', metrics)
+        self.assertNotIn('operation="offender_search"', metrics)
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    @override_settings(UPLOAD_REQUEST_PAGE_SIZE=10, UPLOAD_REQUEST_RETRY_BACKOFF=0)
+    def test_upload_stats(self, mock_api_client):
+        setup_mock_get_authenticated_api_session(mock_api_client)
+        _, locations = generate_testable_location_data(length=25)
+        user = mock.MagicMock()
+        user.user_data = {'username': 'shall'}
+        user.get_full_name.return_value = 'Sam Hall'
+
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_inactive/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/'), status=502)
+            rsps.add(rsps.POST, api_url('/prisoner_locations/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_old/'))
+            update_locations(user=user, locations=locations)
+
+        saved_stats = load_saved_stats('upload')
+        self.assertTrue(saved_stats['succeeded'])
+        self.assertEqual(saved_stats['counts']['rows'], 25)
+        self.assertEqual(saved_stats['counts']['retries'], 1)
+        self.assertGreater(saved_stats['counts']['bytes_sent'], 0)
+        # 3 batches, all posted again after one failed
+        self.assertEqual(saved_stats['phase_counts'], {'delete_inactive': 2, 'upload_batch': 6, 'delete_old': 1})
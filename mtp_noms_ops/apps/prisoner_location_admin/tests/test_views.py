@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 from unittest import mock
 
 from django.urls import reverse
@@ -7,10 +8,12 @@ from mtp_common.auth.exceptions import Forbidden
 from mtp_common.test_utils import silence_logger
 import responses
 
+from prisoner_location_admin.report import LocationFileReport
 from prisoner_location_admin.tests import (
     PrisonerLocationUploadTestCase, generate_testable_location_data,
     get_csv_data_as_file, respond_to_upload_checks, setup_mock_get_authenticated_api_session,
 )
+from prisoner_location_admin.views import REPORT_SESSION_KEY
 from security.tests import api_url
 
 
@@ -176,3 +179,71 @@ class PrisonerLocationAdminViewsTestCase(PrisonerLocationUploadTestCase):
             )
 
         self.assertContains(response, api_error_message)
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    def test_location_file_problems_can_be_downloaded(self, mock_api_client):
+        self.login()
+        setup_mock_get_authenticated_api_session(mock_api_client)
+
+        file_data, expected_data = generate_testable_location_data(extra_rows=[
+            'A1234ZZ,Smith,John,31/2/1997,IXB',
+        ])
+
+        with responses.RequestsMock() as rsps, silence_logger(level=logging.WARNING):
+            respond_to_upload_checks(rsps)
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_inactive/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_old/'))
+            response = self.client.post(
+                reverse('location_file_upload'),
+                {'location_file': get_csv_data_as_file(file_data)},
+                follow=True,
+            )
+            uploaded_data = json.loads(rsps.calls[-2].request.body.decode())
+
+        self.assertListEqual(uploaded_data, expected_data)
+        self.assertContains(response, '1 row in the last uploaded file was not uploaded')
+        self.assertContains(response, 'Invalid date of birth: 1')
+        self.assertContains(response, reverse('location_file_report'))
+
+        response = self.client.get(reverse('location_file_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        report = response.content.decode()
+        self.assertIn('A1234ZZ,dob,"Date of birth ""31/2/1997"" is not in a valid format"', report)
+
+    @mock.patch('prisoner_location_admin.tasks.api_client')
+    def test_location_file_report_kept_in_session_and_cache(self, mock_api_client):
+        self.login()
+        setup_mock_get_authenticated_api_session(mock_api_client)
+
+        file_data, _ = generate_testable_location_data(extra_rows=[
+            'A1234ZZ,Smith,John,31/2/1997,IXB',
+        ])
+
+        with responses.RequestsMock() as rsps, silence_logger(level=logging.WARNING):
+            respond_to_upload_checks(rsps)
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_inactive/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/'))
+            rsps.add(rsps.POST, api_url('/prisoner_locations/actions/delete_old/'))
+            self.client.post(reverse('location_file_upload'), {'location_file': get_csv_data_as_file(file_data)})
+
+        # nothing is left on this instance's disk so any instance can show the report
+        self.assertFalse(any('report' in name for name in os.listdir(self.spool_dir.name)))
+        report = LocationFileReport.from_session_data(self.client.session[REPORT_SESSION_KEY])
+        self.assertDictEqual(report.counts, {'dob': 1})
+        self.assertIn(b'A1234ZZ,dob', report.get_contents())
+
+        # the summary remains once the report expires
+        report.delete()
+        response = self.client.get(reverse('location_file_upload'))
+        self.assertContains(response, 'Invalid date of birth: 1')
+        with silence_logger('django.request'):
+            response = self.client.get(reverse('location_file_report'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_location_file_report_not_found_without_upload(self):
+        self.login()
+        with silence_logger('django.request'):
+            response = self.client.get(reverse('location_file_report'))
+        self.assertEqual(response.status_code, 404)
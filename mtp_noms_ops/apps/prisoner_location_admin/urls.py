@@ -10,4 +10,9 @@ urlpatterns = [
         user_test(required_permissions)(views.LocationFileUploadView.as_view()),
         name='location_file_upload',
     ),
+    re_path(
+        r'^report/$',
+        user_test(required_permissions)(views.LocationFileReportView.as_view()),
+        name='location_file_report',
+    ),
 ]
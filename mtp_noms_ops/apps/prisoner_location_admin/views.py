@@ -1,12 +1,17 @@
 from django import forms
 from django.conf import settings
 from django.contrib import messages
+from django.http import Http404, HttpResponse
 from django.urls import reverse_lazy
 from django.utils.translation import gettext, ngettext
+from django.views.generic import View
 from django.views.generic.edit import FormView
 from mtp_common.spooling import spooler
 
 from prisoner_location_admin.forms import LocationFileUploadForm
+from prisoner_location_admin.report import LocationFileReport
+
+REPORT_SESSION_KEY = 'prisoner_location_report'
 
 
 class LocationFileUploadView(FormView):
@@ -19,7 +24,24 @@ class LocationFileUploadView(FormView):
         kwargs['request'] = self.request
         return kwargs
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['report'] = LocationFileReport.from_session_data(self.request.session.get(REPORT_SESSION_KEY))
+        return context
+
+    def save_report(self, form):
+        if form.report:
+            self.request.session[REPORT_SESSION_KEY] = form.report.session_data()
+        else:
+            self.request.session.pop(REPORT_SESSION_KEY, None)
+
+    def form_invalid(self, form):
+        if 'location_file' in form.errors:
+            self.save_report(form)
+        return super().form_invalid(form)
+
     def form_valid(self, form):
+        self.save_report(form)
         try:
             form.update_locations()
             location_count = len(form.cleaned_data['location_file'])
@@ -69,3 +91,18 @@ class LocationFileUploadView(FormView):
         except forms.ValidationError as e:
             form.add_error(None, e)
             return self.form_invalid(form)
+
+
+class LocationFileReportView(View):
+    """
+    Downloads the report of rows that could not be uploaded from the last location file
+    """
+
+    def get(self, request):
+        report = LocationFileReport.from_session_data(request.session.get(REPORT_SESSION_KEY))
+        contents = report and report.get_contents()
+        if contents is None:
+            raise Http404('Report not found')
+        response = HttpResponse(contents, content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="prisoner-location-problems.csv"'
+        return response
@@ -4,9 +4,9 @@ from django import forms
 from django.contrib import messages
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
-from mtp_common.auth.api_client import get_api_session
 from requests.exceptions import RequestException
 
+from mtp_noms_ops.api import get_api_session
 from security.constants import (
     CHECK_AUTO_ACCEPT_UNIQUE_CONSTRAINT_ERROR,
     CURRENT_CHECK_REJECTION_BOOL_CATEGORY_LABELS, CURRENT_CHECK_REJECTION_TEXT_CATEGORY_LABELS,
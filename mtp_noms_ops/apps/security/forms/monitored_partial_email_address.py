@@ -4,9 +4,9 @@ from urllib.parse import quote
 from django import forms
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
-from mtp_common.auth.api_client import get_api_session
 from requests.exceptions import RequestException
 
+from mtp_noms_ops.api import get_api_session
 from security.forms.check import SecurityFormWithMyListCount
 
 logger = logging.getLogger('mtp')
@@ -14,12 +14,16 @@ from django.utils.functional import cached_property
 from django.utils.html import format_html, format_html_join
 from django.utils.translation import gettext_lazy as _, override as override_locale
 from mtp_common.api import retrieve_all_pages_for_path
-from mtp_common.auth.api_client import get_api_session
 from mtp_common.auth.exceptions import HttpNotFoundError
 from requests.exceptions import RequestException
 
+from mtp_noms_ops.api import get_api_session
+from mtp_noms_ops.timing import timed
 from security.constants import SECURITY_FORMS_DEFAULT_PAGE_SIZE
 from security.models import PrisonList
+from security.pagination import (
+    get_cached_count, get_page_cursor, retrieve_all_pages_by_keyset, save_count, save_page_cursor,
+)
 from security.searches import (
     save_search, update_result_count, delete_search, get_existing_search
 )
@@ -92,6 +96,18 @@ class AmountPattern(enum.Enum):
         ]
 
 
+class PrisonChoiceField(forms.MultipleChoiceField):
+    """
+    Validates selected prisons against a set of NOMIS ids, if provided by the form, rather than the list of choices
+    """
+    get_prison_ids = None
+
+    def valid_value(self, value):
+        if self.get_prison_ids is None:
+            return super().valid_value(value)
+        return str(value) in self.get_prison_ids()
+
+
 class SecurityForm(forms.Form):
     """
     Base form for security searches, always uses initial values as defaults
@@ -102,6 +118,9 @@ class SecurityForm(forms.Form):
 
     exclusive_date_params = []
     exclude_private_estate = False
+    # reuse a recently counted total when paging through the list
+    cache_counts = False
+    keyset_orderings = {}
 
     filtered_description_template = NotImplemented
     unfiltered_description_template = NotImplemented
@@ -123,11 +142,13 @@ class SecurityForm(forms.Form):
         self.request = request
         self.total_count = 0
         self.page_count = 0
+        self.count_is_approximate = False
         self.existing_search = None
 
         if 'prison' in self.fields:
-            self.prison_list = PrisonList(self.session, exclude_private_estate=self.exclude_private_estate)
-            self['prison'].field.choices = self.prison_list.prison_choices
+            # choices are only loaded when rendered or validated
+            self.fields['prison'].choices = lambda: self.prison_list.prison_choices
+            self.fields['prison'].get_prison_ids = lambda: self.prison_list.prison_ids
 
             if 'prison' in self.data and hasattr(self.data, 'getlist'):
                 selected_prisons = itertools.chain.from_iterable(
@@ -138,18 +159,18 @@ class SecurityForm(forms.Form):
                 self.data.setlist('prison', selected_prisons)
 
             if 'prison_region' in self.fields:
-                self['prison_region'].field.choices = [
+                self.fields['prison_region'].choices = lambda: [
                     ('', _('All regions')),
                     *self.prison_list.region_choices,
                 ]
             if 'prison_population' in self.fields:
-                self['prison_population'].field.choices = [
+                self.fields['prison_population'].choices = lambda: [
                     ('', _('All types')),  # blank option
                     *self.prison_list.population_choices,
                 ]
 
             if 'prison_category' in self.fields:
-                self['prison_category'].field.choices = [
+                self.fields['prison_category'].choices = lambda: [
                     ('', _('All categories')),  # blank option
                     *self.prison_list.category_choices,
                 ]
@@ -158,6 +179,10 @@ class SecurityForm(forms.Form):
     def session(self):
         return get_api_session(self.request)
 
+    @cached_property
+    def prison_list(self):
+        return PrisonList(self.session, exclude_private_estate=self.exclude_private_estate)
+
     def get_object_list_endpoint_path(self):
         raise NotImplementedError
 
@@ -185,13 +210,73 @@ class SecurityForm(forms.Form):
                 filters[param] += datetime.timedelta(days=1)
         return filters
 
+    def get_keyset_ordering(self):
+        """
+        Returns the KeysetOrdering for the chosen ordering if the object list can be paged by key rather than offset
+        """
+        if not settings.SECURITY_KEYSET_PAGINATION:
+            return None
+        return self.keyset_orderings.get(self.cleaned_data.get('ordering'))
+
+    @cached_property
+    def cached_count(self):
+        """
+        Count of the object list saved when another page of it was recently loaded without one.
+        mtp-api's limit-offset pagination counts the list in every response and cannot be asked not to,
+        so reusing the count keeps the total and page links stable while paging
+        and is needed when a page is requested by key as the API then only counts objects after the cursor
+        """
+        page = self.cleaned_data.get('page')
+        if not self.cache_counts or not page or page == 1:
+            return None
+        return get_cached_count(
+            self.request.user.username, self.get_object_list_endpoint_path(), self.get_api_request_params(),
+        )
+
+    @cached_property
+    def page_cursor(self):
+        """
+        Cursor saved when the previous page was loaded, if any,
+        which is only used while there is a cached count as the API only counts objects after the cursor
+        """
+        page = self.cleaned_data.get('page')
+        if not page or page == 1 or not self.get_keyset_ordering() or self.cached_count is None:
+            return None
+        return get_page_cursor(
+            self.request.user.username, self.get_object_list_endpoint_path(), self.get_api_request_params(), page,
+        )
+
+    def save_count(self):
+        save_count(
+            self.request.user.username, self.get_object_list_endpoint_path(), self.get_api_request_params(),
+            self.total_count,
+        )
+
+    def save_next_page_cursor(self, object_list):
+        keyset = self.get_keyset_ordering()
+        page = self.cleaned_data['page']
+        if not keyset or page >= self.page_count:
+            return
+        cursor = keyset.cursor_after(object_list, previous=self.page_cursor)
+        if cursor:
+            save_page_cursor(
+                self.request.user.username, self.get_object_list_endpoint_path(), self.get_api_request_params(),
+                page + 1, cursor,
+            )
+
     def get_api_request_page_params(self):
         page = self.cleaned_data.get('page')
         if not page:
             return None
         filters = self.get_api_request_params()
-        filters['offset'] = (page - 1) * self.page_size
-        filters['limit'] = self.page_size
+        cursor = self.page_cursor
+        if cursor:
+            filters.update(self.get_keyset_ordering().bound_params(cursor))
+            filters['offset'] = 0
+            filters['limit'] = self.page_size + len(cursor.seen_ids)
+        else:
+            filters['offset'] = (page - 1) * self.page_size
+            filters['limit'] = self.page_size
         return filters
 
     def get_object_list(self):
@@ -212,15 +297,30 @@ class SecurityForm(forms.Form):
             self.add_error(None, _('This service is currently unavailable'))
             return []
         count = data.get('count', 0)
+        object_list = data.get('results', [])
+        cursor = self.page_cursor
+        if cursor:
+            object_list = cursor.skip_seen(object_list)[:self.page_size]
+        if self.cached_count is not None:
+            count = self.cached_count
+            self.count_is_approximate = True
         self.total_count = count
         self.page_count = int(ceil(count / self.page_size))
-        return data.get('results', [])
+        if self.cache_counts and self.cached_count is None:
+            self.save_count()
+        self.save_next_page_cursor(object_list)
+        return object_list
 
     def get_complete_object_list(self):
         filters = self.get_api_request_params()
-        return convert_date_fields(retrieve_all_pages_for_path(
-            self.session, self.get_object_list_endpoint_path(), **filters)
-        )
+        keyset = self.get_keyset_ordering()
+        if keyset:
+            object_list = retrieve_all_pages_by_keyset(
+                self.session, self.get_object_list_endpoint_path(), keyset, **filters
+            )
+        else:
+            object_list = retrieve_all_pages_for_path(self.session, self.get_object_list_endpoint_path(), **filters)
+        return convert_date_fields(object_list)
 
     def build_query_string(self, **extra_query_data):
         query_data = self.get_query_data(allow_parameter_manipulation=False)
@@ -267,6 +367,7 @@ class SecurityForm(forms.Form):
         return self._get_value_text(bf, f, v)
 
     @property
+    @timed('search-description')
     def search_description(self):
         with override_locale(settings.LANGUAGE_CODE):
             description_kwargs = {
@@ -13,12 +13,14 @@ from security.constants import SECURITY_FORMS_DEFAULT_PAGE_SIZE
 from security.forms.object_base import (
     AmountPattern,
     parse_amount,
+    PrisonChoiceField,
     SecurityForm,
     validate_amount,
     validate_prisoner_number,
     validate_range_fields,
 )
 from security.models import credit_sources, disbursement_methods, PaymentMethod
+from security.pagination import KeysetOrdering
 from security.utils import (
     convert_date_fields,
     remove_whitespaces_and_hyphens,
@@ -75,7 +77,7 @@ class PrisonSelectorSearchFormMixin(forms.Form):
         ),
         initial=PRISON_SELECTOR_USER_PRISONS_CHOICE_VALUE,
     )
-    prison = forms.MultipleChoiceField(label=_('Prison name'), required=False, choices=[])
+    prison = PrisonChoiceField(label=_('Prison name'), required=False, choices=[])
 
     def _update_prison_in_query_data(self, query_data):
         prison_selector = query_data.pop('prison_selector', None)
@@ -427,6 +429,7 @@ class SendersForm(
     )
     description_capitalisation = {}
     unlisted_description = ''
+    cache_counts = True
 
     PAYMENT_METHOD_API_FIELDS_MAPPING = {
         'payment_method': 'source',
@@ -527,6 +530,7 @@ class PrisonersForm(SearchFormMixin, PrisonSelectorSearchFormMixin, SecurityForm
     )
     description_capitalisation = {}
     unlisted_description = ''
+    cache_counts = True
 
     def get_object_list_endpoint_path(self):
         return '/prisoners/'
@@ -612,6 +616,11 @@ class CreditsForm(
     )
 
     exclusive_date_params = ['received_at__lt']
+    cache_counts = True
+    keyset_orderings = {
+        'received_at': KeysetOrdering('received_at'),
+        '-received_at': KeysetOrdering('received_at', descending=True),
+    }
 
     # NB: ensure that these templates are HTML-safe
     filtered_description_template = 'Results containing {filter_description} {prisons_filter_description}'
@@ -786,6 +795,11 @@ class DisbursementsForm(
     invoice_number = forms.CharField(label=_('Invoice number'), required=False)
 
     exclusive_date_params = ['created__lt']
+    cache_counts = True
+    keyset_orderings = {
+        'created': KeysetOrdering('created'),
+        '-created': KeysetOrdering('created', descending=True),
+    }
 
     # NB: ensure that these templates are HTML-safe
     filtered_description_template = 'Results containing {filter_description} {prisons_filter_description}'
@@ -4,7 +4,8 @@ from django import forms
 from django.utils import timezone
 from django.utils.functional import cached_property
 from mtp_common.api import retrieve_all_pages_for_path
-from mtp_common.auth.api_client import get_api_session
+
+from mtp_noms_ops.api import get_api_session
 
 
 class ReviewCreditsForm(forms.Form):
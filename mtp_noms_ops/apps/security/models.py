@@ -6,6 +6,8 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from mtp_common.api import retrieve_all_pages_for_path
 
+from mtp_noms_ops.timing import timed
+
 
 class PaymentMethod(enum.Enum):
     bank_transfer = _('Bank transfer')
@@ -61,6 +63,7 @@ class EmailNotifications:
 class PrisonList:
     excluded_nomis_ids = {'ZCH'}
 
+    @timed('prison-list')
     def __init__(self, session, exclude_private_estate=False):
         self.prisons = self.get_prisons(session)
 
@@ -83,11 +86,13 @@ class PrisonList:
             return choice[1]
 
         self.prison_choices = sorted(prison_choices, key=sorter)
+        self.prison_ids = frozenset(nomis_id for nomis_id, _ in prison_choices)
         self.region_choices = [(label, label) for label in sorted(region_choices)]
         self.category_choices = sorted(category_choices.items(), key=sorter)
         self.population_choices = sorted(population_choices.items(), key=sorter)
 
-    def get_prisons(self, session):
+    @staticmethod
+    def get_prisons(session):
         prisons = cache.get('PrisonList')
         if prisons is None:
             # NB: must not exclude empty prisons because location report needs to work for new prisons
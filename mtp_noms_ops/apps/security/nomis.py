@@ -0,0 +1,135 @@
+from http.cookiejar import DefaultCookiePolicy
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+import requests
+from requests.exceptions import RequestException
+
+from mtp_noms_ops.api_metrics import instrument_session
+
+logger = logging.getLogger('mtp')
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for settings.NOMIS_CIRCUIT_BREAKER_RESET_TIMEOUT seconds
+    once settings.NOMIS_CIRCUIT_BREAKER_FAILURES consecutive calls have failed
+    so that slow or unavailable responses do not tie up request threads.
+    After that, one probe call is allowed through (half-open) and the circuit closes again if it succeeds.
+    State is shared by all threads in a process.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} {self.state}>'
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.probing or time.monotonic() - self.opened_at >= settings.NOMIS_CIRCUIT_BREAKER_RESET_TIMEOUT:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < settings.NOMIS_CIRCUIT_BREAKER_RESET_TIMEOUT:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info('%(name)s circuit breaker closed', {'name': self.name})
+            self.reset()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened_at is not None or self.failures >= settings.NOMIS_CIRCUIT_BREAKER_FAILURES:
+                if self.opened_at is None:
+                    logger.warning(
+                        '%(name)s circuit breaker opened after %(failures)d consecutive failures',
+                        {'name': self.name, 'failures': self.failures},
+                    )
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+
+nomis_circuit_breaker = CircuitBreaker('NOMIS')
+
+_nomis_session = None
+_nomis_session_lock = threading.Lock()
+
+
+def get_nomis_session():
+    """
+    Returns the session shared by all NOMIS lookups in a process so that kept-alive connections are reused
+    """
+    global _nomis_session
+
+    with _nomis_session_lock:
+        if _nomis_session is None:
+            session = requests.Session()
+            # lookups are made on behalf of different users so nothing is remembered between them
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            _nomis_session = instrument_session(session, 'nomis')
+        return _nomis_session
+
+
+def lookup_prisoner(kind, lookup, prisoner_number, cache_timeout=None):
+    """
+    Calls a NOMIS lookup function for a prisoner unless it recently found nothing for them or NOMIS is failing
+    :param kind: description of what is looked up, e.g. 'image' or 'location'
+    :param cache_timeout: if set, results are also cached for this many seconds
+    :return: the lookup's result or None if there is none or NOMIS is unavailable
+    """
+    negative_cache_key = f'nomis-no-{kind}-{prisoner_number.upper()}'
+    cache_key = f'nomis-{kind}-{prisoner_number.upper()}'
+    if cache_timeout:
+        result = cache.get(cache_key)
+        if result is not None:
+            return result
+    if cache.get(negative_cache_key):
+        return None
+    if not nomis_circuit_breaker.allow_request():
+        return None
+    try:
+        result = lookup(prisoner_number, session=get_nomis_session())
+    except RequestException as e:
+        if e.response is None or e.response.status_code != 404:
+            # includes authentication failures and rate limiting which must not be cached as missing results
+            nomis_circuit_breaker.record_failure()
+            logger.warning(
+                'Could not load %(kind)s for %(prisoner_number)s',
+                {'kind': kind, 'prisoner_number': prisoner_number},
+            )
+            return None
+        # NOMIS is working but has nothing for this prisoner
+        result = None
+    except:  # noqa: E722,B001
+        nomis_circuit_breaker.record_failure()
+        raise
+    nomis_circuit_breaker.record_success()
+    if not result:
+        cache.set(negative_cache_key, True, timeout=settings.NOMIS_NEGATIVE_CACHE_TIMEOUT)
+    elif cache_timeout:
+        cache.set(cache_key, result, timeout=cache_timeout)
+    return result
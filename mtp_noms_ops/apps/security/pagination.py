@@ -0,0 +1,115 @@
+import datetime
+import hashlib
+import typing
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+from mtp_common.api import retrieve_all_pages_for_path
+
+
+class Cursor(typing.NamedTuple):
+    """
+    Position after the last object seen: its ordering key and the ids of all objects seen with that key
+    """
+    key: str
+    seen_ids: tuple
+
+    def skip_seen(self, results):
+        seen_ids = set(self.seen_ids)
+        return [result for result in results if result.get('id') not in seen_ids]
+
+
+class KeysetOrdering(typing.NamedTuple):
+    """
+    An API list ordering by a date-time field that can be paged through by filtering on the last key seen
+    rather than by offset, which the API has to count through on every request
+    """
+    field: str
+    descending: bool = False
+
+    def bound_params(self, cursor):
+        # bounds are inclusive as several objects can share a key
+        if self.descending:
+            key = parse_datetime(cursor.key) + datetime.timedelta(microseconds=1)
+            return {f'{self.field}__lt': key.isoformat()}
+        return {f'{self.field}__gte': cursor.key}
+
+    def cursor_after(self, results, previous=None):
+        """
+        Returns the cursor following a page of results or None if they cannot be paged by key
+        """
+        if not results:
+            return previous
+        key = results[-1].get(self.field)
+        if not key or not parse_datetime(key):
+            return None
+        seen_ids = tuple(result['id'] for result in results if result.get(self.field) == key)
+        if previous and previous.key == key:
+            seen_ids = previous.seen_ids + seen_ids
+        return Cursor(key=key, seen_ids=seen_ids)
+
+
+def get_query_cache_key(prefix, username, path, params, *extra):
+    """
+    Cache key for a user's API list query, irrespective of the order of params
+    """
+    query = urlencode(sorted(params.items()), doseq=True)
+    digest = hashlib.sha256('\n'.join(map(str, (username, path, query, *extra))).encode()).hexdigest()
+    return f'{prefix}-{digest}'
+
+
+def get_page_cursor(username, path, params, page):
+    cursor = cache.get(get_query_cache_key('keyset-cursor', username, path, params, page))
+    return Cursor(*cursor) if cursor else None
+
+
+def save_page_cursor(username, path, params, page, cursor):
+    cache.set(
+        get_query_cache_key('keyset-cursor', username, path, params, page), tuple(cursor),
+        timeout=settings.SECURITY_KEYSET_CURSOR_TIMEOUT,
+    )
+
+
+def get_cached_count(username, path, params):
+    return cache.get(get_query_cache_key('object-count', username, path, params))
+
+
+def save_count(username, path, params, count):
+    cache.set(
+        get_query_cache_key('object-count', username, path, params), count,
+        timeout=settings.SECURITY_COUNT_CACHE_TIMEOUT,
+    )
+
+
+def retrieve_all_pages_by_keyset(session, path, keyset, **params):
+    """
+    Loads all pages into a single results list like mtp_common.api.retrieve_all_pages_for_path
+    but pages through the list by key, falling back to offsets if a key is missing
+    :param session: Requests Session object
+    :param path: URL path
+    :param keyset: KeysetOrdering matching the `ordering` param
+    :param params: additional URL params
+    """
+    page_size = settings.REQUEST_PAGE_SIZE
+    loaded_results = []
+
+    cursor = None
+    while True:
+        page_params = dict(params, limit=page_size, offset=0)
+        if cursor:
+            page_params.update(keyset.bound_params(cursor))
+            page_params['limit'] += len(cursor.seen_ids)
+        results = session.get(path, params=page_params).json().get('results', [])
+        if len(results) < page_params['limit']:
+            loaded_results += cursor.skip_seen(results) if cursor else results
+            break
+        if cursor:
+            results = cursor.skip_seen(results)
+        cursor = keyset.cursor_after(results, previous=cursor)
+        if cursor is None:
+            return retrieve_all_pages_for_path(session, path, **params)
+        loaded_results += results
+
+    return loaded_results
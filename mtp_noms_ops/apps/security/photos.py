@@ -0,0 +1,141 @@
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from django.conf import settings
+
+logger = logging.getLogger('mtp')
+
+# size of each cache directory as last measured plus photos written since, in this process
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+
+class CachedPhoto(typing.NamedTuple):
+    data: bytes
+    etag: str
+
+
+class PrisonerPhotoCache:
+    """
+    Decoded NOMIS prisoner photographs stored on local disk so that repeat views by any user need not call NOMIS.
+    Photos expire settings.NOMIS_PHOTO_CACHE_TTL seconds after being fetched and the least-recently viewed
+    are evicted once the cache exceeds settings.NOMIS_PHOTO_CACHE_MAX_SIZE bytes.
+    File modification times record when a photo was fetched and access times when it was last viewed.
+    The directory is only scanned when this process's running total exceeds the limit or, as other processes
+    also write photos, once every settings.NOMIS_PHOTO_CACHE_SWEEP_INTERVAL seconds.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or get_photo_cache_dir()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.directory}>'
+
+    def get_path(self, prisoner_number: str) -> str:
+        return os.path.join(self.directory, f'{prisoner_number.upper()}.jpg')
+
+    def get(self, prisoner_number: str) -> typing.Optional[CachedPhoto]:
+        path = self.get_path(prisoner_number)
+        try:
+            fetched = os.stat(path).st_mtime
+            now = time.time()
+            if now - fetched > settings.NOMIS_PHOTO_CACHE_TTL:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            # access time is set explicitly as filesystems are often mounted with noatime
+            os.utime(path, (now, fetched))
+        except FileNotFoundError:
+            return None
+        except OSError:
+            logger.exception(
+                'Cached photo for %(prisoner_number)s cannot be read',
+                {'prisoner_number': prisoner_number},
+            )
+            return None
+        return CachedPhoto(data=data, etag=make_etag(data))
+
+    def put(self, prisoner_number: str, data: bytes) -> CachedPhoto:
+        """
+        Caches a photo, evicting others if necessary; failure to write is logged but does not prevent a response
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.photo-', suffix='.jpg', dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.get_path(prisoner_number))
+            if self.add_size(len(data)) or self.sweep_due():
+                self.evict()
+        except OSError:
+            logger.exception('Photo for %(prisoner_number)s cannot be cached', {'prisoner_number': prisoner_number})
+        return CachedPhoto(data=data, etag=make_etag(data))
+
+    @property
+    def sweep_path(self):
+        return os.path.join(self.directory, '.swept')
+
+    def add_size(self, size: int) -> bool:
+        """
+        Adds a written photo to the running total, returning True if the cache may be over its size limit
+        """
+        with _cache_sizes_lock:
+            total_size = _cache_sizes.get(self.directory)
+            if total_size is None:
+                return True
+            total_size += size
+            _cache_sizes[self.directory] = total_size
+        return total_size > settings.NOMIS_PHOTO_CACHE_MAX_SIZE
+
+    def sweep_due(self) -> bool:
+        try:
+            swept = os.stat(self.sweep_path).st_mtime
+        except FileNotFoundError:
+            return True
+        return time.time() - swept > settings.NOMIS_PHOTO_CACHE_SWEEP_INTERVAL
+
+    def evict(self):
+        """
+        Deletes expired photos and then the least-recently viewed until the cache is within its size limit
+        """
+        with open(self.sweep_path, 'wb'):
+            pass
+        expired = time.time() - settings.NOMIS_PHOTO_CACHE_TTL
+        photos = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.') or not entry.name.endswith('.jpg'):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                stat = entry.stat()
+                if stat.st_mtime < expired:
+                    os.unlink(entry.path)
+                    continue
+                photos.append((stat.st_atime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        if total_size > settings.NOMIS_PHOTO_CACHE_MAX_SIZE:
+            photos.sort()
+            for _, size, path in photos:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                total_size -= size
+                if total_size <= settings.NOMIS_PHOTO_CACHE_MAX_SIZE:
+                    break
+        with _cache_sizes_lock:
+            _cache_sizes[self.directory] = total_size
+
+
+def get_photo_cache_dir():
+    return settings.NOMIS_PHOTO_CACHE_DIR or os.path.join(tempfile.gettempdir(), 'nomis-photos')
+
+
+def make_etag(data: bytes) -> str:
+    return '"%s"' % hashlib.sha1(data).hexdigest()
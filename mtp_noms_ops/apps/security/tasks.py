@@ -10,11 +10,12 @@ from mtp_common.tasks import send_email
 from openpyxl.writer.excel import save_workbook
 
 from security.export import ObjectListSerialiser
+from security.pagination import retrieve_all_pages_by_keyset
 from security.utils import convert_date_fields
 
 
 @spoolable(body_params=('user', 'session', 'filters'))
-def email_export_xlsx(*, object_type, user, session, endpoint_path, filters, export_description):
+def email_export_xlsx(*, object_type, user, session, endpoint_path, filters, export_description, keyset=None):
     if object_type == 'credits':
         export_message = 'Click the link to download the credits you exported from ‘Prisoner money intelligence’.'
     elif object_type == 'disbursements':
@@ -37,9 +38,11 @@ def email_export_xlsx(*, object_type, user, session, endpoint_path, filters, exp
 
     api_session = get_api_session_with_session(user, session)
     generated_at = timezone.localtime()
-    object_list = convert_date_fields(
-        retrieve_all_pages_for_path(api_session, endpoint_path, **filters)
-    )
+    if keyset:
+        object_list = retrieve_all_pages_by_keyset(api_session, endpoint_path, keyset, **filters)
+    else:
+        object_list = retrieve_all_pages_for_path(api_session, endpoint_path, **filters)
+    object_list = convert_date_fields(object_list)
 
     serialiser = ObjectListSerialiser.serialiser_for(object_type)
     workbook = serialiser.make_workbook(object_list)
@@ -1,4 +1,5 @@
-import re
+import hashlib
+import json
 import logging
 
 from django import template
@@ -6,7 +7,7 @@ from django.urls import reverse
 from django.utils.html import escape, format_html, format_html_join
 from django.utils.http import urlencode
 from django.utils.safestring import mark_safe
-from django.utils.translation import gettext
+from django.utils.translation import get_language, gettext
 from mtp_common.security.checks import human_readable_check_rejection_reasons
 from mtp_common.utils import format_postcode
 
@@ -19,7 +20,7 @@ from security.models import (
     disbursement_resolutions,
     security_check_statuses,
 )
-from security.utils import get_abbreviated_cardholder_names
+from security.utils import SearchHighlighter, get_abbreviated_cardholder_names
 
 logger = logging.getLogger('mtp')
 register = template.Library()
@@ -267,54 +268,44 @@ def find_rejection_reason(comment_set):
     return ''
 
 
-def _build_search_terms_re(context):
+def _build_search_highlighter(context):
     """
-    Constructs the compiled regex pattern from the search term in the context.
+    Constructs the search highlighter from the search term in the context.
     It returns None if not on the search results page, if the form is not in the context or the
     search term can't be found.
-    The search term is automatically obtained from the simple_form field of the form in the context.
-
-    The value used in the regex pattern is html and regex escaped which means that you need to escape
-    the test string as well when using it.
+    The search term is automatically obtained from the simple_form field of the form in the context
+    unless the view already provided a `search_highlighter`.
     """
     in_search_results = context.get('is_search_results', False)
     if not in_search_results:
         return None
 
-    form = context.get('form')
-    if not form:
-        return None
+    search_highlighter = context.get('search_highlighter')
+    if search_highlighter is None:
+        form = context.get('form')
+        if not form:
+            return None
+        search_highlighter = SearchHighlighter.from_form(form)
 
-    search_term = form.cleaned_data.get('simple_search')
+    return search_highlighter or None
 
-    if not search_term:
-        return None
 
-    search_terms = [
-        re.escape(
-            escape(term),
-        )
-        for term in search_term.split()
-    ]
-    return re.compile(f'({"|".join(search_terms)})', re.I)
-
-
-def _get_cached_search_terms_re(context):
+def _get_cached_search_highlighter(context):
     """
-    Returns the cached seach_terms_re to be used.
+    Returns the cached search highlighter to be used.
     """
-    if '_search_terms_re' not in context:
-        context['_search_terms_re'] = _build_search_terms_re(context)
-    return context['_search_terms_re']
+    if '_search_highlighter' not in context:
+        context['_search_highlighter'] = _build_search_highlighter(context)
+    return context['_search_highlighter']
 
 
 @register.simple_tag(takes_context=True)
 def setup_highlight(context):
     """
-    Template tag that can be used to optimise the highlight logic by caching the compiled reex pattern.
+    Template tag that can be used to optimise the highlight logic by caching the search highlighter.
     """
     # warm up cache
-    _get_cached_search_terms_re(context)
+    _get_cached_search_highlighter(context)
     return ''
 
 
@@ -329,12 +320,9 @@ def search_highlight(context, value, default=''):
     if not value:
         return default
 
-    escaped_value = escape(value)
-    search_terms_re = _get_cached_search_terms_re(context)
-    if search_terms_re:
-        return mark_safe(
-            search_terms_re.sub(r'<span class="mtp-search-highlight">\1</span>', escaped_value),
-        )
+    search_highlighter = _get_cached_search_highlighter(context)
+    if search_highlighter:
+        return search_highlighter.highlight(value)
     return value
 
 
@@ -351,17 +339,9 @@ def extract_best_match(context, items):
     item_list = items or []
     best_match = None
 
-    search_terms_re = _get_cached_search_terms_re(context)
-
-    if search_terms_re:
-        best_match = next(
-            (
-                item
-                for item in item_list
-                if search_terms_re.search(escape(item))
-            ),
-            None,
-        )
+    search_highlighter = _get_cached_search_highlighter(context)
+    if search_highlighter:
+        best_match = search_highlighter.best_match(item_list)
 
     if not best_match and item_list:
         best_match = item_list[0]
@@ -372,6 +352,27 @@ def extract_best_match(context, items):
     }
 
 
+@register.simple_tag(takes_context=True)
+def search_result_row_cache_key(context, obj):
+    """
+    Returns a key identifying the rendered search result row for `obj` to be used with the `cache` template tag.
+    It varies on the object id, a hash of the object's payload, the highlighted search terms,
+    the active language and whether the prison column is shown.
+    """
+    search_highlighter = _get_cached_search_highlighter(context)
+    payload = json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+    shows_prison_column = bool(
+        context.get('is_advanced_search_results') or context.get('is_all_prisons_simple_search_results')
+    )
+    return ':'.join((
+        str(obj.get('id')),
+        hashlib.md5(payload.encode(), usedforsecurity=False).hexdigest(),
+        search_highlighter.search_terms_re.pattern if search_highlighter else '',
+        get_language() or '',
+        str(int(shows_prison_column)),
+    ))
+
+
 @register.filter
 def get_latest_auto_accept_state_field(context, field_name):
     if any([not context_entry.get(field_name) for context_entry in context]):
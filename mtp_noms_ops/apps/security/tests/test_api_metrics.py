@@ -0,0 +1,88 @@
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from mtp_common.auth.api_client import MoJOAuth2Session
+from mtp_common.auth.exceptions import HttpClientError, HttpServerError
+from mtp_common.auth.test_utils import generate_tokens
+import requests
+import responses
+
+from mtp_noms_ops.api_metrics import (
+    ApiCallMetricsMiddleware, api_call_response_size, api_call_responses, api_calls_per_request,
+    instrument_session, normalise_endpoint,
+)
+from security.tests import api_url
+
+
+def get_sample_value(metric, suffix, **labels):
+    return sum(
+        sample.value
+        for collected in metric.collect()
+        for sample in collected.samples
+        if sample.name.endswith(suffix) and all(sample.labels.get(k) == v for k, v in labels.items())
+    )
+
+
+class NormaliseEndpointTestCase(SimpleTestCase):
+    def test_ids_replaced(self):
+        for url, endpoint in [
+            ('http://localhost:8000/senders/123/credits/?limit=20', '/senders/{id}/credits/'),
+            ('http://localhost:8000/prisoners/', '/prisoners/'),
+            ('http://localhost:8000/', '/'),
+            ('https://prison-api/api/v1/offenders/A1409AE/image', '/api/v1/offenders/{prisoner_number}/image'),
+            ('http://localhost:8000/searches/5f2b0d8a-1c1e-4c7e-9a51-0b3a0b7cf0b2/', '/searches/{uuid}/'),
+            ('http://localhost:8000/users/shall/flags/hmpps-employee/', '/users/{username}/flags/hmpps-employee/'),
+            ('https://offender-search/prison/BXI/prisoners?page=2', '/prison/{prison}/prisoners'),
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(normalise_endpoint(url), endpoint)
+
+
+class ApiCallMetricsTestCase(SimpleTestCase):
+    def test_calls_recorded_by_endpoint_and_view(self):
+        labels = {'service': 'api', 'method': 'GET', 'endpoint': '/senders/{id}/credits/'}
+        ok_count = get_sample_value(api_call_responses, '_total', status='200', **labels)
+        error_count = get_sample_value(api_call_responses, '_total', status='404', **labels)
+        size_sum = get_sample_value(api_call_response_size, '_sum', **labels)
+        view_labels = {'view': '<unnamed view>', 'service': 'api'}
+        request_count = get_sample_value(api_calls_per_request, '_count', **view_labels)
+        call_sum = get_sample_value(api_calls_per_request, '_sum', **view_labels)
+
+        def view(_):
+            with instrument_session(requests.Session(), 'api') as session:
+                session.get(api_url('/senders/1/credits/'))
+                session.get(api_url('/senders/2/credits/'))
+                session.get(api_url('/senders/3/credits/'))
+            return HttpResponse()
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url('/senders/1/credits/'), body=b'{"count":0}')
+            rsps.add(rsps.GET, api_url('/senders/2/credits/'), body=b'{"count":0}')
+            rsps.add(rsps.GET, api_url('/senders/3/credits/'), status=404)
+            ApiCallMetricsMiddleware(view)(RequestFactory().get('/'))
+
+        self.assertEqual(get_sample_value(api_call_responses, '_total', status='200', **labels) - ok_count, 2)
+        self.assertEqual(get_sample_value(api_call_responses, '_total', status='404', **labels) - error_count, 1)
+        self.assertEqual(get_sample_value(api_call_response_size, '_sum', **labels) - size_sum, 22)
+        self.assertEqual(get_sample_value(api_calls_per_request, '_count', **view_labels) - request_count, 1)
+        self.assertEqual(get_sample_value(api_calls_per_request, '_sum', **view_labels) - call_sum, 3)
+
+    def test_error_responses_recorded(self):
+        labels = {'service': 'api', 'method': 'GET', 'endpoint': '/prisoners/{id}/'}
+        counts = {
+            status: get_sample_value(api_call_responses, '_total', status=status, **labels)
+            for status in ('200', '403', '500')
+        }
+
+        session = instrument_session(MoJOAuth2Session(token=generate_tokens()), 'api')
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url('/prisoners/1/'), json={})
+            rsps.add(rsps.GET, api_url('/prisoners/2/'), status=403)
+            rsps.add(rsps.GET, api_url('/prisoners/3/'), status=500)
+            session.get(api_url('/prisoners/1/'))
+            with self.assertRaises(HttpClientError):
+                session.get(api_url('/prisoners/2/'))
+            with self.assertRaises(HttpServerError):
+                session.get(api_url('/prisoners/3/'))
+
+        for status, count in counts.items():
+            self.assertEqual(get_sample_value(api_call_responses, '_total', status=status, **labels) - count, 1)
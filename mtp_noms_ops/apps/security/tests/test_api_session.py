@@ -0,0 +1,154 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from mtp_common.auth.exceptions import HttpServerError
+from mtp_common.auth.test_utils import generate_tokens
+import requests
+import responses
+
+from mtp_noms_ops.api import (
+    ApiHTTPAdapter, RequestApiSession, api_connection_checkouts, api_connections_opened,
+    get_api_adapter, get_api_session,
+)
+from mtp_noms_ops.utils import ApiSessionMiddleware
+from security.tests import api_url
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # noqa: N802
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+class RequestApiSessionTestCase(SimpleTestCase):
+    def make_request(self):
+        request = RequestFactory().get('/')
+        request.session = {}
+        request.user = mock.MagicMock(token=generate_tokens())
+        return request
+
+    def test_session_shared_by_request(self):
+        request = self.make_request()
+        ApiSessionMiddleware.process_request(request)
+        api_session = get_api_session(request)
+        self.assertIsInstance(api_session, RequestApiSession)
+        self.assertIs(get_api_session(request), api_session)
+        self.assertIsNot(get_api_session(self.make_request()), get_api_session(self.make_request()))
+
+    def test_identical_gets_remembered(self):
+        api_session = get_api_session(self.make_request())
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url('/prisoners/1/'), json={'id': 1})
+            rsps.add(rsps.GET, api_url('/prisoners/'), json={'count': 0})
+            self.assertEqual(api_session.get('/prisoners/1/').json(), {'id': 1})
+            self.assertEqual(api_session.get(api_url('/prisoners/1/')).json(), {'id': 1})
+            api_session.get('/prisoners/', params={'prison': 'IXB'})
+            api_session.get('/prisoners/', params={'prison': 'IXB'})
+            api_session.get('/prisoners/', params={'prison': 'INP'})
+            self.assertEqual(len(rsps.calls), 3)
+
+    def test_pages_not_remembered(self):
+        api_session = get_api_session(self.make_request())
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url('/prisoners/'), json={'count': 0})
+            for offset in range(0, 200, 20):
+                api_session.get('/prisoners/', params={'offset': offset, 'limit': 20})
+            api_session.get('/prisoners/', params={'offset': 0, 'limit': 20})
+            self.assertEqual(len(rsps.calls), 11)
+        self.assertEqual(len(api_session.memo), 0)
+
+    @override_settings(API_SESSION_MEMO_SIZE=2)
+    def test_least_recently_used_responses_forgotten(self):
+        api_session = get_api_session(self.make_request())
+        with responses.RequestsMock() as rsps:
+            for prisoner_id in range(1, 4):
+                rsps.add(rsps.GET, api_url(f'/prisoners/{prisoner_id}/'), json={'id': prisoner_id})
+            api_session.get('/prisoners/1/')
+            api_session.get('/prisoners/2/')
+            api_session.get('/prisoners/1/')
+            api_session.get('/prisoners/3/')
+            self.assertEqual(len(api_session.memo), 2)
+            api_session.get('/prisoners/1/')
+            api_session.get('/prisoners/2/')
+            self.assertEqual(
+                [call.request.url for call in rsps.calls],
+                [api_url(f'/prisoners/{prisoner_id}/') for prisoner_id in (1, 2, 3, 2)],
+            )
+
+    def test_other_methods_forget_responses(self):
+        api_session = get_api_session(self.make_request())
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url('/searches/'), json={'count': 0})
+            rsps.add(rsps.POST, api_url('/searches/'), status=201)
+            api_session.get('/searches/')
+            api_session.post('/searches/', json={})
+            api_session.get('/searches/')
+            self.assertEqual(len(rsps.calls), 3)
+
+    def test_errors_not_remembered(self):
+        api_session = get_api_session(self.make_request())
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url('/prisoners/1/'), status=500)
+            rsps.add(rsps.GET, api_url('/prisoners/1/'), json={'id': 1})
+            with self.assertRaises(HttpServerError):
+                api_session.get('/prisoners/1/')
+            self.assertEqual(api_session.get('/prisoners/1/').json(), {'id': 1})
+
+
+class ApiHTTPAdapterTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def get_count(self, metric, **labels):
+        return sum(
+            sample.value
+            for collected in metric.collect()
+            for sample in collected.samples
+            if sample.name.endswith('_total') and all(sample.labels.get(k) == v for k, v in labels.items())
+        )
+
+    def test_adapter_shared_by_sessions(self):
+        sessions = [
+            get_api_session(mock.MagicMock(api_session=None, session={}, user=mock.MagicMock(token=generate_tokens())))
+            for _ in range(2)
+        ]
+        adapters = [api_session.get_adapter(api_url('/prisoners/')) for api_session in sessions]
+        self.assertIsInstance(adapters[0], ApiHTTPAdapter)
+        self.assertIs(adapters[0], adapters[1])
+        self.assertIs(adapters[0], get_api_adapter())
+        sessions[0].close()
+        self.assertIsNotNone(get_api_adapter().poolmanager)
+
+    def test_connections_kept_alive_and_counted(self):
+        adapter = ApiHTTPAdapter()
+        self.addCleanup(adapter.poolmanager.clear)
+        url = 'http://127.0.0.1:%d/prisoners/' % self.server.server_address[1]
+        opened = self.get_count(api_connections_opened, host='127.0.0.1')
+        reused = self.get_count(api_connection_checkouts, host='127.0.0.1', reused='true')
+        with requests.Session() as session:
+            session.mount(url, adapter)
+            for _ in range(3):
+                self.assertEqual(session.get(url).json(), {})
+        self.assertEqual(self.get_count(api_connections_opened, host='127.0.0.1') - opened, 1)
+        self.assertEqual(self.get_count(api_connection_checkouts, host='127.0.0.1', reused='true') - reused, 2)
+
+    def test_idempotent_requests_retried(self):
+        retries = get_api_adapter().max_retries
+        self.assertGreater(retries.total, 0)
+        self.assertIn('GET', retries.allowed_methods)
+        self.assertNotIn('POST', retries.allowed_methods)
+        self.assertEqual(retries.status, 0)
@@ -4,9 +4,11 @@ from unittest import mock
 from urllib.parse import parse_qs
 
 from django import forms
-from django.test import SimpleTestCase
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
 from mtp_common.auth.test_utils import generate_tokens
 import responses
+from responses.matchers import query_param_matcher
 
 from security.forms.object_base import AmountPattern, SecurityForm
 from security.forms.object_list import (
@@ -477,16 +479,42 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
             ),
         ]
 
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
-
-            for scenario in scenarios:
+        for scenario in scenarios:
+            with responses.RequestsMock() as rsps:
+                if scenario.data.get('prison'):
+                    # prisons are only loaded to validate the selection
+                    mock_prison_response(rsps)
                 form = MyPrisonSelectorSearchForm(
                     mock.MagicMock(),
                     data=scenario.data,
                 )
                 self.assertFalse(form.is_valid())
-                self.assertDictEqual(form.errors, scenario.expected_errors)
+            self.assertDictEqual(form.errors, scenario.expected_errors)
+
+    def test_prisons_loaded_only_when_needed(self):
+        """
+        Test that prisons are not loaded unless the selection needs validating or the field is rendered
+        and that they are loaded only once.
+        """
+        with responses.RequestsMock():
+            form = MyPrisonSelectorSearchForm(
+                mock.MagicMock(),
+                data={'prison_selector': PRISON_SELECTOR_USER_PRISONS_CHOICE_VALUE},
+            )
+            self.assertTrue(form.is_valid())
+
+        with responses.RequestsMock() as rsps:
+            mock_prison_response(rsps)
+            form = MyPrisonSelectorSearchForm(
+                mock.MagicMock(),
+                data={
+                    'prison_selector': PrisonSelectorSearchFormMixin.PRISON_SELECTOR_EXACT_PRISON_CHOICE_VALUE,
+                    'prison': [SAMPLE_PRISONS[1]['nomis_id']],
+                },
+            )
+            self.assertTrue(form.is_valid())
+            self.assertIn(f'value="{SAMPLE_PRISONS[0]["nomis_id"]}"', str(form['prison']))
+            self.assertEqual(len(rsps.calls), 1)
 
     def test_all_prisons_simple_search_shoud_not_be_allowed(self):
         """
@@ -498,9 +526,7 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
         - the current user's prisons value is 'all'
         """
         # case of form not submitted
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
-
+        with responses.RequestsMock():
             form = MyPrisonSelectorSearchForm(mock.MagicMock())
             self.assertFalse(form.allow_all_prisons_simple_search())
 
@@ -513,8 +539,7 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
             ],
         )
 
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
+        with responses.RequestsMock():
             scenarios = [
                 # selection == user's prisons AND current user's prisons == one prison AND no simple search term used
                 Scenario(
@@ -579,9 +604,7 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
             user_prisons=[SAMPLE_PRISONS[0]],
         )
 
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
-
+        with responses.RequestsMock():
             form = MyPrisonSelectorSearchForm(
                 request,
                 data={
@@ -605,9 +628,7 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
         - the user's prisons value is 'all'
         """
         # case of form not submitted
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
-
+        with responses.RequestsMock():
             form = MyPrisonSelectorSearchForm(mock.MagicMock())
             self.assertFalse(form.was_all_prisons_simple_search_used())
 
@@ -620,8 +641,7 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
             ],
         )
 
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
+        with responses.RequestsMock():
             scenarios = [
                 # selection == all prisons AND current user's prisons == one prison AND no simple search term used
                 Scenario(
@@ -687,9 +707,7 @@ class PrisonSelectorSearchFormMixinTestCase(SimpleTestCase):
             user_prisons=[SAMPLE_PRISONS[0]],
         )
 
-        with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
-
+        with responses.RequestsMock():
             form = MyPrisonSelectorSearchForm(
                 request,
                 data={
@@ -1060,7 +1078,6 @@ class SenderFormTestCase(SecurityFormTestCase):
         Test that if no data is passed in, the default values are used instead.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(self.request, data={})
@@ -1113,7 +1130,6 @@ class SenderFormTestCase(SecurityFormTestCase):
         Test that if data for a simple search is passed in, the API query string is constructed as expected.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(
@@ -1241,7 +1257,6 @@ class SenderFormTestCase(SecurityFormTestCase):
 
         for request_data, expected_api_call_params, expected_cleaned_data, expected_qs in scenarios:
             with responses.RequestsMock() as rsps:
-                mock_prison_response(rsps)
                 mock_empty_response(rsps, self.api_list_path)
 
                 form = self.form_class(
@@ -1357,11 +1372,41 @@ class SenderFormTestCase(SecurityFormTestCase):
 
         for scenario in scenarios:
             with responses.RequestsMock() as rsps:
-                mock_prison_response(rsps)
+                if scenario.data.get('prison'):
+                    # prisons are only loaded to validate the selection
+                    mock_prison_response(rsps)
                 form = self.form_class(self.request, data=scenario.data)
-            self.assertFalse(form.is_valid())
+                self.assertFalse(form.is_valid())
             self.assertDictEqual(form.errors, scenario.expected_errors)
 
+    def test_count_reused_while_paging(self):
+        """
+        Test that later pages reuse the count from the first page without keyset pagination
+        and show it as approximate.
+        """
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, api_url(self.api_list_path), json={'count': 45, 'results': []})
+            form = self.form_class(self.request, data={'page': '1', 'ordering': 'credit_total'})
+            self.assertTrue(form.is_valid())
+            form.get_object_list()
+        self.assertEqual(form.total_count, 45)
+        self.assertFalse(form.count_is_approximate)
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET, api_url(self.api_list_path), json={'count': 46, 'results': []},
+                match=[query_param_matcher({'offset': 40, 'limit': 20}, strict_match=False)],
+            )
+            form = self.form_class(self.request, data={'page': '3', 'ordering': 'credit_total'})
+            self.assertTrue(form.is_valid())
+            form.get_object_list()
+        self.assertEqual(form.total_count, 45)
+        self.assertEqual(form.page_count, 3)
+        self.assertTrue(form.count_is_approximate)
+
 
 class PrisonerFormTestCase(SecurityFormTestCase):
     """
@@ -1375,7 +1420,6 @@ class PrisonerFormTestCase(SecurityFormTestCase):
         Test that if no data is passed in, the default values are used instead.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(self.request, data={})
@@ -1423,7 +1467,6 @@ class PrisonerFormTestCase(SecurityFormTestCase):
         Test that if data for a simple search is passed in, the API query string is constructed as expected.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(
@@ -1482,7 +1525,6 @@ class PrisonerFormTestCase(SecurityFormTestCase):
         Test that if data for an advanced search is passed in, the API query string is constructed as expected.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(
@@ -1568,9 +1610,11 @@ class PrisonerFormTestCase(SecurityFormTestCase):
 
         for scenario in scenarios:
             with responses.RequestsMock() as rsps:
-                mock_prison_response(rsps)
+                if scenario.data.get('prison'):
+                    # prisons are only loaded to validate the selection
+                    mock_prison_response(rsps)
                 form = self.form_class(self.request, data=scenario.data)
-            self.assertFalse(form.is_valid())
+                self.assertFalse(form.is_valid())
             self.assertDictEqual(form.errors, scenario.expected_errors)
 
 
@@ -1586,7 +1630,6 @@ class CreditFormTestCase(SecurityFormTestCase):
         Test that if no data is passed in, the default values are used instead.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(self.request, data={})
@@ -1647,7 +1690,6 @@ class CreditFormTestCase(SecurityFormTestCase):
         Test that if data for a simple search is passed in, the API query string is constructed as expected.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(
@@ -1786,7 +1828,6 @@ class CreditFormTestCase(SecurityFormTestCase):
 
         for request_data, expected_api_call_params, expected_cleaned_data, expected_qs in scenarios:
             with responses.RequestsMock() as rsps:
-                mock_prison_response(rsps)
                 mock_empty_response(rsps, self.api_list_path)
 
                 form = self.form_class(
@@ -1973,11 +2014,81 @@ class CreditFormTestCase(SecurityFormTestCase):
 
         for scenario in scenarios:
             with responses.RequestsMock() as rsps:
-                mock_prison_response(rsps)
+                if scenario.data.get('prison'):
+                    # prisons are only loaded to validate the selection
+                    mock_prison_response(rsps)
                 form = self.form_class(self.request, data=scenario.data)
-            self.assertFalse(form.is_valid())
+                self.assertFalse(form.is_valid())
             self.assertDictEqual(form.errors, scenario.expected_errors)
 
+    @override_settings(SECURITY_KEYSET_PAGINATION=True)
+    def test_keyset_pagination(self):
+        """
+        Test that once a page has been loaded, the next page is requested by date rather than offset
+        without repeating credits received at the same time.
+        """
+        cache.clear()
+        self.addCleanup(cache.clear)
+        start = datetime.datetime(2024, 3, 1, 12, tzinfo=datetime.timezone.utc)
+        credits = [
+            {'id': credit_id, 'received_at': (start - datetime.timedelta(minutes=credit_id)).isoformat()}
+            for credit_id in range(30)
+        ]
+        credits[20]['received_at'] = credits[19]['received_at']
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET, api_url(self.api_list_path), json={'count': 30, 'results': credits[:20]},
+                match=[query_param_matcher({'offset': 0, 'limit': 20}, strict_match=False)],
+            )
+            form = self.form_class(self.request, data={'page': '1'})
+            self.assertTrue(form.is_valid())
+            self.assertEqual(len(form.get_object_list()), 20)
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET, api_url(self.api_list_path), json={'count': 11, 'results': credits[19:]},
+                match=[query_param_matcher({
+                    'offset': 0, 'limit': 21, 'received_at__lt': '2024-03-01T11:41:00.000001+00:00',
+                }, strict_match=False)],
+            )
+            form = self.form_class(self.request, data={'page': '2'})
+            self.assertTrue(form.is_valid())
+            self.assertListEqual([credit['id'] for credit in form.get_object_list()], list(range(20, 30)))
+        self.assertEqual(form.total_count, 30)
+        self.assertEqual(form.page_count, 2)
+        self.assertTrue(form.count_is_approximate)
+
+    @override_settings(SECURITY_KEYSET_PAGINATION=True)
+    def test_keyset_pagination_falls_back_to_offset_without_count(self):
+        """
+        Test that the next page is requested by offset once the count from the previous page has expired
+        so that an exact count is shown.
+        """
+        cache.clear()
+        self.addCleanup(cache.clear)
+        credits = [
+            {'id': credit_id, 'received_at': f'2024-03-01T12:{credit_id:02}:00+00:00'}
+            for credit_id in range(30)
+        ]
+
+        with responses.RequestsMock() as rsps, override_settings(SECURITY_COUNT_CACHE_TIMEOUT=0):
+            rsps.add(rsps.GET, api_url(self.api_list_path), json={'count': 30, 'results': credits[:20]})
+            form = self.form_class(self.request, data={'page': '1'})
+            self.assertTrue(form.is_valid())
+            form.get_object_list()
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET, api_url(self.api_list_path), json={'count': 31, 'results': credits[20:]},
+                match=[query_param_matcher({'offset': 20, 'limit': 20}, strict_match=False)],
+            )
+            form = self.form_class(self.request, data={'page': '2'})
+            self.assertTrue(form.is_valid())
+            self.assertEqual(len(form.get_object_list()), 10)
+        self.assertEqual(form.total_count, 31)
+        self.assertFalse(form.count_is_approximate)
+
 
 class DisbursementFormTestCase(SecurityFormTestCase):
     """
@@ -1991,7 +2102,6 @@ class DisbursementFormTestCase(SecurityFormTestCase):
         Test that if no data is passed in, the default values are used instead.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(self.request, data={})
@@ -2052,7 +2162,6 @@ class DisbursementFormTestCase(SecurityFormTestCase):
         Test that if data for a simple search is passed in, the API query string is constructed as expected.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(
@@ -2124,7 +2233,6 @@ class DisbursementFormTestCase(SecurityFormTestCase):
         Test that if data for an advanced search is passed in, the API query string is constructed as expected.
         """
         with responses.RequestsMock() as rsps:
-            mock_prison_response(rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             form = self.form_class(
@@ -2291,7 +2399,9 @@ class DisbursementFormTestCase(SecurityFormTestCase):
 
         for scenario in scenarios:
             with responses.RequestsMock() as rsps:
-                mock_prison_response(rsps)
+                if scenario.data.get('prison'):
+                    # prisons are only loaded to validate the selection
+                    mock_prison_response(rsps)
                 form = self.form_class(self.request, data=scenario.data)
-            self.assertFalse(form.is_valid())
+                self.assertFalse(form.is_valid())
             self.assertDictEqual(form.errors, scenario.expected_errors)
@@ -0,0 +1,134 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from mtp_common.test_utils import silence_logger
+import requests
+from requests.exceptions import ConnectionError as RequestsConnectionError, HTTPError
+
+from security.nomis import CircuitBreaker, get_nomis_session, lookup_prisoner, nomis_circuit_breaker
+
+
+@override_settings(NOMIS_CIRCUIT_BREAKER_FAILURES=3, NOMIS_CIRCUIT_BREAKER_RESET_TIMEOUT=30)
+class CircuitBreakerTestCase(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('Test')
+        with silence_logger():
+            breaker.record_failure()
+            breaker.record_failure()
+            breaker.record_success()
+            breaker.record_failure()
+            breaker.record_failure()
+            self.assertTrue(breaker.allow_request())
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow_request())
+
+    @mock.patch('security.nomis.time')
+    def test_half_open_probe(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        breaker = CircuitBreaker('Test')
+        with silence_logger():
+            for _ in range(3):
+                breaker.record_failure()
+        self.assertFalse(breaker.allow_request())
+
+        # one probe allowed after reset timeout
+        mock_time.monotonic.return_value = 131
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+
+        # failed probe re-opens circuit
+        with silence_logger():
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow_request())
+
+        # successful probe closes circuit
+        mock_time.monotonic.return_value = 162
+        self.assertTrue(breaker.allow_request())
+        with silence_logger():
+            breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow_request())
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    NOMIS_CIRCUIT_BREAKER_FAILURES=2,
+)
+class LookupPrisonerTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        nomis_circuit_breaker.reset()
+
+    def tearDown(self):
+        nomis_circuit_breaker.reset()
+        super().tearDown()
+
+    def test_results_returned(self):
+        lookup = mock.Mock(return_value='photo')
+        self.assertEqual(lookup_prisoner('image', lookup, 'A1409AE'), 'photo')
+        self.assertEqual(lookup_prisoner('image', lookup, 'A1409AE'), 'photo')
+        self.assertEqual(lookup.call_count, 2)
+
+    def test_session_shared_by_lookups(self):
+        lookup = mock.Mock(return_value='photo')
+        lookup_prisoner('image', lookup, 'A1409AA')
+        lookup_prisoner('image', lookup, 'A1409AB')
+        sessions = [call.kwargs['session'] for call in lookup.call_args_list]
+        self.assertIs(sessions[0], sessions[1])
+        self.assertIs(sessions[0], get_nomis_session())
+
+    def test_results_cached_if_requested(self):
+        lookup = mock.Mock(return_value='BXI-1-001')
+        self.assertEqual(lookup_prisoner('location', lookup, 'A1409AE', cache_timeout=60), 'BXI-1-001')
+        self.assertEqual(lookup_prisoner('location', lookup, 'A1409AE', cache_timeout=60), 'BXI-1-001')
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_missing_results_cached(self):
+        lookup = mock.Mock(return_value=None)
+        self.assertIsNone(lookup_prisoner('image', lookup, 'A1409AE'))
+        self.assertIsNone(lookup_prisoner('image', lookup, 'a1409ae'))
+        self.assertEqual(lookup.call_count, 1)
+        lookup_prisoner('location', lookup, 'A1409AE')
+        self.assertEqual(lookup.call_count, 2)
+
+    def test_not_found_treated_as_missing_results(self):
+        response = requests.Response()
+        response.status_code = 404
+        lookup = mock.Mock(side_effect=HTTPError(response=response))
+        for _ in range(3):
+            self.assertIsNone(lookup_prisoner('image', lookup, 'A1409AE'))
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(nomis_circuit_breaker.state, 'closed')
+
+    def test_other_client_errors_treated_as_failures(self):
+        for status_code in (401, 403, 429):
+            with self.subTest(status_code=status_code):
+                cache.clear()
+                nomis_circuit_breaker.reset()
+                response = requests.Response()
+                response.status_code = status_code
+                lookup = mock.Mock(side_effect=HTTPError(response=response))
+                with silence_logger():
+                    self.assertIsNone(lookup_prisoner('image', lookup, 'A1409AA'))
+                    self.assertIsNone(lookup_prisoner('image', lookup, 'A1409AA'))
+                # not cached as missing results
+                self.assertEqual(lookup.call_count, 2)
+                self.assertEqual(nomis_circuit_breaker.state, 'open')
+
+    def test_failures_open_circuit(self):
+        lookup = mock.Mock(side_effect=RequestsConnectionError)
+        with silence_logger():
+            for prisoner_number in ('A1409AA', 'A1409AB', 'A1409AC', 'A1409AD'):
+                self.assertIsNone(lookup_prisoner('image', lookup, prisoner_number))
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(nomis_circuit_breaker.state, 'open')
+
+        # failures are not cached as missing results
+        nomis_circuit_breaker.reset()
+        lookup = mock.Mock(return_value='photo')
+        self.assertEqual(lookup_prisoner('image', lookup, 'A1409AA'), 'photo')
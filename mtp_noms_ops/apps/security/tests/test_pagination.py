@@ -0,0 +1,82 @@
+import datetime
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from mtp_common.auth.test_utils import generate_tokens
+import responses
+from responses.matchers import query_param_matcher
+
+from mtp_noms_ops.api import get_api_session
+from security.pagination import Cursor, KeysetOrdering, retrieve_all_pages_by_keyset
+from security.tests import api_url
+
+
+def make_credits(count):
+    # pairs of credits share a received date
+    start = datetime.datetime(2024, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    return [
+        {'id': credit_id, 'received_at': (start - datetime.timedelta(minutes=(credit_id - 1) // 2)).isoformat()}
+        for credit_id in range(1, count + 1)
+    ]
+
+
+class KeysetOrderingTestCase(SimpleTestCase):
+    def test_bounds_include_cursor_key(self):
+        cursor = Cursor(key='2024-03-01T12:00:00+00:00', seen_ids=(1,))
+        self.assertDictEqual(
+            KeysetOrdering('received_at').bound_params(cursor),
+            {'received_at__gte': '2024-03-01T12:00:00+00:00'},
+        )
+        self.assertDictEqual(
+            KeysetOrdering('received_at', descending=True).bound_params(cursor),
+            {'received_at__lt': '2024-03-01T12:00:00.000001+00:00'},
+        )
+
+    def test_cursor_remembers_objects_sharing_last_key(self):
+        keyset = KeysetOrdering('received_at', descending=True)
+        credits = make_credits(8)
+        cursor = keyset.cursor_after(credits[:4])
+        self.assertEqual(cursor.key, credits[3]['received_at'])
+        self.assertTupleEqual(cursor.seen_ids, (3, 4))
+        self.assertListEqual(cursor.skip_seen(credits[2:]), credits[4:])
+
+        same_key_credits = [dict(credit, received_at=cursor.key) for credit in credits[4:]]
+        self.assertTupleEqual(keyset.cursor_after(same_key_credits, previous=cursor).seen_ids, (3, 4, 5, 6, 7, 8))
+
+    def test_no_cursor_without_key(self):
+        self.assertIsNone(KeysetOrdering('received_at').cursor_after([{'id': 1, 'received_at': None}]))
+
+
+@override_settings(REQUEST_PAGE_SIZE=4)
+class RetrieveAllPagesByKeysetTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session = get_api_session(
+            mock.MagicMock(api_session=None, session={}, user=mock.MagicMock(token=generate_tokens()))
+        )
+
+    def test_pages_by_key(self):
+        credits = make_credits(9)
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                rsps.GET, api_url('/credits/'), json={'count': 9, 'results': credits[:4]},
+                match=[query_param_matcher({'ordering': '-received_at', 'limit': 4, 'offset': 0})],
+            )
+            rsps.add(
+                rsps.GET, api_url('/credits/'), json={'count': 7, 'results': credits[2:8]},
+                match=[query_param_matcher({
+                    'ordering': '-received_at', 'limit': 6, 'offset': 0,
+                    'received_at__lt': '2024-03-01T11:59:00.000001+00:00',
+                })],
+            )
+            rsps.add(
+                rsps.GET, api_url('/credits/'), json={'count': 3, 'results': credits[6:]},
+                match=[query_param_matcher({
+                    'ordering': '-received_at', 'limit': 6, 'offset': 0,
+                    'received_at__lt': '2024-03-01T11:57:00.000001+00:00',
+                })],
+            )
+            object_list = retrieve_all_pages_by_keyset(
+                self.session, '/credits/', KeysetOrdering('received_at', descending=True), ordering='-received_at',
+            )
+        self.assertListEqual(object_list, credits)
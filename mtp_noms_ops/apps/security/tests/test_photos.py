@@ -0,0 +1,74 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from security.photos import PrisonerPhotoCache, make_etag
+
+
+class PrisonerPhotoCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.photo_cache = PrisonerPhotoCache(self.cache_dir.name)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        super().tearDown()
+
+    def age_photo(self, prisoner_number, fetched_ago, viewed_ago=None):
+        now = time.time()
+        viewed_ago = fetched_ago if viewed_ago is None else viewed_ago
+        os.utime(self.photo_cache.get_path(prisoner_number), (now - viewed_ago, now - fetched_ago))
+
+    def test_photos_cached_by_prisoner_number(self):
+        self.assertIsNone(self.photo_cache.get('A1409AE'))
+        photo = self.photo_cache.put('A1409AE', b'jpeg data')
+        self.assertEqual(photo.etag, make_etag(b'jpeg data'))
+        self.assertEqual(self.photo_cache.get('a1409ae'), photo)
+        self.assertIsNone(self.photo_cache.get('A1409AF'))
+
+    @override_settings(NOMIS_PHOTO_CACHE_TTL=60)
+    def test_expired_photos_not_returned(self):
+        self.photo_cache.put('A1409AE', b'jpeg data')
+        self.age_photo('A1409AE', 61)
+        self.assertIsNone(self.photo_cache.get('A1409AE'))
+        self.assertFalse(os.path.exists(self.photo_cache.get_path('A1409AE')))
+
+    @override_settings(NOMIS_PHOTO_CACHE_MAX_SIZE=25)
+    def test_least_recently_viewed_photos_evicted(self):
+        self.photo_cache.put('A1409AA', b'0123456789')
+        self.photo_cache.put('A1409AB', b'0123456789')
+        # fetched first but viewed most recently
+        self.age_photo('A1409AA', 30, viewed_ago=1)
+        self.age_photo('A1409AB', 20)
+
+        self.photo_cache.put('A1409AC', b'0123456789')
+        self.assertIsNotNone(self.photo_cache.get('A1409AA'))
+        self.assertIsNone(self.photo_cache.get('A1409AB'))
+        self.assertIsNotNone(self.photo_cache.get('A1409AC'))
+
+    @override_settings(NOMIS_PHOTO_CACHE_MAX_SIZE=25)
+    def test_cache_only_scanned_when_over_limit_or_sweep_due(self):
+        self.photo_cache.put('A1409AA', b'0123456789')
+        with mock.patch('security.photos.os.scandir', wraps=os.scandir) as mock_scandir:
+            self.photo_cache.put('A1409AB', b'0123456789')
+            mock_scandir.assert_not_called()
+            self.photo_cache.put('A1409AC', b'0123456789')
+            mock_scandir.assert_called_once()
+
+            with override_settings(NOMIS_PHOTO_CACHE_SWEEP_INTERVAL=60):
+                os.utime(self.photo_cache.sweep_path, (time.time() - 61, time.time() - 61))
+                self.photo_cache.put('A1409AC', b'01234')
+            self.assertEqual(mock_scandir.call_count, 2)
+
+    def test_unwritable_cache_still_returns_photo(self):
+        not_a_directory = os.path.join(self.cache_dir.name, 'file')
+        with open(not_a_directory, 'w'):
+            pass
+        photo_cache = PrisonerPhotoCache(os.path.join(not_a_directory, 'photos'))
+        with self.assertLogs('mtp', 'ERROR'):
+            photo = photo_cache.put('A1409AE', b'jpeg data')
+        self.assertEqual(photo.data, b'jpeg data')
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from mtp_noms_ops.profiling import SamplingProfilerMiddleware, StackSampler
+
+
+def busy_view(request):
+    deadline = time.monotonic() + 0.1
+    while time.monotonic() < deadline:
+        pass
+    return HttpResponse()
+
+
+class SamplingProfilerTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        self.settings = override_settings(
+            PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_INTERVAL=0.001,
+            PROFILING_DIR=self.profile_dir.name, PROFILING_MAX_FILES=2,
+            SERVER_TIMING_USERNAMES={'shall'},
+        )
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def make_request(self, username='shall', **params):
+        request = RequestFactory().get('/', params)
+        request.user = mock.MagicMock(is_authenticated=True, username=username)
+        return request
+
+    def list_profiles(self):
+        return sorted(os.listdir(self.profile_dir.name))
+
+    def test_sampler_collapses_stacks(self):
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_view(None)
+        sampler.stop()
+        self.assertGreater(sampler.sample_count, 0)
+        stack, _ = sampler.stacks.most_common(1)[0]
+        self.assertIn(f'{__name__}.busy_view', stack.split(';'))
+
+    def test_not_used_unless_enabled(self):
+        with override_settings(PROFILING_ENABLED=False), self.assertRaises(MiddlewareNotUsed):
+            SamplingProfilerMiddleware(busy_view)
+
+    def test_query_flag_profiles_request(self):
+        middleware = SamplingProfilerMiddleware(busy_view)
+        with self.assertLogs('mtp', level='INFO'):
+            middleware(self.make_request(profile='1'))
+        profiles = self.list_profiles()
+        self.assertEqual(len(profiles), 1)
+        with open(os.path.join(self.profile_dir.name, profiles[0])) as f:
+            stack, count = f.readline().rsplit(' ', 1)
+        self.assertIn(f'{__name__}.busy_view', stack)
+        self.assertGreater(int(count), 0)
+
+    def test_query_flag_ignored_for_other_users(self):
+        middleware = SamplingProfilerMiddleware(busy_view)
+        middleware(self.make_request(username='other', profile='1'))
+        middleware(self.make_request())
+        self.assertListEqual(self.list_profiles(), [])
+
+    def test_sampled_requests_profiled_with_bounded_retention(self):
+        middleware = SamplingProfilerMiddleware(busy_view)
+        with override_settings(PROFILING_SAMPLE_RATE=1), self.assertLogs('mtp', level='INFO'):
+            for _ in range(3):
+                middleware(self.make_request(username='other'))
+        self.assertEqual(len(self.list_profiles()), 2)
@@ -0,0 +1,204 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from mtp_common.auth import AUTH_TOKEN_SESSION_KEY, USER_DATA_SESSION_KEY
+from mtp_common.auth.models import MojAnonymousUser, MojUser
+from mtp_common.auth.exceptions import HttpServerError
+from mtp_common.auth.test_utils import generate_tokens
+from mtp_common.test_utils import silence_logger
+import responses
+
+from mtp_noms_ops.session import USER_CAPABILITIES_SESSION_KEY, SessionMiddleware, SessionStore
+from mtp_noms_ops.utils import ApiSessionMiddleware, UserCapability, UserPermissionMiddleware
+from security import required_permissions as security_permissions
+
+PRISONS = [
+    {
+        'nomis_id': 'AAI', 'name': 'HMP & YOI Test 1', 'region': 'London', 'pre_approval_required': False,
+        'categories': [{'description': 'Category D', 'name': 'D'}], 'populations': [],
+    },
+    {
+        'nomis_id': 'BBI', 'name': 'HMP Test 2', 'region': 'London', 'pre_approval_required': True,
+        'categories': [], 'populations': [{'description': 'Male', 'name': 'male'}],
+    },
+]
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SessionStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def save_session(self, prisons):
+        session = SessionStore()
+        session[AUTH_TOKEN_SESSION_KEY] = generate_tokens()
+        session[USER_DATA_SESSION_KEY] = {'username': 'shall', 'prisons': prisons}
+        session.save()
+        return session.session_key
+
+    def get_stored_prisons(self, session_key):
+        session_data = signing.loads(session_key, salt=SessionStore.salt, serializer=SessionStore().serializer)
+        return session_data[USER_DATA_SESSION_KEY]['prisons']
+
+    def test_cached_prisons_stored_as_ids(self):
+        cache.set('PrisonList', PRISONS)
+        different_prison = {**PRISONS[1], 'name': 'HMP Renamed'}
+        session_key = self.save_session([PRISONS[0], different_prison])
+        self.assertListEqual(self.get_stored_prisons(session_key), ['AAI', different_prison])
+        session = SessionStore(session_key)
+        self.assertListEqual(session[USER_DATA_SESSION_KEY]['prisons'], [PRISONS[0], different_prison])
+
+        cache.clear()
+        session_key = self.save_session(PRISONS)
+        self.assertListEqual(self.get_stored_prisons(session_key), PRISONS)
+
+    def make_request(self, session_key):
+        request = RequestFactory().get('/')
+        request.session = SessionStore(session_key)
+        request.user = mock.MagicMock(token=generate_tokens())
+        return request
+
+    def test_prisons_loaded_with_request_api_session_if_not_cached(self):
+        cache.set('PrisonList', PRISONS)
+        session_key = self.save_session([PRISONS[0], {**PRISONS[1], 'name': 'HMP Renamed'}])
+        cache.clear()
+        request = self.make_request(session_key)
+        with responses.RequestsMock():
+            # no API calls are made while loading the session
+            self.assertListEqual(request.session[USER_DATA_SESSION_KEY]['prisons'][:1], ['AAI'])
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, f'{settings.API_URL}/prisons/', json={'count': 2, 'results': PRISONS})
+            ApiSessionMiddleware.process_request(request)
+        self.assertListEqual(
+            request.session[USER_DATA_SESSION_KEY]['prisons'],
+            [PRISONS[0], {**PRISONS[1], 'name': 'HMP Renamed'}],
+        )
+        self.assertListEqual(cache.get('PrisonList'), PRISONS)
+        self.assertFalse(request.session.modified)
+
+    def test_session_kept_if_prisons_cannot_be_loaded(self):
+        cache.set('PrisonList', PRISONS)
+        session_key = self.save_session(PRISONS)
+        cache.clear()
+        request = self.make_request(session_key)
+        with responses.RequestsMock() as rsps, silence_logger():
+            rsps.add(rsps.GET, f'{settings.API_URL}/prisons/', status=500)
+            with self.assertRaises(HttpServerError):
+                ApiSessionMiddleware.process_request(request)
+        self.assertEqual(request.session[USER_DATA_SESSION_KEY]['username'], 'shall')
+        self.assertListEqual(request.session[USER_DATA_SESSION_KEY]['prisons'], ['AAI', 'BBI'])
+
+        # the next request loads them once the API recovers
+        request = self.make_request(session_key)
+        with responses.RequestsMock() as rsps:
+            rsps.add(rsps.GET, f'{settings.API_URL}/prisons/', json={'count': 2, 'results': PRISONS})
+            ApiSessionMiddleware.process_request(request)
+        self.assertListEqual(request.session[USER_DATA_SESSION_KEY]['prisons'], PRISONS)
+
+    def test_prison_ids_kept_when_saved_with_cold_cache(self):
+        cache.set('PrisonList', PRISONS)
+        session_key = self.save_session(PRISONS)
+        cache.clear()
+        session = SessionStore(session_key)
+        session['modified'] = True
+        session.save()
+        self.assertListEqual(self.get_stored_prisons(session.session_key), ['AAI', 'BBI'])
+
+    def test_unmodified_session_resigned_after_interval(self):
+        session_key = self.save_session([])
+        session = SessionStore(session_key)
+        self.assertEqual(session[USER_DATA_SESSION_KEY]['username'], 'shall')
+        session.save()
+        self.assertEqual(session.session_key, session_key)
+
+        session[USER_DATA_SESSION_KEY] = {'username': 'shall', 'prisons': PRISONS}
+        session.save()
+        self.assertNotEqual(session.session_key, session_key)
+
+        session = SessionStore(session_key)
+        self.assertEqual(session[USER_DATA_SESSION_KEY]['username'], 'shall')
+        with mock.patch('mtp_noms_ops.session.time') as mock_time, \
+                mock.patch('mtp_noms_ops.session.signing.dumps', wraps=signing.dumps) as mock_dumps:
+            mock_time.time.return_value = time.time() + settings.SESSION_RESIGN_INTERVAL
+            session.save()
+        mock_dumps.assert_called_once()
+
+    def test_unchanged_cookie_not_sent(self):
+        session_key = self.save_session([])
+
+        def view(request):
+            request.session.get(USER_DATA_SESSION_KEY)
+            if request.GET.get('modify'):
+                request.session['modified'] = True
+            return HttpResponse()
+
+        middleware = SessionMiddleware(view)
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+        response = middleware(request)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        request = RequestFactory().get('/', {'modify': '1'})
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+        response = middleware(request)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertNotEqual(response.cookies[settings.SESSION_COOKIE_NAME].value, session_key)
+
+
+class UserCapabilitiesTestCase(SimpleTestCase):
+    def make_request(self, permissions, prisons):
+        session = SessionStore()
+        session[USER_DATA_SESSION_KEY] = {'username': 'shall', 'permissions': permissions, 'prisons': prisons}
+        request = RequestFactory().get('/')
+        request.session = session
+        request.user = MojUser(1, generate_tokens(), session[USER_DATA_SESSION_KEY])
+        return request
+
+    def test_capabilities_evaluated_lazily_and_cached_in_session(self):
+        request = self.make_request(security_permissions, PRISONS)
+        with mock.patch('mtp_noms_ops.utils.can_manage_security_checks', return_value=False) as mock_check:
+            UserPermissionMiddleware.process_request(request)
+            mock_check.assert_not_called()
+            self.assertTrue(request.can_access_security)
+            self.assertTrue(request.can_pre_approve)
+            self.assertFalse(request.can_access_prisoner_location)
+            self.assertFalse(request.can_access_user_management)
+            self.assertFalse(request.can_manage_security_checks)
+            self.assertListEqual(list(request.user_prisons), PRISONS)
+
+            UserPermissionMiddleware.process_request(request)
+            self.assertTrue(request.can_access_security)
+            self.assertEqual(mock_check.call_count, 1)
+
+        self.assertEqual(
+            request.session[USER_CAPABILITIES_SESSION_KEY],
+            UserCapability.access_security | UserCapability.pre_approve,
+        )
+
+    def test_capabilities_recalculated_when_user_data_changes(self):
+        request = self.make_request(security_permissions, PRISONS[:1])
+        UserPermissionMiddleware.process_request(request)
+        self.assertFalse(request.can_pre_approve)
+
+        request.user.user_data['prisons'] = PRISONS
+        request.session[USER_DATA_SESSION_KEY] = request.user.user_data
+        self.assertNotIn(USER_CAPABILITIES_SESSION_KEY, request.session)
+        UserPermissionMiddleware.process_request(request)
+        self.assertTrue(request.can_pre_approve)
+
+    def test_anonymous_users_have_no_capabilities(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.user = MojAnonymousUser()
+        UserPermissionMiddleware.process_request(request)
+        self.assertFalse(request.can_access_security)
+        self.assertFalse(request.can_pre_approve)
+        self.assertFalse(request.user_prisons)
+        self.assertTrue(request.session.is_empty())
@@ -1,13 +1,16 @@
 from unittest import mock
 
 from django.test import SimpleTestCase
+from django.utils.translation import override as override_locale
 
 from security.templatetags.security import (
     extract_best_match,
     get_split_prison_names,
     search_highlight,
+    search_result_row_cache_key,
     setup_highlight,
 )
+from security.utils import SearchHighlighter
 
 
 class TestGetSplitPrisonNames(SimpleTestCase):
@@ -233,7 +236,7 @@ class TestSetupHighlight(SimpleTestCase):
 
     def test_caches_regex(self):
         """
-        Test that the compiled re is cached so that can be used in subsequent highlight calls.
+        Test that the search highlighter is cached so that can be used in subsequent highlight calls.
         """
         context = {
             'is_search_results': True,
@@ -245,7 +248,24 @@ class TestSetupHighlight(SimpleTestCase):
         }
         setup_highlight(context)
 
-        assert '_search_terms_re' in context
+        assert '_search_highlighter' in context
+
+    def test_uses_view_provided_highlighter(self):
+        """
+        Test that a search highlighter provided by the view is used instead of building a new one.
+        """
+        search_highlighter = SearchHighlighter('term')
+        context = {
+            'is_search_results': True,
+            'search_highlighter': search_highlighter,
+        }
+        setup_highlight(context)
+
+        self.assertIs(context['_search_highlighter'], search_highlighter)
+        self.assertEqual(
+            search_highlight(context, 'a term'),
+            'a <span class="mtp-search-highlight">term</span>',
+        )
 
 
 class TestExtractBestMatch(SimpleTestCase):
@@ -339,3 +359,27 @@ class TestExtractBestMatch(SimpleTestCase):
                 'total_remaining': 1,
             },
         )
+
+
+class TestSearchResultRowCacheKey(SimpleTestCase):
+    """
+    Tests for the search_result_row_cache_key template tag.
+    """
+
+    def test_varies_on_payload_search_terms_language_and_columns(self):
+        credit = {'id': 1, 'amount': 1000}
+        context = {
+            'is_search_results': True,
+            'form': mock.Mock(cleaned_data={'simple_search': 'term'}),
+        }
+        with override_locale('en-gb'):
+            key = search_result_row_cache_key(context, credit)
+            self.assertEqual(key, search_result_row_cache_key(context, dict(credit)))
+
+            self.assertNotEqual(key, search_result_row_cache_key(context, {'id': 2, 'amount': 1000}))
+            self.assertNotEqual(key, search_result_row_cache_key(context, {'id': 1, 'amount': 1001}))
+            self.assertNotEqual(key, search_result_row_cache_key({}, credit))
+            advanced_context = {**context, 'is_advanced_search_results': True}
+            self.assertNotEqual(key, search_result_row_cache_key(advanced_context, credit))
+        with override_locale('cy'):
+            self.assertNotEqual(key, search_result_row_cache_key(context, credit))
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.http import HttpResponse
+from django.template import engines
+from django.template.response import SimpleTemplateResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from mtp_noms_ops.timing import ServerTimingMiddleware, timed
+
+
+@override_settings(SERVER_TIMING_USERNAMES={'shall'}, SERVER_TIMING_LOG_THRESHOLD=0)
+class ServerTimingMiddlewareTestCase(SimpleTestCase):
+    def make_request(self, username):
+        request = RequestFactory().get('/')
+        request.user = mock.MagicMock(is_authenticated=True, username=username)
+        return request
+
+    def call_middleware(self, request, view):
+        # mimics Django's handling of template responses
+        middleware = ServerTimingMiddleware(None)
+
+        def get_response(request):
+            response = view(request)
+            if hasattr(response, 'render'):
+                response = middleware.process_template_response(request, response).render()
+            return response
+
+        middleware.get_response = get_response
+        return middleware(request)
+
+    def test_stages_timed(self):
+        @timed('stage')
+        def stage():
+            pass
+
+        def view(request):
+            stage()
+            stage()
+            with timed('other-stage'):
+                pass
+            template = engines['django'].from_string('{{ value }}')
+            return SimpleTemplateResponse(template, {'value': 1})
+
+        with self.assertLogs('mtp', level='INFO') as logs:
+            response = self.call_middleware(self.make_request('shall'), view)
+        stages = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertListEqual(stages, ['stage', 'other-stage', 'render', 'total'])
+
+        elk_fields = logs.records[0].elk_fields
+        self.assertEqual(elk_fields['@fields.timing_stage_count'], 2)
+        self.assertEqual(elk_fields['@fields.timing_other_stage_count'], 1)
+        self.assertEqual(elk_fields['@fields.timing_render_count'], 1)
+        self.assertIn('@fields.timing_total_ms', elk_fields)
+
+    def test_header_only_for_chosen_users(self):
+        with self.assertLogs('mtp', level='INFO'):
+            response = self.call_middleware(self.make_request('other'), lambda request: HttpResponse())
+        self.assertNotIn('Server-Timing', response)
+
+    def test_timing_outside_requests(self):
+        with timed('stage'):
+            pass
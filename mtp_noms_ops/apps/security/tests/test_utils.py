@@ -13,6 +13,7 @@ from security.utils import (
     EmailSet,
     remove_whitespaces_and_hyphens,
     get_need_attention_date,
+    SearchHighlighter,
 )
 
 
@@ -293,3 +294,30 @@ class ConvertDateFieldsTestCase(unittest.TestCase):
                 'received_at': 'invalid',
             }
         )
+
+
+class SearchHighlighterTestCase(unittest.TestCase):
+    def test_empty_search_term(self):
+        for search_term in (None, '', '   '):
+            self.assertFalse(SearchHighlighter(search_term))
+
+    def test_highlights_all_terms(self):
+        search_highlighter = SearchHighlighter('term1 term2 term1')
+        self.assertEqual(
+            search_highlighter.highlight('aTERM2 b&term1'),
+            'a<span class="mtp-search-highlight">TERM2</span> '
+            'b&amp;<span class="mtp-search-highlight">term1</span>',
+        )
+
+    def test_memoises_highlighted_values(self):
+        search_highlighter = SearchHighlighter('term')
+        with mock.patch.object(search_highlighter, 'search_terms_re', wraps=search_highlighter.search_terms_re) as re:
+            first = search_highlighter.highlight('a term')
+            second = search_highlighter.highlight('a term')
+        self.assertIs(first, second)
+        self.assertEqual(re.sub.call_count, 1)
+
+    def test_best_match(self):
+        search_highlighter = SearchHighlighter('<b>')
+        self.assertEqual(search_highlighter.best_match(['first', 'second <b>', 'third <b>']), 'second <b>')
+        self.assertIsNone(search_highlighter.best_match(['first', 'second']))
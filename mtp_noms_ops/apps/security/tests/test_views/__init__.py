@@ -16,6 +16,7 @@ from security import (
     required_permissions,
     provided_job_info_flag,
 )
+from security.nomis import nomis_circuit_breaker
 from security.tests import api_url
 
 SAMPLE_PRISONS = [
@@ -91,8 +92,14 @@ class SecurityBaseTestCase(SimpleTestCase):
         self.notifications_mock = mock.patch('mtp_common.templatetags.mtp_common.notifications_for_request',
                                              return_value=[])
         self.notifications_mock.start()
+        self.photo_cache_dir = tempfile.TemporaryDirectory()
+        self.photo_cache_settings = override_settings(NOMIS_PHOTO_CACHE_DIR=self.photo_cache_dir.name)
+        self.photo_cache_settings.enable()
+        nomis_circuit_breaker.reset()
 
     def tearDown(self):
+        self.photo_cache_settings.disable()
+        self.photo_cache_dir.cleanup()
         self.notifications_mock.stop()
         super().tearDown()
 
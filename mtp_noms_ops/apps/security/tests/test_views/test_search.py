@@ -11,6 +11,7 @@ from django.test import override_settings
 from django.urls import reverse
 from mtp_common.test_utils import silence_logger
 from mtp_common.test_utils.notify import NotifyMock, GOVUK_NOTIFY_TEST_API_KEY
+import requests
 import responses
 
 from security.forms.object_list import PrisonSelectorSearchFormMixin, PRISON_SELECTOR_USER_PRISONS_CHOICE_VALUE
@@ -150,7 +151,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             api_results = self.get_api_object_list_response_data()
             rsps.add(
                 rsps.GET,
@@ -170,7 +170,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             api_results = self.get_api_object_list_response_data()
             rsps.add(
                 rsps.GET,
@@ -185,6 +184,31 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
             )
         self._test_search_results_content(response, advanced=True)
 
+    def test_search_results_timed(self):
+        """
+        Test that stages of rendering search results are reported in the Server-Timing header to chosen users only
+        """
+        with responses.RequestsMock() as rsps:
+            self.login(rsps)
+            api_results = self.get_api_object_list_response_data()
+            rsps.add(
+                rsps.GET,
+                api_url(self.api_list_path),
+                json={
+                    'count': len(api_results),
+                    'results': api_results,
+                },
+            )
+            response = self.client.get(reverse(self.search_results_view_name))
+            self.assertNotIn('Server-Timing', response)
+            with override_settings(SERVER_TIMING_USERNAMES={'shall'}):
+                response = self.client.get(reverse(self.search_results_view_name))
+        stages = {
+            metric.split(';')[0]
+            for metric in response['Server-Timing'].split(', ')
+        }
+        self.assertLessEqual({'api', 'search-description', 'render', 'total'}, stages)
+
     def _test_search_results_content(self, response, advanced=False):
         """
         Subclass to test that the response content of the search results view is as expected.
@@ -201,8 +225,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
             user_data = self.get_user_data(prisons=SAMPLE_PRISONS)
             self.login(rsps, user_data=user_data)
 
-            mock_prison_response(rsps=rsps)
-
             mock_empty_response(rsps, self.api_list_path)
 
             response = self.client.get(reverse(self.view_name))
@@ -222,8 +244,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
             user_data = self.get_user_data(prisons=user_prisons)
             self.login(rsps, user_data=user_data)
 
-            mock_prison_response(rsps=rsps)
-
             mock_empty_response(rsps, self.api_list_path)
 
             url = (
@@ -248,8 +268,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         with responses.RequestsMock() as rsps:
             self.login(rsps)
 
-            mock_prison_response(rsps=rsps)
-
             mock_empty_response(rsps, self.api_list_path)
 
             url = (
@@ -303,8 +321,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         with responses.RequestsMock() as rsps:
             self.login(rsps)
 
-            mock_prison_response(rsps=rsps)
-
             mock_empty_response(rsps, self.api_list_path)
             query_string = (
                 f'prison_selector={PRISON_SELECTOR_USER_PRISONS_CHOICE_VALUE}'
@@ -327,8 +343,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         with responses.RequestsMock() as rsps:
             self.login(rsps)
 
-            mock_prison_response(rsps=rsps)
-
             mock_empty_response(rsps, self.api_list_path)
 
             query_string = (
@@ -352,7 +366,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             query_string = 'ordering=invalid&simple_search=test'
             request_url = f'{reverse(self.view_name)}?{query_string}&{SEARCH_FORM_SUBMITTED_INPUT_NAME}=1'
             response = self.client.get(request_url)
@@ -386,7 +399,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             mock_empty_response(rsps, self.api_list_path)
             query_string = f'ordering={self.search_ordering}&simple_search=test'
             request_url = f'{reverse(self.view_name)}?{query_string}'
@@ -400,7 +412,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             mock_empty_response(rsps, self.api_list_path)
 
             response = self.client.get(f'{reverse(self.search_results_view_name)}?simple_search=test')
@@ -429,7 +440,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
             user_data = self.get_user_data(prisons=None)
 
             self.login(rsps, user_data=user_data)
-            mock_prison_response(rsps=rsps)
             mock_empty_response(rsps, self.api_list_path)
             response = self.client.get(f'{reverse(self.search_results_view_name)}?simple_search=test')
 
@@ -454,7 +464,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             api_results = self.get_api_object_list_response_data()
             rsps.add(
                 rsps.GET,
@@ -489,7 +498,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
 
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             rsps.add(
                 rsps.GET,
                 api_url(self.api_list_path),
@@ -526,7 +534,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
 
         with NotifyMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             rsps.add(
                 rsps.GET,
                 api_url(self.api_list_path),
@@ -558,7 +565,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
 
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
 
             mock_empty_response(rsps, self.api_list_path)
 
@@ -582,7 +588,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
 
         with NotifyMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
 
             mock_empty_response(rsps, self.api_list_path)
 
@@ -620,7 +625,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
 
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             response = self.client.get(
                 f'{reverse(self.export_view_name)}?{qs}',
                 HTTP_REFERER=referer_url,
@@ -641,7 +645,6 @@ class AbstractSecurityViewTestCase(SecurityBaseTestCase):
 
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             response = self.client.get(
                 f'{reverse(self.export_email_view_name)}?{qs}',
                 HTTP_REFERER=referer_url,
@@ -818,7 +821,6 @@ class SenderViewsTestCase(AbstractSecurityViewTestCase):
         sender_id = 9
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             rsps.add(
                 rsps.GET,
                 api_url(self.api_list_path),
@@ -985,7 +987,6 @@ class PrisonerViewsTestCase(AbstractSecurityViewTestCase):
         prisoner_id = 9
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
             rsps.add(
                 rsps.GET,
                 api_url(self.api_list_path),
@@ -1058,6 +1059,73 @@ class PrisonerViewsTestCase(AbstractSecurityViewTestCase):
         )
         self.assertRedirects(response, '/static/images/placeholder-image.png', fetch_redirect_response=False)
 
+    @responses.activate
+    @mock.patch('security.views.nomis.can_access_nomis', mock.Mock(return_value=True))
+    @mock.patch('security.views.nomis.get_photograph_data')
+    def test_nomis_photo_cached(self, mock_get_photograph_data):
+        mock_get_photograph_data.return_value = TEST_IMAGE_DATA
+        self.login(responses, follow=False)
+        url = reverse(
+            'security:prisoner_image',
+            kwargs={'prisoner_number': self.prisoner_profile['prisoner_number']}
+        )
+        response = self.client.get(url)
+        self.assertContains(response, base64.b64decode(TEST_IMAGE_DATA))
+        etag = response['ETag']
+
+        response = self.client.get(url)
+        self.assertContains(response, base64.b64decode(TEST_IMAGE_DATA))
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(mock_get_photograph_data.call_count, 1)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(mock_get_photograph_data.call_count, 1)
+
+    @responses.activate
+    @mock.patch('security.views.nomis.can_access_nomis', mock.Mock(return_value=True))
+    @mock.patch('security.views.nomis.get_photograph_data')
+    @mock.patch('security.views.nomis.get_location')
+    @override_settings(NOMIS_CIRCUIT_BREAKER_FAILURES=2)
+    def test_nomis_lookups_stop_when_nomis_failing(self, mock_get_location, mock_get_photograph_data):
+        mock_get_photograph_data.side_effect = requests.Timeout
+        mock_get_location.side_effect = requests.Timeout
+        self.login(responses, follow=False)
+        prisoner_number = self.prisoner_profile['prisoner_number']
+        with silence_logger():
+            for _ in range(2):
+                response = self.client.get(
+                    reverse('security:prisoner_image', kwargs={'prisoner_number': prisoner_number}),
+                    {'ratio': '2x'},
+                )
+                self.assertRedirects(
+                    response, '/static/images/placeholder-image%402x.png', fetch_redirect_response=False,
+                )
+            response = self.client.get(
+                reverse('security:prisoner_nomis_info', kwargs={'prisoner_number': prisoner_number})
+            )
+        self.assertEqual(response.json(), {})
+        self.assertEqual(mock_get_photograph_data.call_count, 2)
+        mock_get_location.assert_not_called()
+
+    @responses.activate
+    @mock.patch('security.views.nomis.can_access_nomis', mock.Mock(return_value=True))
+    @mock.patch('security.views.nomis.get_location')
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_nomis_info_cached(self, mock_get_location):
+        mock_get_location.return_value = {
+            'nomis_id': 'BXI',
+            'name': 'HMP Brixton',
+            'housing_location': {'description': 'BXI-A-1-001', 'levels': []},
+        }
+        self.login(responses, follow=False)
+        url = reverse('security:prisoner_nomis_info', kwargs={'prisoner_number': 'A1409AA'})
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertDictEqual(response.json(), {'housing_location': 'BXI-A-1-001'})
+        self.assertEqual(mock_get_location.call_count, 1)
+
     @responses.activate
     def test_display_pinned_profile(self):
         self._add_prisoner_data_responses()
@@ -1379,7 +1447,6 @@ class CreditViewsTestCase(AbstractSecurityViewTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
 
             # get realistic referer
             qs = f'ordering={self.search_ordering}&advanced=True&' \
@@ -1658,7 +1725,6 @@ class DisbursementViewsTestCase(AbstractSecurityViewTestCase):
         """
         with responses.RequestsMock() as rsps:
             self.login(rsps)
-            mock_prison_response(rsps=rsps)
 
             # get realistic referer
             qs = f'ordering={self.search_ordering}&advanced=True&' \
@@ -5,10 +5,13 @@ import re
 
 from django.utils import timezone
 from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from mtp_common.auth import USER_DATA_SESSION_KEY
-from mtp_common.auth.api_client import get_api_session
 
+from mtp_noms_ops.api import get_api_session
+from mtp_noms_ops.timing import timed
 from security import hmpps_employee_flag, confirmed_prisons_flag, provided_job_info_flag
 
 logger = logging.getLogger('mtp')
@@ -30,6 +33,7 @@ def get_need_attention_date():
     return tomorrow - urgent_if_older_than
 
 
+@timed('convert-dates')
 def convert_date_fields(object_list, include_nested=False):
     """
     MTP API responds with string date/time fields, this filter converts them to python objects.
@@ -170,6 +174,67 @@ class EmailSet(OrderedSet):
         return (item or '').strip().lower()
 
 
+class SearchHighlighter:
+    """
+    Wraps words of a simple search term found in values with a span with class 'mtp-search-highlight'.
+    The matcher is compiled once per search and escaped/highlighted values are memoised
+    so that repeated values on a results page are only escaped and scanned once.
+
+    Matching is done on html-escaped values so that the output is always safe to render.
+    """
+    highlight_replacement = r'<span class="mtp-search-highlight">\1</span>'
+
+    def __init__(self, search_term):
+        search_terms = list(dict.fromkeys((search_term or '').split()))
+        if search_terms:
+            self.search_terms_re = re.compile(
+                f'({"|".join(re.escape(escape(term)) for term in search_terms)})',
+                re.I,
+            )
+        else:
+            self.search_terms_re = None
+        self._escaped_values = {}
+        self._highlighted_values = {}
+
+    @classmethod
+    def from_form(cls, form):
+        cleaned_data = getattr(form, 'cleaned_data', None) or {}
+        return cls(cleaned_data.get('simple_search'))
+
+    def __bool__(self):
+        return self.search_terms_re is not None
+
+    def _escape(self, value):
+        try:
+            return self._escaped_values[value]
+        except KeyError:
+            escaped_value = escape(value)
+            self._escaped_values[value] = escaped_value
+            return escaped_value
+
+    def highlight(self, value):
+        """
+        Returns the html-escaped `value` with all search terms highlighted
+        """
+        try:
+            return self._highlighted_values[value]
+        except KeyError:
+            highlighted_value = mark_safe(
+                self.search_terms_re.sub(self.highlight_replacement, self._escape(value))
+            )
+            self._highlighted_values[value] = highlighted_value
+            return highlighted_value
+
+    def matches(self, value):
+        return self.search_terms_re.search(self._escape(value)) is not None
+
+    def best_match(self, items):
+        """
+        Returns the first item that contains a search term or None
+        """
+        return next(filter(self.matches, items), None)
+
+
 def can_choose_prisons(user):
     has_only_security_roles = user.user_data['roles'] == ['security']
     is_user_admin = user.has_perm('auth.change_user')
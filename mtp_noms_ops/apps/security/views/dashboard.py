@@ -4,9 +4,9 @@ from django.conf import settings
 from django.urls import reverse
 from django.utils.translation import gettext, ngettext
 from django.views.generic import TemplateView
-from mtp_common.auth.api_client import get_api_session
 from requests.exceptions import RequestException
 
+from mtp_noms_ops.api import get_api_session
 from security.context_processors import initial_params
 from security.searches import get_saved_searches, populate_new_result_counts
 
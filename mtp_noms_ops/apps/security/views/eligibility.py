@@ -4,8 +4,8 @@ from django.urls import reverse, reverse_lazy
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import FormView, TemplateView
-from mtp_common.auth.api_client import get_api_session
 
+from mtp_noms_ops.api import get_api_session
 from security import hmpps_employee_flag, not_hmpps_employee_flag
 from security.forms.eligibility import HMPPSEmployeeForm
 from security.utils import save_user_flags
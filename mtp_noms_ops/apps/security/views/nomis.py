@@ -1,50 +1,62 @@
 import base64
-import logging
 
+from django.conf import settings
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
-from django.utils.cache import patch_cache_control
+from django.utils.cache import get_conditional_response, patch_cache_control
 from mtp_common.nomis import can_access_nomis, get_photograph_data, get_location
-from requests.exceptions import RequestException
 
-
-logger = logging.getLogger('mtp')
+from security.nomis import lookup_prisoner
+from security.photos import PrisonerPhotoCache
 
 
 def prisoner_image_view(request, prisoner_number):
     if can_access_nomis() and prisoner_number:
-        try:
-            b64data = get_photograph_data(prisoner_number)
+        photo_cache = PrisonerPhotoCache()
+        photo = photo_cache.get(prisoner_number)
+        if photo is None:
+            b64data = lookup_prisoner('image', get_photograph_data, prisoner_number)
             if b64data:
-                response = HttpResponse(
-                    base64.b64decode(b64data), content_type='image/jpeg'
-                )
-                patch_cache_control(response, private=True, max_age=2592000)
-                return response
-        except RequestException:
-            logger.warning('Could not load image for %(prisoner_number)s', {'prisoner_number': prisoner_number})
+                photo = photo_cache.put(prisoner_number, base64.b64decode(b64data))
+        if photo:
+            response = get_conditional_response(request, etag=photo.etag)
+            if response is None:
+                response = HttpResponse(photo.data, content_type='image/jpeg')
+            response['ETag'] = photo.etag
+            patch_cache_control(response, private=True, max_age=2592000)
+            return response
     if request.GET.get('ratio') == '2x':
         return HttpResponseRedirect(staticfiles_storage.url('images/placeholder-image@2x.png'))
     else:
         return HttpResponseRedirect(staticfiles_storage.url('images/placeholder-image.png'))
 
 
+def get_housing_location(prisoner_number, session=None):
+    location = get_location(prisoner_number, session=session)
+    if not location or 'housing_location' not in location:
+        return None
+    housing = location['housing_location']
+    if housing['levels']:
+        # effectively drops prison code prefix from description
+        return '-'.join(
+            level['value'] for level in housing['levels']
+        )
+    return housing['description']
+
+
+def lookup_housing_location(prisoner_number):
+    return lookup_prisoner(
+        'location', get_housing_location, prisoner_number,
+        cache_timeout=settings.NOMIS_LOCATION_CACHE_TIMEOUT,
+    )
+
+
 def prisoner_nomis_info_view(request, prisoner_number):
     response_data = {}
     if can_access_nomis() and prisoner_number:
-        try:
-            location = get_location(prisoner_number)
-            if 'housing_location' in location:
-                housing = location['housing_location']
-                if housing['levels']:
-                    # effectively drops prison code prefix from description
-                    response_data['housing_location'] = '-'.join(
-                        level['value'] for level in housing['levels']
-                    )
-                else:
-                    response_data['housing_location'] = housing['description']
-        except RequestException:
-            logger.warning('Could not load location for %(prisoner_number)s', {'prisoner_number': prisoner_number})
+        housing_location = lookup_housing_location(prisoner_number)
+        if housing_location:
+            response_data['housing_location'] = housing_location
     response = JsonResponse(response_data)
     patch_cache_control(response, private=True, max_age=3600)
     return response
@@ -13,10 +13,11 @@ from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import FormView, TemplateView
 from mtp_common.analytics import genericised_pageview
-from mtp_common.auth.api_client import get_api_session
 from mtp_common.auth.exceptions import HttpNotFoundError
 from requests.exceptions import RequestException
 
+from mtp_noms_ops.api import get_api_session
+from mtp_noms_ops.timing import timed
 from security.context_processors import initial_params
 from security.export import ObjectListXlsxResponse
 from security.tasks import email_export_xlsx
@@ -157,6 +158,7 @@ class SecurityView(FormView):
                     endpoint_path=form.get_object_list_endpoint_path(),
                     filters=form.get_api_request_params(),
                     export_description=self.get_export_description(form),
+                    keyset=form.get_keyset_ordering(),
                 )
                 messages.info(
                     self.request,
@@ -184,7 +186,8 @@ class SecurityView(FormView):
             context['objects'] = object_list
         else:
             context = self.get_context_data(form=form)
-        return render(self.request, self.get_template_names(), context)
+        with timed('render'):
+            return render(self.request, self.get_template_names(), context)
 
     def form_invalid(self, form):
         """
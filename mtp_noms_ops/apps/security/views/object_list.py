@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
@@ -8,6 +9,7 @@ from security.forms.object_list import (
     DisbursementsForm,
     NotificationsForm,
 )
+from security.utils import SearchHighlighter
 from security.views.object_base import SecurityView, ViewType
 
 
@@ -41,6 +43,8 @@ class SecuritySearchView(SecurityView):
             'is_advanced_search_results': is_search_results and form.was_advanced_search_used(),
             'is_all_prisons_simple_search_results': is_search_results and form.was_all_prisons_simple_search_used(),
             'all_prisons_simple_search_link': all_prisons_simple_search_link,
+            'search_highlighter': SearchHighlighter.from_form(form) if is_search_results else None,
+            'row_cache_timeout': settings.SEARCH_RESULT_ROW_CACHE_TIMEOUT,
         }
 
 
@@ -7,9 +7,9 @@ from django.urls import reverse, reverse_lazy
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import FormView, TemplateView
-from mtp_common.auth.api_client import get_api_session
 from mtp_common.views import SettingsView
 
+from mtp_noms_ops.api import get_api_session
 from security import confirmed_prisons_flag, provided_job_info_flag
 from settings.forms import ConfirmPrisonForm, ChangePrisonForm, ALL_PRISONS_CODE, JobInformationForm
 from security.models import EmailNotifications
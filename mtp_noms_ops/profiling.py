@@ -0,0 +1,137 @@
+import collections
+import contextlib
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from mtp_noms_ops.timing import ServerTimingMiddleware
+
+logger = logging.getLogger('mtp')
+
+
+class StackSampler:
+    """
+    Samples the call stack of one thread at regular intervals from a background thread,
+    counting identical stacks so that they can be saved in collapsed-stack format for flame graphs
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} thread {self.thread_id} ({self.sample_count} samples)>'
+
+    @property
+    def sample_count(self):
+        return sum(self.stacks.values())
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}")
+            frame = frame.f_back
+        if stack:
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class SamplingProfilerMiddleware:
+    """
+    Profiles a random settings.PROFILING_SAMPLE_RATE fraction of requests and those with a `profile` query flag
+    from users shown server timings, saving collapsed stacks in settings.PROFILING_DIR.
+    Only the latest settings.PROFILING_MAX_FILES profiles are kept.
+    Not used at all unless settings.PROFILING_ENABLED is set.
+    """
+    query_flag = 'profile'
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        self.save_profile(request, sampler)
+        return response
+
+    @classmethod
+    def should_profile(cls, request):
+        if request.GET.get(cls.query_flag) and ServerTimingMiddleware.should_show_timings(request):
+            return True
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    @classmethod
+    def save_profile(cls, request, sampler):
+        view_name = getattr(getattr(request, 'resolver_match', None), 'view_name', None) or 'unnamed'
+        file_name = '%s-%s-%s.folded' % (
+            time.strftime('%Y%m%d-%H%M%S'),
+            re.sub(r'[^\w-]+', '-', view_name),
+            uuid.uuid4().hex[:8],
+        )
+        profile_dir = get_profile_dir()
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, file_name)
+            sampler.save(path)
+            delete_old_profiles(profile_dir)
+        except OSError:
+            logger.exception('Profile of %(view)s could not be saved', {'view': view_name})
+            return
+        logger.info(
+            'Profile of %(view)s with %(samples)d samples saved to %(path)s',
+            {'view': view_name, 'samples': sampler.sample_count, 'path': path},
+        )
+
+
+def get_profile_dir():
+    return settings.PROFILING_DIR or os.path.join(tempfile.gettempdir(), 'mtp-profiles')
+
+
+def delete_old_profiles(profile_dir):
+    profiles = []
+    for entry in os.scandir(profile_dir):
+        if entry.name.endswith('.folded'):
+            with contextlib.suppress(FileNotFoundError):
+                profiles.append((entry.stat().st_mtime, entry.path))
+    profiles.sort(reverse=True)
+    for _, path in profiles[settings.PROFILING_MAX_FILES:]:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
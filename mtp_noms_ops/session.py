@@ -0,0 +1,130 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends import signed_cookies
+from django.contrib.sessions.middleware import SessionMiddleware as DjangoSessionMiddleware
+from django.core import signing
+from django.core.cache import cache
+from mtp_common.auth import USER_DATA_SESSION_KEY
+
+from security.models import PrisonList
+
+# derived from user data so removed whenever that changes
+USER_CAPABILITIES_SESSION_KEY = '_user_capabilities'
+
+
+class SessionStore(signed_cookies.SessionStore):
+    """
+    Stores prisons in user data as NOMIS ids when they match the shared prison list cache,
+    rehydrating them when the session is loaded. If the cache does not have them, the ids are left in place
+    until `expand_prisons` loads the prison list with the request's API session.
+    An unmodified session is only re-signed, extending its expiry, once its signature is
+    settings.SESSION_RESIGN_INTERVAL seconds old.
+    """
+    salt = 'django.contrib.sessions.backends.signed_cookies'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self.signed_at = None
+
+    def __setitem__(self, key, value):
+        if key == USER_DATA_SESSION_KEY:
+            self._session.pop(USER_CAPABILITIES_SESSION_KEY, None)
+        super().__setitem__(key, value)
+
+    def load(self):
+        try:
+            session_data = signing.loads(
+                self.session_key,
+                serializer=self.serializer,
+                max_age=self.get_session_cookie_age(),
+                salt=self.salt,
+            )
+            self.signed_at = signing.b62_decode(self.session_key.rsplit(':', 2)[1])
+        except Exception:
+            # as in signed_cookies.SessionStore, any problem resets the session
+            self.create()
+            return {}
+        return self.expand_user_data(session_data)
+
+    def save(self, must_create=False):
+        if (
+            not self.modified and self.signed_at is not None
+            and time.time() - self.signed_at < settings.SESSION_RESIGN_INTERVAL
+        ):
+            # existing cookie is still valid
+            return
+        super().save(must_create=must_create)
+
+    def _get_session_key(self):
+        return signing.dumps(
+            self.compact_user_data(self._session),
+            compress=True,
+            salt=self.salt,
+            serializer=self.serializer,
+        )
+
+    @classmethod
+    def compact_user_data(cls, session_data):
+        user_data = session_data.get(USER_DATA_SESSION_KEY)
+        if not user_data or not user_data.get('prisons'):
+            return session_data
+        cached_prisons = cache.get('PrisonList')
+        if not cached_prisons:
+            return session_data
+        cached_prisons = {prison['nomis_id']: prison for prison in cached_prisons}
+        prisons = [
+            prison['nomis_id'] if isinstance(prison, dict) and cached_prisons.get(prison['nomis_id']) == prison
+            else prison
+            for prison in user_data['prisons']
+        ]
+        return {
+            **session_data,
+            USER_DATA_SESSION_KEY: {**user_data, 'prisons': prisons},
+        }
+
+    @classmethod
+    def expand_user_data(cls, session_data):
+        """
+        Replaces prison ids in user data with prisons from the shared cache if it has all of them
+        """
+        user_data = session_data.get(USER_DATA_SESSION_KEY)
+        if not cls.has_prison_ids(user_data):
+            return session_data
+        cached_prisons = {prison['nomis_id']: prison for prison in cache.get('PrisonList') or []}
+        if not all(prison in cached_prisons for prison in user_data['prisons'] if isinstance(prison, str)):
+            # session loading must not call the API so these are loaded by `expand_prisons` later
+            return session_data
+        user_data['prisons'] = [
+            cached_prisons[prison] if isinstance(prison, str) else prison
+            for prison in user_data['prisons']
+        ]
+        return session_data
+
+    @classmethod
+    def has_prison_ids(cls, user_data):
+        return bool(user_data) and any(isinstance(prison, str) for prison in user_data.get('prisons') or [])
+
+    def expand_prisons(self, api_session):
+        """
+        Loads the prison list into the shared cache if user data still has prison ids that it did not have
+        when the session was loaded
+        """
+        if not self.has_prison_ids(self.get(USER_DATA_SESSION_KEY)):
+            return
+        PrisonList.get_prisons(api_session)
+        self.expand_user_data(self._session)
+
+
+class SessionMiddleware(DjangoSessionMiddleware):
+    """
+    Does not send the session cookie back if it has not changed
+    """
+
+    def process_response(self, request, response):
+        response = super().process_response(request, response)
+        cookie_name = settings.SESSION_COOKIE_NAME
+        cookie = response.cookies.get(cookie_name)
+        if cookie is not None and cookie.value and cookie.value == request.COOKIES.get(cookie_name):
+            del response.cookies[cookie_name]
+        return response
@@ -83,11 +83,15 @@ WSGI_APPLICATION = 'mtp_noms_ops.wsgi.application'
 ROOT_URLCONF = 'mtp_noms_ops.urls'
 MIDDLEWARE = (
     'mtp_common.metrics.middleware.RequestMetricsMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'mtp_noms_ops.api_metrics.ApiCallMetricsMiddleware',
+    'mtp_noms_ops.timing.ServerTimingMiddleware',
+    'mtp_noms_ops.session.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'mtp_common.auth.csrf.CsrfViewMiddleware',
     'mtp_common.auth.middleware.AuthenticationMiddleware',
+    'mtp_noms_ops.utils.ApiSessionMiddleware',
+    'mtp_noms_ops.profiling.SamplingProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -115,6 +119,17 @@ AUTODISCOVER_HEALTHCHECKS = True
 METRICS_USER = os.environ.get('METRICS_USER', 'prom')
 METRICS_PASS = os.environ.get('METRICS_PASS', 'prom')
 
+# users shown a Server-Timing header (everyone is in DEBUG mode) and requests slower than this many seconds are logged
+SERVER_TIMING_USERNAMES = set(filter(None, os.environ.get('SERVER_TIMING_USERNAMES', '').split(',')))
+SERVER_TIMING_LOG_THRESHOLD = float(os.environ.get('SERVER_TIMING_LOG_THRESHOLD', '2'))
+# sampling profiler for a fraction of requests or those with a `profile` query flag from users above
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL = 0.005  # seconds
+# collapsed-stack profiles are saved here (system temporary directory by default)
+PROFILING_DIR = os.environ.get('PROFILING_DIR', '')
+PROFILING_MAX_FILES = int(os.environ.get('PROFILING_MAX_FILES', '50'))
+
 # security tightening
 # some overridden in prod/docker settings where SSL is ensured
 SECURE_CONTENT_TYPE_NOSNIFF = True
@@ -132,7 +147,13 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'mtp',
-    }
+    },
+    # used by the `cache` template tag, e.g. for search result rows
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mtp-template-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
 }
 
 
@@ -253,7 +274,7 @@ if os.environ.get('SENTRY_DSN'):
 TEST_RUNNER = 'mtp_common.test_utils.runner.TestRunner'
 
 # authentication
-SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+SESSION_ENGINE = 'mtp_noms_ops.session'
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 AUTHENTICATION_BACKENDS = (
     'mtp_common.auth.backends.MojBackend',
@@ -263,11 +284,18 @@ AUTHENTICATION_BACKENDS = (
 # control the time a session exists for; should match api's access token expiry
 SESSION_COOKIE_AGE = 60 * 60  # 1 hour
 SESSION_SAVE_EVERY_REQUEST = True
+# unchanged sessions are only re-signed (extending their expiry) once their signature is this old
+SESSION_RESIGN_INTERVAL = 5 * 60
 
 
 API_CLIENT_ID = 'noms-ops'
 API_CLIENT_SECRET = os.environ.get('API_CLIENT_SECRET', 'noms-ops')
 API_URL = os.environ.get('API_URL', 'http://localhost:8000')
+# connections to mtp-api kept alive per process; extra connections are opened and discarded unless blocking
+API_CONNECTION_POOL_SIZE = int(os.environ.get('API_CONNECTION_POOL_SIZE', '10'))
+API_CONNECTION_POOL_BLOCK = os.environ.get('API_CONNECTION_POOL_BLOCK', 'False') == 'True'
+API_REQUEST_RETRIES = int(os.environ.get('API_REQUEST_RETRIES', '2'))  # only for idempotent requests
+API_SESSION_MEMO_SIZE = 32  # responses to repeated GETs remembered while handling a request
 
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'root'
@@ -293,8 +321,17 @@ FOOTER_FEEDBACK_LINK = os.environ.get('FOOTER_FEEDBACK_LINK', None)
 
 REQUEST_PAGE_SIZE = 500
 UPLOAD_REQUEST_PAGE_SIZE = 3000
+UPLOAD_REQUEST_CONCURRENCY = int(os.environ.get('UPLOAD_REQUEST_CONCURRENCY', '4'))
+UPLOAD_REQUEST_RETRIES = 3
+UPLOAD_REQUEST_RETRY_BACKOFF = 2  # seconds, doubled after each retry
 MAX_CREDITS_TO_DOWNLOAD = 2000
 MAX_CREDITS_TO_EMAIL = 20000
+SEARCH_RESULT_ROW_CACHE_TIMEOUT = int(os.environ.get('SEARCH_RESULT_ROW_CACHE_TIMEOUT', '300'))
+# page credits and disbursements by date rather than offset where ordered by date
+SECURITY_KEYSET_PAGINATION = os.environ.get('SECURITY_KEYSET_PAGINATION', 'False') == 'True'
+SECURITY_KEYSET_CURSOR_TIMEOUT = 30 * 60  # seconds
+# how long an exact count is shown, as approximate, for pages loaded by keyset
+SECURITY_COUNT_CACHE_TIMEOUT = int(os.environ.get('SECURITY_COUNT_CACHE_TIMEOUT', '300'))
 
 GOVUK_NOTIFY_API_KEY = os.environ.get('GOVUK_NOTIFY_API_KEY', '')
 GOVUK_NOTIFY_REPLY_TO_PUBLIC = os.environ.get('GOVUK_NOTIFY_REPLY_TO_PUBLIC', '')
@@ -306,6 +343,19 @@ EMAIL_BACKEND = 'mtp_common.notify.email_backend.NotifyEmailBackend'
 LOCATION_UPLOADER_USERNAME = os.environ.get('LOCATION_UPLOADER_USERNAME', 'prisoner-location-admin')
 LOCATION_UPLOADER_PASSWORD = os.environ.get('LOCATION_UPLOADER_PASSWORD', 'prisoner-location-admin')
 
+# uploaded prisoner locations are spooled to disk here (system temporary directory by default)
+# so must be readable by uWSGI spooler processes
+LOCATION_UPLOAD_SPOOL_DIR = os.environ.get('LOCATION_UPLOAD_SPOOL_DIR') or None
+# when enabled, the last successful location upload is kept at LOCATION_UPLOAD_SNAPSHOT_PATH
+# so that later uploads need only send changes; this needs mtp-api to support differential updates
+# and must only be enabled where every upload is made from the instance holding the snapshot
+# as it is not compared with locations in mtp-api
+LOCATION_UPLOAD_DIFFERENTIAL = os.environ.get('LOCATION_UPLOAD_DIFFERENTIAL', 'False') == 'True'
+LOCATION_UPLOAD_SNAPSHOT_PATH = os.environ.get('LOCATION_UPLOAD_SNAPSHOT_PATH') or None
+LOCATION_UPLOAD_SNAPSHOT_MAX_AGE = 2 * 24 * 60 * 60  # seconds
+LOCATION_UPLOAD_DIFFERENTIAL_LIMIT = 0.5  # proportion of locations changed above which all are uploaded
+# reports of rows that could not be uploaded are kept in the cache for users to download
+LOCATION_UPLOAD_REPORT_MAX_AGE = 24 * 60 * 60  # seconds
 ASYNC_LOCATION_UPLOAD = os.environ.get('ASYNC_LOCATION_UPLOAD', 'True') == 'True'
 SHOW_LANGUAGE_SWITCH = os.environ.get('SHOW_LANGUAGE_SWITCH', 'False') == 'True'
 
@@ -313,7 +363,29 @@ HMPPS_CLIENT_ID = os.environ.get('HMPPS_CLIENT_ID', 'prisoner-money')
 HMPPS_CLIENT_SECRET = os.environ.get('HMPPS_CLIENT_SECRET', '')
 HMPPS_AUTH_BASE_URL = os.environ.get('HMPPS_AUTH_BASE_URL', '')
 HMPPS_PRISON_API_BASE_URL = os.environ.get('HMPPS_PRISON_API_BASE_URL', '')
+# decoded prisoner photos from NOMIS are cached here (a directory in system temporary directory by default)
+NOMIS_PHOTO_CACHE_DIR = os.environ.get('NOMIS_PHOTO_CACHE_DIR') or None
+NOMIS_PHOTO_CACHE_MAX_SIZE = int(os.environ.get('NOMIS_PHOTO_CACHE_MAX_SIZE', str(200 * 1024 * 1024)))  # bytes
+NOMIS_PHOTO_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+NOMIS_PHOTO_CACHE_SWEEP_INTERVAL = 10 * 60  # seconds between scans for photos to evict
+# NOMIS lookups for prisoner photos and locations that find nothing are not repeated for this long
+NOMIS_NEGATIVE_CACHE_TIMEOUT = 60 * 60  # seconds
+# NOMIS lookups stop for a while after this many consecutive failures
+NOMIS_CIRCUIT_BREAKER_FAILURES = 5
+NOMIS_CIRCUIT_BREAKER_RESET_TIMEOUT = 30  # seconds
+# prisoner housing locations from NOMIS are shared between requests for this long
+NOMIS_LOCATION_CACHE_TIMEOUT = 5 * 60  # seconds
 HMPPS_OFFENDER_SEARCH_BASE_URL = os.environ.get('HMPPS_OFFENDER_SEARCH_BASE_URL', '')
+OFFENDER_SEARCH_CONCURRENCY = int(os.environ.get('OFFENDER_SEARCH_CONCURRENCY', '4'))
+OFFENDER_SEARCH_RETRIES = 2
+OFFENDER_SEARCH_RETRY_BACKOFF = 1  # seconds, doubled after each retry
+# when enabled, every location load saves its progress so that a failed one can be rerun with --resume
+LOCATION_LOAD_CHECKPOINT = os.environ.get('LOCATION_LOAD_CHECKPOINT', 'False') == 'True'
+# progress of loading locations from offender search is saved here (system temporary directory by default)
+LOCATION_LOAD_CHECKPOINT_DIR = os.environ.get('LOCATION_LOAD_CHECKPOINT_DIR') or None
+LOCATION_LOAD_CHECKPOINT_MAX_AGE = 6 * 60 * 60  # seconds
+# timings of the latest location load and upload are saved here to be exposed as metrics by any process
+LOCATION_LOAD_STATS_DIR = os.environ.get('LOCATION_LOAD_STATS_DIR') or None
 
 TOKEN_RETRIEVAL_USERNAME = os.environ.get('TOKEN_RETRIEVAL_USERNAME', '_token_retrieval')
 TOKEN_RETRIEVAL_PASSWORD = os.environ.get('TOKEN_RETRIEVAL_PASSWORD', '_token_retrieval')
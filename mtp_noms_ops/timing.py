@@ -0,0 +1,128 @@
+import collections
+import contextlib
+import contextvars
+import logging
+import threading
+from time import perf_counter
+
+from django.conf import settings
+
+logger = logging.getLogger('mtp')
+
+# timings of the Django request currently being handled
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Total durations of named stages of handling one request, e.g. calling the API or rendering templates.
+    Stages can overlap and run more than once, in which case their durations are summed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = collections.defaultdict(float)
+        self.counts = collections.Counter()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {dict(self.seconds)}>'
+
+    def add(self, name: str, seconds: float):
+        with self.lock:
+            self.seconds[name] += seconds
+            self.counts[name] += 1
+
+    def server_timing(self, total_seconds: float) -> str:
+        """
+        Returns a Server-Timing header value with durations in milliseconds
+        """
+        metrics = [
+            f'{name};dur={seconds * 1000:.1f}'
+            for name, seconds in self.seconds.items()
+        ]
+        metrics.append(f'total;dur={total_seconds * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def elk_fields(self, total_seconds: float) -> dict:
+        fields = {'@fields.timing_total_ms': round(total_seconds * 1000, 1)}
+        for name, seconds in sorted(self.seconds.items()):
+            field_name = name.replace('-', '_')
+            fields[f'@fields.timing_{field_name}_ms'] = round(seconds * 1000, 1)
+            fields[f'@fields.timing_{field_name}_count'] = self.counts[name]
+        return fields
+
+
+def record_timing(name: str, seconds: float):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextlib.contextmanager
+def timed(name: str):
+    """
+    Times a stage of handling the current request; can also be used as a function decorator
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, perf_counter() - started)
+
+
+class ServerTimingMiddleware:
+    """
+    Times stages of handling each request, adding a Server-Timing header for users in
+    settings.SERVER_TIMING_USERNAMES (or everyone in DEBUG mode) so that browser developer tools show
+    where time went, and logging timings of requests slower than settings.SERVER_TIMING_LOG_THRESHOLD seconds.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total_seconds = perf_counter() - started
+
+        if self.should_show_timings(request):
+            response['Server-Timing'] = timings.server_timing(total_seconds)
+        if total_seconds >= settings.SERVER_TIMING_LOG_THRESHOLD:
+            view_name = getattr(getattr(request, 'resolver_match', None), 'view_name', None) or '<unnamed view>'
+            logger.info(
+                '%(method)s %(view)s took %(milliseconds)dms',
+                {'method': request.method, 'view': view_name, 'milliseconds': total_seconds * 1000},
+                extra={'elk_fields': {
+                    '@fields.view': view_name,
+                    '@fields.status': response.status_code,
+                    **timings.elk_fields(total_seconds),
+                }},
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        timings = current_timings.get()
+        if timings is not None:
+            started = perf_counter()
+
+            def record_rendering(_):
+                timings.add('render', perf_counter() - started)
+
+            response.add_post_render_callback(record_rendering)
+        return response
+
+    @classmethod
+    def should_show_timings(cls, request):
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_authenticated and user.username in settings.SERVER_TIMING_USERNAMES)
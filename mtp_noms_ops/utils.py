@@ -1,26 +1,89 @@
+import enum
+from functools import partial
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required, permission_required
 from django.urls import reverse, reverse_lazy
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import gettext_lazy as _
 
+from mtp_noms_ops.api import create_api_session
+from mtp_noms_ops.session import USER_CAPABILITIES_SESSION_KEY
+
 from prisoner_location_admin import required_permissions as prisoner_location_permissions
 from security import required_permissions as security_permissions
 from security.utils import can_manage_security_checks
 
 
+class UserCapability(enum.IntFlag):
+    access_prisoner_location = enum.auto()
+    access_security = enum.auto()
+    access_user_management = enum.auto()
+    pre_approve = enum.auto()
+    manage_security_checks = enum.auto()
+
+
+def get_user_capabilities(request):
+    """
+    Returns what the user can access, computed once for each change of user data and cached in the session
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return UserCapability(0)
+    capabilities = request.session.get(USER_CAPABILITIES_SESSION_KEY)
+    if capabilities is not None:
+        return UserCapability(capabilities)
+
+    capabilities = UserCapability(0)
+    if user.has_perms(prisoner_location_permissions):
+        capabilities |= UserCapability.access_prisoner_location
+    if user.has_perms(security_permissions):
+        capabilities |= UserCapability.access_security
+    if user.has_perm('auth.change_user'):
+        capabilities |= UserCapability.access_user_management
+    if any(prison['pre_approval_required'] for prison in user.user_data.get('prisons') or []):
+        capabilities |= UserCapability.pre_approve
+    if can_manage_security_checks(user):
+        capabilities |= UserCapability.manage_security_checks
+    request.session[USER_CAPABILITIES_SESSION_KEY] = int(capabilities)
+    return capabilities
+
+
 class UserPermissionMiddleware(MiddlewareMixin):
+    """
+    Adds attributes describing what the user can access to the request;
+    these are only evaluated when used so that views which do not need them do not load the user
+    """
+
+    @classmethod
+    def process_request(cls, request):
+        capabilities = SimpleLazyObject(partial(get_user_capabilities, request))
+
+        def has_capability(capability):
+            return SimpleLazyObject(lambda: capability in capabilities)
+
+        request.user_prisons = SimpleLazyObject(lambda: request.user.user_data.get('prisons') or [])
+        request.can_access_prisoner_location = has_capability(UserCapability.access_prisoner_location)
+        request.can_access_security = has_capability(UserCapability.access_security)
+        request.can_access_user_management = has_capability(UserCapability.access_user_management)
+        request.can_pre_approve = has_capability(UserCapability.pre_approve)
+        request.can_manage_security_checks = has_capability(UserCapability.manage_security_checks)
+
+
+class ApiSessionMiddleware(MiddlewareMixin):
+    """
+    Attaches one API session to each request, created when first used,
+    so that forms and views share connections and responses to identical GET requests.
+    Prisons in user data that could not be loaded with the session are loaded using it.
+    """
+
     @classmethod
     def process_request(cls, request):
-        request.user_prisons = request.user.user_data.get('prisons') or []
-        request.can_access_prisoner_location = request.user.has_perms(prisoner_location_permissions)
-        request.can_access_security = request.user.has_perms(security_permissions)
-        request.can_access_user_management = request.user.has_perm('auth.change_user')
-        request.can_pre_approve = request.user.is_authenticated and any(
-            prison['pre_approval_required']
-            for prison in request.user_prisons
-        )
-        request.can_manage_security_checks = can_manage_security_checks(request.user)
+        request.api_session = SimpleLazyObject(partial(create_api_session, request))
+        expand_prisons = getattr(request.session, 'expand_prisons', None)
+        if expand_prisons:
+            expand_prisons(request.api_session)
 
 
 class SecurityMiddleware(MiddlewareMixin):